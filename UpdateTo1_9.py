@@ -3,6 +3,10 @@
 MCEdit filter used to update Minecraft commands from 1.7 or 1.8 format to 1.9 format
 """
 
+import glob
+import io
+import json
+import os
 import string
 
 from filterutils import *
@@ -15,6 +19,12 @@ KEEP_SAY = 0
 SAY_TO_TEXT = 1
 SAY_TO_TRANSLATE = 2
 
+WORKERS_OPTION = u'Worker Processes'
+INCREMENTAL_OPTION = u'Skip Unchanged Chunks'
+DRY_RUN_OPTION = u'Dry Run Diff File'
+TIMINGS_OPTION = u'Print Timings'
+SHARE_SUBTREES_OPTION = u'Share Identical Subtrees'
+
 
 class CommandPatternFormatter(string.Formatter):
     """
@@ -41,16 +51,287 @@ class CommandPatternFormatter(string.Formatter):
         'line': r'.*',
     }
 
+    # The placeholders matched as balanced spans when they aren't at the end of the pattern
+    SPAN_KINDS = {'nbt', 'json'}
+
+    # The placeholders that have to be at the end of the pattern to be matched without a regex
+    REST_KINDS = {'cmd', 'line'}
+
+    # The characters that make a word of a pattern a regex
+    REGEX_CHARS = set(u'\\.^$*+?()[]{}|')
+
+    @classmethod
+    def placeholder_kind(cls, key):
+        """
+        The entry of DEFAULT_DICT used for a placeholder, None for the ones that match a single word
+
+        >>> CommandPatternFormatter.placeholder_kind(u'pos1')
+        'pos'
+        >>> CommandPatternFormatter.placeholder_kind(u'sel') is None
+        True
+        """
+        for start in cls.DEFAULT_DICT:
+            if key.lower().startswith(start):
+                return start
+
+        return None
+
     def get_value(self, key, args, kwargs):
         try:
             super(CommandPatternFormatter, self).get_value(key=key, args=args, kwargs=kwargs)
         except (IndexError, KeyError):
-            prefix = '(?P<' + key + '>'
-            for start, value in self.DEFAULT_DICT.iteritems():
-                if key.lower().startswith(start):
-                    return prefix + value + ')'
+            kind = self.placeholder_kind(key)
+            return '(?P<' + key + '>' + (r'\S+' if kind is None else self.DEFAULT_DICT[kind]) + ')'
+
+    def token_steps(self, format_string):
+        """
+        Split a pattern in the steps of a TokenPattern
+
+        Each word of the pattern is a step. The words that glue a text to word placeholders, or that are a word
+        placeholder at the start of the pattern, are matched by a regex against a single word of the command
+
+        >>> c = CommandPatternFormatter()
+        >>> c.token_steps(u'/testfor {sel} {nbt}')
+        [(u'/testfor', None, None), (None, u'sel', None), (None, u'nbt', 'nbt')]
+        >>> c.token_steps(u'summon-at {entity}: {nbt}')[1][0].pattern
+        u'(?P<entity>\\\\S+):\\\\Z'
+        >>> c.token_steps(u'summon-pos{pos} {entity}') is None
+        True
+
+        :param format_string: The pattern
+        :return: The (word, None, None) steps of the words of the pattern, the (None, name, kind) steps of its
+                 placeholders and the (regex, None, 'glued') steps of the other words. None if the pattern contains a
+                 regex, if its words aren't separated by single spaces or if a word glues a text to a placeholder that
+                 isn't a single word
+        """
+        words = [[]]
+        for literal, name, spec, conversion in self.parse(format_string):
+            if spec or conversion or self.REGEX_CHARS.intersection(literal):
+                return None
+
+            for index, part in enumerate(literal.split(u' ')):
+                if index:
+                    words.append([])
+
+                if part:
+                    words[-1].append((part, None, None))
+
+            if name is not None:
+                words[-1].append((None, name, self.placeholder_kind(name)))
+
+        steps = []
+        for index, word in enumerate(words):
+            if not word:
+                return None
+
+            kinds = [kind for _, name, kind in word if name is not None]
+            if len(word) == 1 and (index or not kinds):
+                if kinds and kinds[0] in self.REST_KINDS and index < len(words) - 1:
+                    return None
+
+                steps.append(word[0])
+                continue
+
+            if any(kind in self.SPAN_KINDS or kind in self.REST_KINDS or kind == 'pos' for kind in kinds):
+                return None
 
-            return prefix + r'\S+)'
+            # Like the /? that starts the regex, the first word can start with a /
+            source = u''.join(text if name is None else self.get_value(name, (), {}) for text, name, _ in word)
+            steps.append((re.compile((u'/?' if index == 0 else u'') + source + u'\\Z'), None, 'glued'))
+
+        return steps
+
+    def compile(self, format_string):
+        """
+        Compile a pattern
+
+        The patterns made of words and placeholders separated by spaces, where an {nbt} or {json} placeholder or a
+        word glued to a placeholder is followed by more of the pattern, are compiled to a TokenPattern. The others are
+        compiled to a regex: when only their last placeholder can contain spaces, the regex doesn't backtrack and is
+        faster than splitting the command. The {nbt}, {json}, {cmd} and {line} placeholders of the other regexes are
+        matched by wildcards that can backtrack
+
+        >>> c = CommandPatternFormatter()
+        >>> c.compile(u'/testfor {sel} {nbt}').__class__.__name__
+        'SRE_Pattern'
+        >>> c.compile(u'summon-at {entity} {nbt} {pos}').__class__.__name__
+        'TokenPattern'
+        >>> c.compile(u'summon-at {entity}: {pos}').__class__.__name__
+        'TokenPattern'
+        >>> c.compile(u'summon-pos{pos} {entity}').__class__.__name__
+        'SRE_Pattern'
+
+        :param format_string: The pattern
+        """
+        steps = self.token_steps(format_string)
+        if steps is None or not any(kind in self.SPAN_KINDS or kind == 'glued' for _, _, kind in steps[:-1]):
+            return re.compile(self.format(format_string))
+
+        return TokenPattern(self.format(format_string), steps)
+
+
+class StructuralMatch(object):
+    """
+    The placeholders bound by a TokenPattern, read like the ones of a regex match
+    """
+
+    def __init__(self, string, groups):
+        self.string = string
+        self.groups = groups
+
+    def group(self, name):
+        return self.groups[name]
+
+    def groupdict(self):
+        return dict(self.groups)
+
+
+class TokenPattern(object):
+    """
+    A command pattern matched against the tokens of the command
+
+    The command is split in tokens once, by a CommandTokens shared by all the patterns tried on it:
+    * {nbt} is a compound span
+    * {json} is a compound, list or string span, or a word
+    * {pos} is three coordinate words, {x}, {y} and {z} one
+    * The other placeholders are words
+    * The words that glue a text to word placeholders are matched by a regex against a single word
+    * The last {nbt}, {json}, {cmd} or {line} placeholder takes the rest of the command without scanning it, {cmd} is
+      bound to a CommandTokens so the command formatted next doesn't start from a plain string
+
+    >>> p = CommandPatternFormatter().compile(u'summon-at {entity} {nbt} {pos}')
+    >>> sorted(p.match(u'/summon-at Zombie {CustomName:"} 1 2 3",Riding:{id:Pig}} ~ ~1 ~').groupdict().items())
+    [(u'entity', u'Zombie'), (u'nbt', u'{CustomName:"} 1 2 3",Riding:{id:Pig}}'), (u'pos', u'~ ~1 ~')]
+    >>> p.match(u'/summon-at Zombie {Riding:{id:Pig} ~ ~1 ~') is None
+    True
+    >>> c = CommandPatternFormatter()
+    >>> p = TokenPattern(c.format(u'execute {sel} {pos} {cmd}'), c.token_steps(u'execute {sel} {pos} {cmd}'))
+    >>> m = p.match(u'execute @p ~ ~ ~ /say hi')
+    >>> m.group(u'cmd'), m.group(u'cmd').__class__.__name__
+    (u'/say hi', 'CommandTokens')
+    >>> p = CommandPatternFormatter().compile(u'summon-at {entity}: {nbt} {pos}')
+    >>> sorted(p.match(u'/summon-at Zombie: {CustomName:"} 1 2 3",Riding:{id:Pig}} ~ ~1 ~').groupdict().items())
+    [(u'entity', u'Zombie'), (u'nbt', u'{CustomName:"} 1 2 3",Riding:{id:Pig}}'), (u'pos', u'~ ~1 ~')]
+    >>> CommandPatternFormatter().compile(u'{sel}: {json} now').match(u'/@a: ["",{text:"a b"}] now').group(u'sel')
+    u'@a'
+    """
+
+    # A word placeholder can't contain any white space
+    WORD_PAT = LazyPattern(r'\S+\Z')
+
+    flags = 0
+
+    def __init__(self, pattern, steps):
+        """
+        :param pattern: The regex equivalent to the pattern, used to index and to name it
+        :param steps: The steps given by CommandPatternFormatter.token_steps
+        """
+        self.pattern = pattern
+
+        # The last placeholder, if it takes the rest of the command
+        self.rest = None
+        if steps[-1][2] in CommandPatternFormatter.SPAN_KINDS | CommandPatternFormatter.REST_KINDS:
+            self.rest = steps.pop()[1:]
+
+        self.steps = steps
+
+        # The number of words read before the first span, they are split at once
+        self.width = 0
+        for word, name, kind in steps:
+            if kind in CommandPatternFormatter.SPAN_KINDS:
+                break
+
+            self.width += 3 if kind == 'pos' else 1
+
+    def match(self, cmd):
+        """
+        Match the whole command
+
+        :param cmd: The command, or its CommandTokens to share its tokens with the other patterns
+        :return: A StructuralMatch, None if the command doesn't match
+        """
+        tokens = cmd if isinstance(cmd, CommandTokens) else CommandTokens(cmd)
+
+        # The rest of the command starts where the split stops
+        tokens.scan(self.width)
+        words = tokens.words
+
+        groups = {}
+        index = 0
+        for word, name, kind in self.steps:
+            if index >= len(words) and not tokens.scan(index + 1):
+                return None
+
+            text = words[index]
+            if kind == 'glued':
+                match = word.match(text)
+                if match is None:
+                    return None
+
+                groups.update(match.groupdict())
+                index += 1
+
+            elif name is None:
+                # Like the /? that starts the regex, the first word can start with a /
+                if text != word and (index or text != u'/' + word):
+                    return None
+
+                index += 1
+
+            elif kind == 'pos':
+                if not tokens.scan(index + 3):
+                    return None
+
+                x, y, z = words[index:index + 3]
+                if not (COORDINATE_PAT.match(x) and COORDINATE_PAT.match(y) and COORDINATE_PAT.match(z)):
+                    return None
+
+                groups[name] = u' '.join(words[index:index + 3])
+                index += 3
+
+            elif kind == 'nbt' or (kind == 'json' and text[:1] in SPAN_TOKENS):
+                span = tokens.span(index)
+                if span is None or (kind == 'nbt' and span[0].kind != COMPOUND_TOKEN):
+                    return None
+
+                groups[name] = span[0].text
+                index = span[1]
+
+            else:
+                if kind in ('x', 'y', 'z'):
+                    if not COORDINATE_PAT.match(text):
+                        return None
+
+                # A word can't be empty or contain white spaces
+                elif not text or (tokens.spaced and not self.WORD_PAT.match(text)):
+                    return None
+
+                groups[name] = text
+                index += 1
+
+        if self.rest is None:
+            if tokens.scan(index + 1):
+                return None
+
+        else:
+            name, kind = self.rest
+            start = tokens.rest(index)
+            if start is None:
+                return None
+
+            value = tokens[start:]
+            if tokens.spaced and u'\n' in value:
+                return None
+
+            if kind == 'nbt' and (len(value) < 2 or value[0] != u'{' or value[-1] != u'}'):
+                return None
+
+            groups[name] = tokens.tail(index) if kind == 'cmd' else value
+
+        return StructuralMatch(tokens, groups)
+
+
+TagRule = namedtuple('TagRule', ['key', 'handler', 'screen', 'ids'])
 
 
 class Formatter(object):
@@ -58,17 +339,18 @@ class Formatter(object):
 
     class_commands = []
 
+    class_tag_rules = []
+
     class_init = False
 
     pattern_formatter = CommandPatternFormatter()
 
-    # The table with the indices of the items
-
-    ITEM_ID_PAT = re.compile(r'^-?\d+(?P<type>[bBsSlL])?$')
+    # Used to find the raw tags with a numeric id, the patterns of the other rules are compiled with the rules
+    NUMERIC_ID_PAT = LazyPattern(r'i\s*d\s*:-?\d', re.UNICODE)
 
     def format_compound(self, tag, base_entity=None, return_type=True, change_id=True):
         """
-        Format a compound tag to fix 1.8 errors in it
+        Format a compound tag to fix 1.8 errors in it, with iter_format_compound whatever the engine
 
         >>> # Create a new formatter
         >>> f = Formatter(SAY_TO_TRANSLATE)
@@ -102,88 +384,382 @@ class Formatter(object):
         {u'Command': u'"/summon Pig ~ ~ ~ {Passengers:[{id:Zombie}]}"'}
 
         :param tag: The tag
-        :type tag: dict
+        :type tag: dict | SNBTCompound
         :param base_entity: The base entity if there is one (for commands like /summon base_entity)
         :param return_type: If it's the first time this function is called
         :param change_id: If the id tag should be changed or not
         :return: The formatted compound tag
         """
+        return self.iter_format_compound(tag, base_entity=base_entity, return_type=return_type, change_id=change_id)
+
+    def iter_format_compound(self, tag, base_entity=None, return_type=True, change_id=True):
+        """
+        Format a compound tag without recursion
+
+        Every compound tag is formatted once, after the compound tags it contains, so a Command under a Riding tag is
+        formatted once too
+
+        >>> f = Formatter(snbt_engine=ITERATIVE_ENGINE)
+        >>> f.iter_format_compound({u'Riding': {u'id': u'Pig', u'Riding': {u'id': u'Bat'}}}, base_entity=u'Zombie')
+        ({u'Passengers': [{u'id': u'Pig'}, {u'id': u'Zombie'}]}, u'Bat')
+
+        >>> depth = 10000
+        >>> tag = {u'id': u'Bat'}
+        >>> for _ in range(depth):
+        ...     tag = {u'id': u'Pig', u'Riding': tag}
+        >>> tag, type = f.iter_format_compound(tag, base_entity=u'Zombie')
+        >>> type
+        u'Bat'
+        >>> len(tag[u'Passengers'])
+        10000
+        >>> tag[u'Passengers'][-1]
+        {u'id': u'Zombie'}
+
+        The tags of the node engine are formatted in place too
+
+        >>> f = Formatter(snbt_engine=NODE_ENGINE)
+        >>> f.iter_format_compound(node_parse_compound(u'{HealF:5F,id:Pig}'), return_type=False)
+        SNBTCompound((u'id', u'Health'), [SNBTScalar(u'Pig'), SNBTScalar(u'5F')])
+
+        The shared subtrees are copied before they change, and their migrated version is remembered
+
+        >>> f = Formatter(share_subtrees=True)
+        >>> tag = f.engine.parse_compound(u'{Riding:{id:Pig,Equipment:[{id:1}]}}')
+        >>> nbt, type = f.iter_format_compound(tag, base_entity=u'Zombie')
+        >>> print(f.engine.compound_string(nbt))
+        {HandItems:[{id:"minecraft:stone"},{}],ArmorItems:[],Passengers:[{id:Zombie}]}
+        >>> print(f.engine.compound_string(tag))
+        {Riding:{Equipment:[{id:1}],id:Pig}}
+        >>> len(f.migrated_subtrees)
+        2
+
+        :param tag: The tag
+        :type tag: dict | SNBTCompound
+        :param base_entity: The base entity if there is one (for commands like /summon base_entity)
+        :param return_type: If the type of the entity should be returned
+        :param change_id: If the id tag should be changed or not
+        :return: The formatted compound tag
+        """
         if tag is None:
             return None
 
-        def format_c(tag):
-            for k, v in tag.items():
-                if isinstance(v, dict):
-                    tag[k] = self.format_compound(v, return_type=False,
-                                                  change_id=change_id and k not in self.KEEP_ID_TAG)
+        self.compile_tag_rules()
 
-                elif isinstance(v, list):
-                    format_l(v)
+        root = [tag]
+        entity = None
 
-        def format_l(tag):
-            for i, t in enumerate(tag):
-                if isinstance(t, dict):
-                    tag[i] = self.format_compound(t, return_type=False, change_id=change_id)
+        # The shared subtrees without any of these keys are kept as they are, the others are copied before they change
+        subtrees = self.subtrees
+        rule_keys = self._tag_id_keys if update_num_ids else self._tag_keys
 
-                elif isinstance(t, list):
-                    format_l(t)
+        # The compound tags to format with their container, their key, if the tags they contain are formatted and the
+        # shared tag they are a copy of
+        stack = [(root, 0, change_id, False, None)]
+        while stack:
+            container, key, change_id, visited, shared = stack.pop()
+            compound = container[key]
 
-        format_c(tag)
+            if visited:
+                if container is root:
+                    container[key], entity = self.__migrate_tag(compound, base_entity, change_id)
 
-        entity = None
+                else:
+                    compound = self.__migrate_tag(compound, None, change_id)[0]
+                    if shared is not None:
+                        compound = self.migrated_subtrees[id(shared), change_id, update_num_ids] = \
+                            subtrees.share(compound)
 
-        if update_num_ids and change_id and u'id' in tag:
-            id = tag[u'id']
-            match = self.ITEM_ID_PAT.match(id)
-            if match:
-                gd = match.groupdict()
-                if gd.get(u'type') is not None:
-                    id = id[:-1]
+                    container[key] = compound
 
-                tag[u'id'] = u'"minecraft:' + ITEMS_TABLE[int(id)] + u'"'
+                continue
 
-        if u'Command' in tag:
-            cmd = tag[u'Command']
-            tag[u'Command'] = u'"' + self.format_command(
-                cmd[1:-1] if (cmd[0] == u'"' and cmd[-1] == u'"') else cmd) + u'"'
+            if isinstance(compound, FrozenCompound):
+                if compound.keys_below.isdisjoint(rule_keys):
+                    continue
 
-        if u'Equipment' in tag:
-            equipment = tag.pop(u'Equipment')
+                # The root isn't remembered since its migration depends on the base entity
+                if container is not root:
+                    migrated = self.migrated_subtrees.get((id(compound), change_id, update_num_ids))
+                    if migrated is not None:
+                        container[key] = migrated
+                        continue
 
-            tag[u'HandItems'] = [equipment[0], {}]
-            tag[u'ArmorItems'] = [equipment[i] for i in range(1, len(equipment))]
+                    shared = compound
 
-        if u'HealF' in tag:
-            healF = tag.pop(u'HealF')
-            tag[u'Health'] = healF
+                compound = container[key] = SNBTCompound(compound.names, list(compound.nodes))
 
-        if u'DropChances' in tag:
-            drop_chances = tag.pop(u'DropChances')
+            stack.append((container, key, change_id, True, shared))
 
-            tag[u'HandDropChances'] = [drop_chances[0], drop_chances[0]]
-            tag[u'ArmorDropChances'] = [drop_chances[i] for i in range(1, len(drop_chances))]
+            for k, v in compound.items():
+                # The entity of the Riding tag gets its ids changed even under a tag that keeps its id
+                v_change_id = change_id and k not in self.KEEP_ID_TAG or k == u'Riding'
 
-        if u'Riding' in tag:
-            entity = self.format_compound(tag.pop(u'Riding'), return_type=False)
+                # The raw tags of the lazy engine are only parsed when they contain something to change
+                # The compound tags in a list tag use the change_id of the compound tag that contains the list
+                if isinstance(v, RawSNBT):
+                    if not self.needs_format(v, v_change_id if v.startswith(u'{') else change_id):
+                        continue
 
-            if base_entity is not None:
-                tag[u'id'] = base_entity
+                    v = compound[k] = v.parse()
 
-            if u'Passengers' not in entity:
-                entity[u'Passengers'] = []
+                if isinstance(v, COMPOUND_TYPES):
+                    stack.append((compound, k, v_change_id, False, None))
 
-            entity[u'Passengers'].append(tag)
-            tag = entity
+                elif isinstance(v, list):
+                    if isinstance(v, FrozenList):
+                        if v.keys_below.isdisjoint(rule_keys):
+                            continue
+
+                        v = compound[k] = list(v)
+
+                    lists = [v]
+                    while lists:
+                        l = lists.pop()
+                        for i, t in enumerate(l):
+                            if isinstance(t, RawSNBT):
+                                if not self.needs_format(t, change_id):
+                                    continue
+
+                                t = l[i] = t.parse()
+
+                            if isinstance(t, COMPOUND_TYPES):
+                                stack.append((l, i, change_id, False, None))
+
+                            elif isinstance(t, list):
+                                if isinstance(t, FrozenList):
+                                    if t.keys_below.isdisjoint(rule_keys):
+                                        continue
+
+                                    t = l[i] = list(t)
+
+                                lists.append(t)
+
+        tag = root[0]
 
         if return_type:
             if entity is not None and u'id' in entity:
-                return tag, entity.pop(u'id')
+                return tag, scalar_text(entity.pop(u'id'))
 
             else:
                 return tag, None
 
         return tag
 
+    def needs_format(self, raw, change_id=True):
+        """
+        Check if a raw tag contains a key that format_compound changes
+
+        The keys and the numeric ids are searched in a single scan
+
+        >>> f = Formatter()
+        >>> f.needs_format(RawSNBT(u'{display:{Name:"Sword"},ench:[{id:16,lvl:1}]}'), change_id=False)
+        False
+        >>> f.needs_format(RawSNBT(u'{display:{Name:"Sword"},ench:[{id:16,lvl:1}]}'))
+        True
+        >>> f.needs_format(RawSNBT(u'[{id:Pig,Riding:{id:Bat}}]'), change_id=False)
+        True
+
+        :param raw: The raw tag
+        :type raw: unicode
+        :param change_id: If the id tags should be changed or not
+        :return: False if format_compound wouldn't change anything in the tag
+        :rtype: bool
+        """
+        self.compile_tag_rules()
+        pattern = self._tag_id_pat if update_num_ids and change_id else self._tag_key_pat
+        return pattern.search(raw) is not None
+
+    def can_rewrite(self, nbt):
+        """
+        Check if format_compound could change the given nbt and count how often it can't
+
+        When the pre-screen is disabled it always returns True
+
+        >>> f = Formatter()
+        >>> f.can_rewrite(u'{CustomName:"Bob",Invulnerable:1b}')
+        False
+        >>> f.can_rewrite(u'{Riding:{id:Pig}}')
+        True
+        >>> sorted(f.prescreen_stats().items())
+        [('parsed', 1), ('skipped', 1)]
+
+        :param nbt: The nbt of a command
+        :type nbt: unicode
+        :return: False if the nbt can be kept as it is
+        :rtype: bool
+        """
+        if not self.prescreen:
+            return True
+
+        if self.needs_format(nbt):
+            self.prescreen_parsed += 1
+            return True
+
+        self.prescreen_skipped += 1
+        return False
+
+    def rewrite_commands(self, nbt):
+        """
+        Format the Command strings of an nbt in place if they are the only thing format_compound would change in it
+
+        The nbt isn't parsed, so the escapes of the strings are kept whatever their depth. The nested Command strings
+        are formatted in the same way by the format_command call of the Command string that contains them, one level
+        at a time
+
+        >>> f = Formatter()
+        >>> print(f.rewrite_commands(u'{Command:"/summon Zombie ~ ~ ~ {CustomName:\\\\"A \\\\\\\\\\\\"B\\\\\\\\\\\\"\\\\",'
+        ...                                      u'Riding:{id:Pig}}",CustomName:"\\\\"C\\\\""}'))
+        {Command:"/summon Pig ~ ~ ~ {Passengers:[{CustomName:\\"A \\\\\\"B\\\\\\"\\",id:Zombie}]}",CustomName:"\\"C\\""}
+        >>> f.rewrite_commands(u'{Command:"/say hi",Riding:{id:Pig}}') is None
+        True
+
+        :param nbt: The nbt of a command
+        :type nbt: unicode
+        :return: The new nbt, None if it has to be parsed and formatted
+        :rtype: unicode
+        """
+        self.compile_tag_rules()
+        screen = self._other_id_pat if update_num_ids else self._other_key_pat
+        return rewrite_command_strings(nbt, self.format_command, screen)
+
+    def prescreen_stats(self):
+        """
+        Get the counters of the pre-screen
+
+        :return: How many nbts were kept as they are and how many were parsed or None if the pre-screen is disabled
+        :rtype: dict
+        """
+        return {'skipped': self.prescreen_skipped, 'parsed': self.prescreen_parsed} if self.prescreen else None
+
+    def __migrate_tag(self, tag, base_entity, change_id):
+        """
+        Apply the 1.9 changes to a compound tag whose values are already formatted
+
+        Only the rules of the keys the tag contains are run, in the order they were defined. The rules have to be
+        compiled already
+
+        :param tag: The tag
+        :param base_entity: The base entity if there is one
+        :param change_id: If the id tag should be changed or not
+        :return: The new tag and the entity it now rides, if any
+        """
+        ids = update_num_ids and change_id
+        keys = (self._tag_id_keys if ids else self._tag_keys).intersection(tag)
+        if not keys:
+            return tag, None
+
+        # The handlers of each set of keys are sorted once
+        handlers = self._tag_handlers.get((ids, keys))
+        if handlers is None:
+            entries = sorted(entry for key in keys for entry in self._tag_dispatch[key])
+            handlers = self._tag_handlers[ids, keys] = [rule.handler for _, rule in entries if ids or not rule.ids]
+
+        # The rules can change the values of their keys, so the shared ones are copied
+        if self.subtrees is not None:
+            for key in keys:
+                tag[key] = thaw(tag[key])
+
+        entity = None
+        for handler in handlers:
+            new_tag = handler(self, tag, base_entity)
+            if new_tag is not tag:
+                tag = entity = new_tag
+
+        return tag, entity
+
+    @classmethod
+    def tag_rule(cls, key, screen=None, ids=False, rules=class_tag_rules):
+        """
+        A decorator that defines that the following function migrates the compound tags that contain the given key
+
+        The function is called with the formatter, the tag and the base entity once the tags in it are formatted. It
+        returns the tag, or the entity the tag now rides. The rules of a tag run in the order they were defined, except
+        the Riding rules that always run last.
+
+        >>> f = Formatter()
+        >>> @f.inst_tag_rule(u'Invulnerable')
+        ... def invulnerable(formatter, tag, base_entity):
+        ...     tag[u'Invulnerable'] = u'1b'
+        ...     return tag
+        ...
+        >>> f.format_compound({u'Invulnerable': u'1', u'HealF': u'5F'}, return_type=False)
+        {u'Invulnerable': u'1b', u'Health': u'5F'}
+        >>> f.format_command(u'/summon Zombie ~ ~ ~ {Invulnerable:1}')
+        u'/summon Zombie ~ ~ ~ {Invulnerable:1b}'
+
+        :param key: The key of the tags the rule changes
+        :param screen: The pattern that finds the raw tags the rule could change, by default the key followed by a :
+        :param ids: If the rule only runs when the ids are changed
+        :param rules: The list of rules this rule should be added to
+        """
+        if screen is None:
+            screen = make_key_pattern([key]).pattern
+
+        def _tag_rule(handler):
+            rules.append(TagRule(key, handler, screen, ids))
+            return handler
+
+        return _tag_rule
+
+    def inst_tag_rule(self, key, screen=None, ids=False):
+        return self.tag_rule(key, screen=screen, ids=ids, rules=self.tag_rules)
+
+    def compile_tag_rules(self):
+        """
+        Build the table from the keys of the compound tags to their rules, when rules were added since the last time
+
+        >>> f = Formatter()
+        >>> f.compile_tag_rules()
+        >>> [rule.key for _, rule in f._tag_dispatch[u'Riding']]
+        [u'Riding']
+        >>> sorted(f._tag_id_keys - f._tag_keys)
+        [u'id']
+
+        >>> # The rules defined after the Riding rule still migrate the tag, not the entity it rides
+        >>> @f.inst_tag_rule(u'Invulnerable')
+        ... def invulnerable(formatter, tag, base_entity):
+        ...     tag[u'Invulnerable'] = u'2b'
+        ...     return tag
+        ...
+        >>> f.format_command(u'/summon Zombie ~ ~ ~ {Invulnerable:1b,Riding:{id:Pig}}')
+        u'/summon Pig ~ ~ ~ {Passengers:[{Invulnerable:2b,id:Zombie}]}'
+        """
+        sizes = (len(self.tag_rules), len(self.class_tag_rules))
+
+        # The rule lists only grow so their sizes tell if new rules were defined
+        if self._tag_rules_sizes == sizes:
+            return
+
+        self._tag_rules_sizes = sizes
+
+        # The new rules could change the result of the cached commands and of the migrated subtrees
+        if self.cache is not None:
+            self.cache.clear()
+
+        self.migrated_subtrees.clear()
+
+        # The Riding rules make the tag a passenger of the entity it rides, so they run after all the other rules
+        dispatch = {}
+        for entry in enumerate(sorted(self.class_tag_rules + self.tag_rules, key=lambda rule: rule.key == u'Riding')):
+            dispatch.setdefault(entry[1].key, []).append(entry)
+
+        rules = [rule for entries in dispatch.values() for _, rule in entries]
+
+        def screen(ids, keep_commands):
+            return re.compile(u'|'.join(rule.screen for rule in rules if (ids or not rule.ids) and
+                                        not (keep_commands and rule.key == u'Command')) or u'(?!)', re.UNICODE)
+
+        self._tag_dispatch = dispatch
+        self._tag_handlers = {}
+        self._tag_keys = frozenset(rule.key for rule in rules if not rule.ids)
+        self._tag_id_keys = frozenset(dispatch)
+        self._tag_key_pat = screen(False, False)
+        self._tag_id_pat = screen(True, False)
+
+        # The patterns of the other rules, searched around the Command strings rewritten in place
+        self._other_key_pat = screen(False, True)
+        self._other_id_pat = screen(True, True)
+
     class CommandFormatter:
         """
         Represent a command formatter
@@ -195,15 +771,29 @@ class Formatter(object):
         u'/summon Zombie 666 42 ~-3'
         """
 
-        def __init__(self, pattern=None, formatter=None):
+        # If the formatter reads the nbt of the command block, its results are then never cached
+        uses_nbt = False
+
+        def __init__(self, pattern=None, formatter=None, uses_nbt=False):
             if not hasattr(self, u'pattern'):
                 self.pattern = pattern
 
             if not hasattr(self, u'formatter'):
                 self.formatter = formatter
 
+            if uses_nbt:
+                self.uses_nbt = True
+
+            # The name of the function, or of the class for the command formatters defined as classes
+            if not hasattr(self, u'name'):
+                is_function = self.__class__ is Formatter.CommandFormatter
+                self.name = self.formatter.__name__ if is_function else self.__class__.__name__
+
             if isinstance(self.pattern, basestring):
-                self.pattern = re.compile(Formatter.pattern_formatter.format(self.pattern))
+                self.pattern = Formatter.pattern_formatter.compile(self.pattern)
+
+            # The command word used to index this formatter, None if it can match any command
+            self.keyword = pattern_keyword(self.pattern)
 
         def format(self, cmd, **kwargs):
             """
@@ -225,20 +815,32 @@ class Formatter(object):
                 return None
 
             else:
-                dic = match.groupdict()
-                for key, value in kwargs.items():
-                    dic[u'_' + key] = value
+                return self.apply(match, **kwargs)
+
+        def apply(self, match, **kwargs):
+            """
+            Format a command the pattern matched
+
+            :param match: The match of the pattern
+            :return: The formatted command or None
+            """
+            dic = match.groupdict()
+            for key, value in kwargs.items():
+                dic[u'_' + key] = value
 
-                return self.formatter(**dic)
+            return self.formatter(**dic)
 
     @classmethod
-    def command(cls, pattern, commands=class_commands):
+    def command(cls, pattern, commands=class_commands, uses_nbt=False):
         """
         A decorator that defines that the following function is a command
 
         It adds the given command and the pattern to the list of known commands
         It adds the given command and the pattern to the list of known commands
 
+        The function gets the nbt of the command block as _nbt. The results of the formatters are cached by command, so
+        a function that reads _nbt has to be defined with uses_nbt, then the commands it could match are not cached
+
         >>> f = Formatter()
         >>> f.format_command(u'/summon-pos 666 42 ~-3 Zombie')
         u'/summon-pos 666 42 ~-3 Zombie'
@@ -259,17 +861,18 @@ class Formatter(object):
 
         :param pattern: The pattern of the command
         :param commands: The list of commands this command should be added to
+        :param uses_nbt: If the function reads the nbt of the command block
         """
 
         if isinstance(pattern, basestring):
-            pattern = re.compile(cls.pattern_formatter.format(pattern))
+            pattern = cls.pattern_formatter.compile(pattern)
 
         def _command(cmd):
             if cmd is None:
                 return None
 
             if hasattr(cmd, u'__call__'):
-                entry = cls.CommandFormatter(pattern, cmd)
+                entry = cls.CommandFormatter(pattern, cmd, uses_nbt=uses_nbt)
 
             else:
                 entry = cmd(pattern)
@@ -280,15 +883,15 @@ class Formatter(object):
 
         return _command
 
-    def inst_command(self, pattern):
-        return self.command(pattern, commands=self.commands)
+    def inst_command(self, pattern, uses_nbt=False):
+        return self.command(pattern, commands=self.commands, uses_nbt=uses_nbt)
 
     @classmethod
     def class_cmd(cls, clazz, commands=class_commands):
         """
         Adds a new command to the list of known commands
 
-        Should be used on a class
+        Should be used on a class. A class whose formatter reads the nbt of the command block sets uses_nbt to True
 
         >>> f = Formatter()
         >>> f.format_command(u'/summon-pos 666 42 ~-3 Zombie')
@@ -307,7 +910,15 @@ class Formatter(object):
         if clazz is None:
             return None
 
-        commands.append(clazz())
+        # The classes that don't call CommandFormatter.__init__ still get a name and a command word
+        entry = clazz()
+        if not hasattr(entry, u'name'):
+            entry.name = clazz.__name__
+
+        if not hasattr(entry, u'keyword'):
+            entry.keyword = pattern_keyword(entry.pattern)
+
+        commands.append(entry)
 
         return clazz
 
@@ -339,8 +950,18 @@ class Formatter(object):
 
             formatter = dic[u'_formatter']
 
+            # Nothing to change in the nbt so the selector doesn't change either
+            if not formatter.can_rewrite(dic[u'nbt']):
+                return fun(**dic)
+
+            # Only the commands in the nbt change so the selector doesn't change either
+            nbt = formatter.rewrite_commands(dic[u'nbt'])
+            if nbt is not None:
+                dic[u'nbt'] = nbt
+                return fun(**dic)
+
             sel = parse_selector(dic[u'sel'])
-            parsed_nbt = parse_compound(dic[u'nbt'])
+            parsed_nbt = formatter.engine.parse_compound(dic[u'nbt'])
 
             if sel is not None:  # If sel is a valid selector
                 t = sel[1].get(u'type')  # Find the type of the selector
@@ -361,7 +982,7 @@ class Formatter(object):
             else:
                 nbt = formatter.format_compound(parsed_nbt, return_type=False)
 
-            dic[u'nbt'] = compound_string(nbt)
+            dic[u'nbt'] = formatter.engine.compound_string(nbt)
 
             return fun(**dic)
 
@@ -390,7 +1011,15 @@ class Formatter(object):
         """
 
         def _nbt(**dic):
-            nbt = compound_string(dic[u'_formatter'].format_compound(parse_compound(dic[u'nbt']), return_type=False))
+            formatter = dic[u'_formatter']
+            if not formatter.can_rewrite(dic[u'nbt']):
+                return fun(**dic)
+
+            nbt = formatter.rewrite_commands(dic[u'nbt'])
+            if nbt is None:
+                nbt = formatter.engine.compound_string(
+                    formatter.format_compound(formatter.engine.parse_compound(dic[u'nbt']), return_type=False))
+
             dic[u'nbt'] = nbt
             return fun(**dic)
 
@@ -418,7 +1047,8 @@ class Formatter(object):
         """
 
         def _json(**dic):
-            json = json_string(parse_json(dic[u'json']))
+            engine = dic[u'_formatter'].engine
+            json = engine.json_string(engine.parse_json(dic[u'json']))
             dic[u'json'] = json
             return fun(**dic)
 
@@ -426,10 +1056,23 @@ class Formatter(object):
 
     @staticmethod
     def __alias(pattern, string, dec):
-        @dec(pattern)
         def formatter(**dic):
             return dic[u'_formatter'].format_command(string.format(**dic))
 
+        formatter.__name__ = Formatter.shortcut_name(u'alias', pattern)
+        dec(pattern)(formatter)
+
+    @staticmethod
+    def shortcut_name(kind, pattern):
+        """
+        The name given to the command formatters made by the shortcuts
+
+        >>> Formatter.shortcut_name(u'nbt', u'/give {sel} {item} {amount} {data} {nbt}')
+        'nbt_give'
+        """
+        keyword = command_keyword(pattern) if isinstance(pattern, basestring) else pattern_keyword(pattern)
+        return str(u'{}_{}'.format(kind, keyword))
+
     @classmethod
     def alias(cls, pattern, string):
         cls.__alias(pattern, string, cls.command)
@@ -471,11 +1114,13 @@ class Formatter(object):
 
                 string = '/' + pattern
 
-            @dec(pattern)
             @modifier
             def formatter(**kwargs):
                 return string.format(**kwargs)
 
+            formatter.__name__ = Formatter.shortcut_name(modifier.__name__, pattern)
+            dec(pattern)(formatter)
+
         if for_class:
             make_cmd = staticmethod(make_cmd)
 
@@ -499,18 +1144,81 @@ class Formatter(object):
         cls.nbt_cmd = cls.class_cmd_shortcut(cls.nbt)
 
         cls.__class_commands_init()
+        cls.__class_tag_rules_init()
+
+        cls.class_init = True
+
+    @classmethod
+    def __class_tag_rules_init(cls):
+        @cls.tag_rule(u'id', screen=cls.NUMERIC_ID_PAT.pattern, ids=True)
+        def numeric_id(formatter, tag, base_entity):
+            quoted = ITEM_IDS.quote_value(tag[u'id'])
+            if quoted is not None:
+                tag[u'id'] = quoted
+
+            return tag
+
+        @cls.tag_rule(u'Command')
+        def command_tag(formatter, tag, base_entity):
+            cmd = scalar_text(tag[u'Command'])
+            tag[u'Command'] = u'"' + formatter.format_command(
+                cmd[1:-1] if (cmd[0] == u'"' and cmd[-1] == u'"') else cmd) + u'"'
+            return tag
+
+        @cls.tag_rule(u'Equipment')
+        def equipment(formatter, tag, base_entity):
+            equipment = tag.pop(u'Equipment')
+
+            tag[u'HandItems'] = [equipment[0], {}]
+            tag[u'ArmorItems'] = [equipment[i] for i in range(1, len(equipment))]
+            return tag
+
+        @cls.tag_rule(u'HealF')
+        def heal_f(formatter, tag, base_entity):
+            tag[u'Health'] = tag.pop(u'HealF')
+            return tag
+
+        @cls.tag_rule(u'DropChances')
+        def drop_chances(formatter, tag, base_entity):
+            drop_chances = tag.pop(u'DropChances')
+
+            tag[u'HandDropChances'] = [drop_chances[0], drop_chances[0]]
+            tag[u'ArmorDropChances'] = [drop_chances[i] for i in range(1, len(drop_chances))]
+            return tag
+
+        # The tag becomes a passenger of the entity it rides, so compile_tag_rules runs it after the other rules
+        @cls.tag_rule(u'Riding')
+        def riding(formatter, tag, base_entity):
+            entity = tag.pop(u'Riding')
+
+            if base_entity is not None:
+                tag[u'id'] = base_entity
+
+            if u'Passengers' not in entity:
+                entity[u'Passengers'] = []
+
+            entity[u'Passengers'].append(tag)
+            return entity
 
     @classmethod
     def __class_commands_init(cls):
         @cls.command(ur'execute {sel} {pos} {cmd}')
         def execute_string(**dic):
-            return u'/execute {} {} {}'.format(dic[u'sel'], dic[u'pos'], dic[u'_formatter'].format_command(dic[u'cmd']))
+            return dic[u'_formatter'].format_execute_chain(dic[u'sel'], dic[u'pos'], dic[u'cmd'], execute_string)
 
         @cls.command(u'summon {entity} {pos} {nbt}')
         def summon_string(**dic):
-            nbt, type = dic[u'_formatter'].format_compound(parse_compound(dic[u'nbt']), dic[u'entity'])
+            formatter = dic[u'_formatter']
+            if not formatter.can_rewrite(dic[u'nbt']):
+                return u'/summon {} {} {}'.format(dic[u'entity'], dic[u'pos'], dic[u'nbt'])
+
+            nbt = formatter.rewrite_commands(dic[u'nbt'])
+            if nbt is not None:
+                return u'/summon {} {} {}'.format(dic[u'entity'], dic[u'pos'], nbt)
 
-            return u'/summon {} {} {}'.format(type or dic[u'entity'], dic[u'pos'], compound_string(nbt))
+            nbt, type = formatter.format_compound(formatter.engine.parse_compound(dic[u'nbt']), dic[u'entity'])
+
+            return u'/summon {} {} {}'.format(type or dic[u'entity'], dic[u'pos'], formatter.engine.compound_string(nbt))
 
         # The selector commands
         cls.selector_cmd(u'scoreboard players {op} {sel} {obj} {val} {nbt}')
@@ -547,16 +1255,69 @@ class Formatter(object):
 
         cls.nbt_cmd(u'/testforblock {pos} {id} {data} {nbt}')
 
-    def __init__(self, say_to_tellraw=KEEP_SAY):
+    def __init__(self, say_to_tellraw=KEEP_SAY, cache_size=0, snbt_engine=None, prescreen=True, instrument=False,
+                 share_subtrees=False):
+        """
+        :param say_to_tellraw: How /say commands should be changed
+        :param cache_size: The number of formatted commands to remember. 0 disables the cache
+        :param snbt_engine: The name of the engine used to parse the nbt tags and the jsons, None for the default one
+        :param prescreen: If the nbts that format_compound can't change should be kept as they are without parsing them
+        :param instrument: If the attempts, the matches and the time spent in each command formatter and in the nbt
+            functions should be recorded
+        :param share_subtrees: If the identical subtrees of the parsed nbts should be shared by all the commands, with
+            their migrated version. The nbt tags are then parsed into nodes, all kept as long as the formatter
+        """
         if not self.class_init:
             self.__class_init()
 
+        self.say_to_tellraw = say_to_tellraw
+        self.engine = get_snbt_engine(snbt_engine)
+
+        # The table of the shared subtrees and their migrated versions, by subtree, change_id and update_num_ids
+        self.subtrees = None
+        self.migrated_subtrees = {}
+        if share_subtrees:
+            self.subtrees = SubtreeTable()
+            self.engine = self.engine._replace(parse_compound=self.subtrees.parse_compound,
+                                               parse_list=self.subtrees.parse_list,
+                                               compound_string=stream_compound_string)
+
+        self.prescreen = prescreen
+        self.prescreen_skipped = 0
+        self.prescreen_parsed = 0
+
+        self.instrumentation = None
+        if instrument:
+            self.instrumentation = Instrumentation()
+            self.engine = self.engine._replace(
+                parse_compound=self.instrumentation.timed(u'parse_compound', self.engine.parse_compound),
+                compound_string=self.instrumentation.timed(u'compound_string', self.engine.compound_string))
+            self.format_compound = self.instrumentation.timed(u'format_compound', self.format_compound)
+
+        # The cache only stores the formatted strings so the parsed trees mutated by format_compound are never shared
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+
         self.selector_inst_cmd = self.inst_cmd_shortcut(self.selector)
         self.json_inst_cmd = self.inst_cmd_shortcut(self.json)
         self.nbt_inst_cmd = self.inst_cmd_shortcut(self.nbt)
 
         self.commands = []
 
+        self.tag_rules = []
+
+        # The table of the tag rules and the sizes of the rule lists it was built with
+        self._tag_rules_sizes = None
+        self._tag_dispatch = {}
+        self._tag_handlers = {}
+        self._tag_keys = self._tag_id_keys = frozenset()
+        self._tag_key_pat = self._tag_id_pat = self._other_key_pat = self._other_id_pat = None
+
+        # The dispatch index and the sizes of the command lists it was built with
+        self._dispatch_sizes = None
+        self._dispatch_index = {}
+        self._dispatch_default = []
+        self._dispatch_uses_nbt = False
+
         @self.inst_class_cmd
         @use_if(say_to_tellraw == SAY_TO_TEXT or say_to_tellraw == SAY_TO_TRANSLATE)
         class SayCommand(object, self.CommandFormatter):
@@ -713,6 +1474,133 @@ class Formatter(object):
 
                 return result
 
+    def dispatch(self, cmd):
+        """
+        Find the command formatters that could match the given command
+
+        The formatters are indexed by the command word of their pattern.
+        The formatters whose pattern doesn't start with a fixed word are tried for every command.
+        The order of the instance and class commands is kept.
+
+        >>> f = Formatter()
+        >>> [c.keyword for c in f.dispatch(u'/summon Zombie ~ ~ ~ {}')]
+        [u'summon']
+        >>> f.dispatch(u'/unknown command')
+        []
+        >>> @f.inst_command(re.compile(r'^(?P<sel>@\S+)$'))
+        ... def sel(**dic):
+        ...     return u'/testfor {sel}'.format(**dic)
+        ...
+        >>> [c.keyword for c in f.dispatch(u'/summon Zombie ~ ~ ~ {}')]
+        [None, u'summon']
+        >>> [c.keyword for c in f.dispatch(u'@a')]
+        [None]
+
+        :param cmd: The stripped command
+        :type cmd: unicode
+        :return: The command formatters to try, in order
+        :rtype: list
+        """
+        self.__update_dispatch()
+        return self._dispatch_index.get(command_keyword(cmd), self._dispatch_default)
+
+    def uses_nbt(self):
+        """
+        Tell if one of the command formatters reads the nbt of the command blocks
+
+        >>> f = Formatter()
+        >>> f.uses_nbt()
+        False
+        >>> @f.inst_command(u'/greet', uses_nbt=True)
+        ... def greet(**dic):
+        ...     return u'/say ' + dic[u'_nbt'][u'who']
+        ...
+        >>> f.uses_nbt()
+        True
+
+        :rtype: bool
+        """
+        self.__update_dispatch()
+        return self._dispatch_uses_nbt
+
+    def __update_dispatch(self):
+        # The new tag rules clear the cache too, before it is read
+        self.compile_tag_rules()
+
+        sizes = (len(self.commands), len(self.class_commands))
+
+        # The command lists only grow so their sizes tell if new commands were registered
+        if self._dispatch_sizes == sizes:
+            return
+
+        self._dispatch_sizes = sizes
+
+        # The new commands could change the result of the cached commands
+        if self.cache is not None:
+            self.cache.clear()
+
+        commands = self.commands + self.class_commands
+        keywords = [getattr(command, u'keyword', None) for command in commands]
+
+        self._dispatch_default = [command for command, keyword in zip(commands, keywords) if keyword is None]
+        self._dispatch_index = {
+            k: [command for command, keyword in zip(commands, keywords) if keyword is None or keyword == k]
+            for k in set(keywords) if k is not None}
+        self._dispatch_uses_nbt = any(getattr(command, u'uses_nbt', False) for command in commands)
+
+    def format_execute_chain(self, sel, pos, cmd, execute):
+        """
+        Format an /execute command and the /execute commands it runs in a single pass
+
+        The /execute prefixes are peeled off from left to right as long as the execute formatter is the first one the
+        dispatch tries on the rest of the command, like format_command would do it on each of them. Then only the last
+        command is formatted and the chain is joined back once. The selectors are kept as they are.
+
+        >>> f = Formatter()
+        >>> f.format_command(u'/execute @a ~ ~ ~ execute @e[type=Pig] ~ ~1 ~  /execute @p 1 2 3 /summon Bat ~ ~ ~ {HealF:1F}')
+        u'/execute @a ~ ~ ~ /execute @e[type=Pig] ~ ~1 ~ /execute @p 1 2 3 /summon Bat ~ ~ ~ {Health:1F}'
+        >>> f.format_command(u'/execute @a ~ ~ ~ /execute @p ~ ~ ~ detect ~ ~-1 ~ stone 0 /testfor @p {HealF:1F}')
+        u'/execute @a ~ ~ ~ /execute @p ~ ~ ~ detect ~ ~-1 ~ stone 0 /testfor @p {HealF:1F}'
+
+        :param sel: The selector of the first /execute
+        :param pos: The position of the first /execute
+        :param cmd: The command the first /execute runs
+        :param execute: The function of the execute formatter
+        :return: The formatted chain
+        :rtype: unicode
+        """
+        prefixes = [u'/execute', sel, pos]
+        while True:
+            stripped = cmd.strip()
+            if len(stripped) != len(cmd):
+                cmd = stripped
+
+            commands = self.dispatch(cmd)
+            if not commands or getattr(commands[0], u'formatter', None) is not execute:
+                break
+
+            match = self.__match_execute(commands[0], cmd)
+            if match is None:
+                break
+
+            prefixes += [u'/execute', match.group(u'sel'), match.group(u'pos')]
+            cmd = match.group(u'cmd')
+
+        prefixes.append(self.format_command(cmd))
+        return u' '.join(prefixes)
+
+    def __match_execute(self, command, cmd):
+        if self.instrumentation is None:
+            return command.pattern.match(cmd)
+
+        # A peeled /execute is an attempt of the execute formatter, formatted in the time of the first one
+        clock = self.instrumentation.clock
+        start = clock()
+        match = command.pattern.match(cmd)
+        self.instrumentation.record(command.pattern.pattern, attempts=1, matches=int(match is not None),
+                                    match_time=clock() - start, format_time=0.0)
+        return match
+
     def format_command(self, cmd, nbt=None):
         """
         Format a single command
@@ -745,15 +1633,198 @@ class Formatter(object):
         :return: The formatted command
         :rtype: str
         """
+        return self.match_command(cmd, nbt)[0]
+
+    def match_command(self, cmd, nbt=None):
+        """
+        Format a single command and tell which command formatter matched it
+
+        >>> f = Formatter()
+        >>> f.match_command(u'/summon Zombie ~ ~ ~ {Riding:{id:Pig}}')
+        (u'/summon Pig ~ ~ ~ {Passengers:[{id:Zombie}]}', 'summon_string')
+        >>> f.match_command(u'/summon-at Zombie {Riding:{id:Pig}} 666 42 ~-3')
+        (u'/summon Pig 666 42 ~-3 {Passengers:[{id:Zombie}]}', 'alias_summon-at')
+        >>> f.match_command(u'/time set day')
+        (u'/time set day', None)
+
+        >>> # The commands a formatter reading the nbt of the command block could match are never cached
+        >>> f = Formatter(cache_size=10)
+        >>> @f.inst_command(u'/greet', uses_nbt=True)
+        ... def greet(**dic):
+        ...     return u'/say ' + dic[u'_nbt'][u'who']
+        ...
+        >>> f.format_command(u'/greet', {u'who': u'A'}), f.format_command(u'/greet', {u'who': u'B'})
+        (u'/say A', u'/say B')
+
+        >>> # The tag rules defined after a command was cached apply to it
+        >>> f.format_command(u'/summon Zombie ~ ~ ~ {Invulnerable:1,HealF:1F}')
+        u'/summon Zombie ~ ~ ~ {Invulnerable:1,Health:1F}'
+        >>> @f.inst_tag_rule(u'Invulnerable')
+        ... def invulnerable(formatter, tag, base_entity):
+        ...     tag[u'Invulnerable'] = u'1b'
+        ...     return tag
+        ...
+        >>> f.format_command(u'/summon Zombie ~ ~ ~ {Invulnerable:1,HealF:1F}')
+        u'/summon Zombie ~ ~ ~ {Invulnerable:1b,Health:1F}'
+
+        :param cmd: The command, its tokens are reused if it is a CommandTokens
+        :type cmd: unicode
+        :param nbt: The nbt values of the command block
+        :return: The formatted command and the name of the command formatter, None if none matched
+        :rtype: (unicode, str)
+        """
+        tokens = cmd if isinstance(cmd, CommandTokens) else None
         cmd = cmd.strip()
+        if tokens is not None and len(tokens) != len(cmd):
+            tokens = None
+
+        # The cache is cleared first if new commands or tag rules were registered. A hit doesn't need the dispatch
+        self.__update_dispatch()
+        if self.cache is not None and not (nbt is not None and self._dispatch_uses_nbt and
+                                           any(getattr(command, u'uses_nbt', False) for command in self.dispatch(cmd))):
+            key = (cmd, self.say_to_tellraw, update_num_ids)
+            result = self.cache.get(key)
+            if result is None:
+                result = self.__format_command(cmd, self.dispatch(cmd), nbt, tokens)
+                self.cache.put(key, result)
+
+            return result
+
+        return self.__format_command(cmd, self.dispatch(cmd), nbt, tokens)
+
+    def format_commands(self, commands, batch_size=10000, report=None, memo_size=4096):
+        """
+        Format a stream of commands, each distinct command is only formatted once while it is remembered
+
+        The commands are read one batch at a time so a generator of any size can be given. At most batch_size commands
+        and their results, plus the memo_size distinct commands used most recently and their results, are held in
+        memory at once
 
-        for command in self.commands + self.class_commands:
+        >>> f = Formatter()
+        >>> stats = []
+        >>> commands = (u'/summon Zombie ~ ~ ~ {Riding:{id:Pig}}' if i % 2 else u'/time set day' for i in range(5))
+        >>> list(f.format_commands(commands, batch_size=2, report=stats.append))  # doctest: +NORMALIZE_WHITESPACE
+        [u'/time set day', u'/summon Pig ~ ~ ~ {Passengers:[{id:Zombie}]}', u'/time set day',
+         u'/summon Pig ~ ~ ~ {Passengers:[{id:Zombie}]}', u'/time set day']
+        >>> [(s.index, s.commands, s.formatted) for s in stats]
+        [(0, 2, 2), (1, 2, 0), (2, 1, 0)]
+        >>> stats = []
+        >>> commands = (u'/say ' + unicode(i % 3) for i in range(6))
+        >>> _ = list(f.format_commands(commands, batch_size=3, report=stats.append, memo_size=2))
+        >>> [(s.index, s.commands, s.formatted) for s in stats]
+        [(0, 3, 3), (1, 3, 3)]
+
+        :param commands: The commands
+        :param batch_size: The number of commands read at once
+        :type batch_size: int
+        :param report: A function called with the BatchStats of each batch before its results are yielded
+        :param memo_size: The number of distinct commands whose results are remembered, the least recently used ones
+            are forgotten first
+        :type memo_size: int
+        :return: A generator of the formatted commands in the order of the commands
+        """
+        formatted = LRUCache(memo_size)
+        clock = timeit.default_timer
+        for index, batch in enumerate(iter_batches(commands, batch_size)):
+            start = clock()
+            new = 0
+            results = []
+            for cmd in batch:
+                result = formatted.get(cmd)
+                if result is None:
+                    result = self.format_command(cmd)
+                    formatted.put(cmd, result)
+                    new += 1
+
+                results.append(result)
+
+            if report is not None:
+                report(BatchStats(index, len(batch), new, clock() - start))
+
+            for result in results:
+                yield result
+
+    def __format_command(self, cmd, commands, nbt, tokens=None):
+        # The command is split in tokens once for all the token patterns
+        if commands and tokens is None:
+            tokens = CommandTokens(cmd)
+
+        if self.instrumentation is not None:
+            return self.__instrumented_format_command(cmd, commands, nbt, tokens)
+
+        for command in commands:
+            result = command.format(tokens, nbt=nbt, formatter=self)
+            if result is not None:
+                return result, command.name
+
+        return cmd, None
 
-            result = command.format(cmd, nbt=nbt, formatter=self)
+    def __instrumented_format_command(self, cmd, commands, nbt, tokens):
+        clock = self.instrumentation.clock
+        for command in commands:
+            start = clock()
+            match = command.pattern.match(tokens)
+            match_time = clock() - start
+
+            if match is None:
+                self.instrumentation.record(command.pattern.pattern, attempts=1, matches=0, match_time=match_time,
+                                            format_time=0.0)
+                continue
+
+            # Includes the time spent formatting the commands the formatter formats itself, like the ones of /execute
+            start = clock()
+            result = command.apply(match, nbt=nbt, formatter=self)
+            self.instrumentation.record(command.pattern.pattern, attempts=1, matches=1, match_time=match_time,
+                                        format_time=clock() - start)
             if result is not None:
-                return result
+                return result, command.name
+
+        return cmd, None
+
+    def instrumentation_report(self, as_json=False):
+        """
+        Get the attempts, the matches and the time spent in each command formatter, by pattern, and the time spent in
+        parse_compound, format_compound and compound_string
+
+        >>> f = Formatter(instrument=True)
+        >>> _ = f.format_command(u'/summon Zombie ~ ~ ~ {Riding:{id:Pig}}')
+        >>> stats = json.loads(f.instrumentation_report(as_json=True))
+        >>> [stats[name][u'calls'] for name in (u'parse_compound', u'format_compound', u'compound_string')]
+        [1, 1, 1]
+        >>> [(entry[u'attempts'], entry[u'matches']) for name, entry in stats.items() if name.startswith(u'^/?summon ')]
+        [(1, 1)]
+        >>> _ = f.format_command(u'/execute @a ~ ~ ~ /execute @p ~ ~ ~ /say hi')
+        >>> stats = json.loads(f.instrumentation_report(as_json=True))
+        >>> [(entry[u'attempts'], entry[u'matches']) for name, entry in stats.items() if u'execute' in name]
+        [(2, 2)]
+        >>> Formatter().instrumentation_report() is None
+        True
+
+        :param as_json: If the report should be a JSON object instead of a text table
+        :return: The report or None if the formatter isn't instrumented
+        :rtype: unicode
+        """
+        if self.instrumentation is None:
+            return None
 
-        return cmd
+        return self.instrumentation.json() if as_json else self.instrumentation.table()
+
+    def cache_stats(self):
+        """
+        Get the counters of the formatted commands cache
+
+        >>> f = Formatter(cache_size=2)
+        >>> for cmd in (u'/testfor @p[r=3]', u'/testfor @p[r=3]', u'/say a', u'/say b', u'/testfor @p[r=3]'):
+        ...     _ = f.format_command(cmd)
+        >>> sorted(f.cache_stats().items())
+        [('evictions', 2), ('hits', 1), ('max_size', 2), ('misses', 4), ('size', 2)]
+        >>> Formatter().cache_stats() is None
+        True
+
+        :return: The hits, misses and evictions of the cache or None if the cache is disabled
+        :rtype: dict
+        """
+        return self.cache.stats() if self.cache is not None else None
 
     options = [
         (u'/say to /tellraw', u'say_to_tellraw',
@@ -761,8 +1832,40 @@ class Formatter(object):
     ]
 
     @classmethod
-    def new(cls, options):
-        return cls(**{key: values[options[name]] for name, key, values in cls.options})
+    def new(cls, options, **kwargs):
+        kwargs.update({key: values[options[name]] for name, key, values in cls.options})
+        return cls(**kwargs)
+
+    # The formatter made by configured, by class, options and arguments. Only the last one is kept
+    configured_formatters = {}
+
+    @classmethod
+    def configured(cls, options, **kwargs):
+        """
+        Get the formatter of the given options, made the first time they are used and kept for the next runs
+
+        Only the formatter of the last options is kept, with its cache, so the options used before don't stay in
+        memory for the whole session
+
+        >>> f = Formatter.configured({SAY_TO_TELLRAW: u'No'}, cache_size=16)
+        >>> f is Formatter.configured({SAY_TO_TELLRAW: u'No', WORKERS_OPTION: 4}, cache_size=16)
+        True
+        >>> f is Formatter.configured({SAY_TO_TELLRAW: u'Use text'}, cache_size=16)
+        False
+        >>> len(Formatter.configured_formatters)
+        1
+
+        :param options: The options of the filter
+        :param kwargs: The other arguments of the formatter
+        :rtype: Formatter
+        """
+        key = (cls,) + tuple(options[name] for name, _, _ in cls.options) + tuple(sorted(kwargs.items()))
+        formatter = cls.configured_formatters.get(key)
+        if formatter is None:
+            cls.configured_formatters.clear()
+            formatter = cls.configured_formatters[key] = cls.new(options, **kwargs)
+
+        return formatter
 
 
 # The minecraft version this filter is made for
@@ -777,19 +1880,403 @@ inputs = (
     (u'/say to /tellraw', (u'Use Translate', u'Use Text', u'No')),
     (u'Update Numerical IDs', True),
     (u'Custom Command Path', (u'string', u'value=')),
+    (WORKERS_OPTION, (1, 1, 64)),
+    (INCREMENTAL_OPTION, False),
+    (DRY_RUN_OPTION, (u'string', u'value=')),
+    (TIMINGS_OPTION, False),
+    (SHARE_SUBTREES_OPTION, False),
 )
 
 update_num_ids = True
 
+# The number of formatted commands remembered during a run
+CACHE_SIZE = 4096
+
+# The number of commands sent at once to a worker process
+BATCH_SIZE = 256
+
+# The formatter of a worker process
+worker_formatter = None
+
+# The id of the command blocks as it is written in binary nbt
+CONTROL_ID_MARKER = nbt_string_marker(u'Control')
+
+# The file next to level.dat that remembers the chunks formatted by the last run
+MANIFEST_NAME = u'UpdateTo1_9.manifest.json'
+
+# The coordinates of a region in the name of its file
+REGION_NAME_PAT = LazyPattern(r'r\.(-?\d+)\.(-?\d+)\.mca$')
+
+# The values of the --say argument of the command line
+SAY_CHOICES = {u'translate': u'Use Translate', u'text': u'Use text', u'no': u'No'}
+
 displayName = u'UpdateTo1.9 MC{} R{}'.format(mc_version, release_version)
 
 
-@iter_on(lambda te: te[u'id'].value == u'Control', TILE_ENTITIES)
-def perform(level, box, options, tile_entities):
-    formatter = Formatter.new(options)
-    for cmd_block, _ in tile_entities():
+def init_worker(options):
+    """
+    Create the formatter of a worker process
+    """
+    global worker_formatter
+    worker_formatter = Formatter.new(options, cache_size=CACHE_SIZE,
+                                     share_subtrees=options.get(SHARE_SUBTREES_OPTION, False))
+
+
+def format_batch(commands):
+    """
+    Format a batch of commands with the formatter of the worker process
+    """
+    return [worker_formatter.format_command(cmd) for cmd in commands]
+
+
+def match_batch(commands):
+    """
+    Format a batch of commands with the formatter of the worker process and tell which command formatter matched each
+    """
+    return [worker_formatter.match_command(cmd) for cmd in commands]
+
+
+def map_command_blocks(fun, cmd_blocks, options):
+    """
+    Map fun on the commands of the command blocks in the worker processes, and yield each command block with its
+    result in order
+
+    Only the commands are sent to the workers. The command blocks are read as the workers need more commands, so only
+    the ones of the batches waiting for their result are held in this process
+
+    :param fun: The function applied on each batch of commands by the workers, format_batch or match_batch
+    :param cmd_blocks: The command blocks, pymclevel or binary tags
+    :param options: The options of the filter
+    :return: A generator of the command blocks with their result
+    """
+    pending = deque()
+
+    def commands():
+        for cmd_block in cmd_blocks:
+            pending.append(cmd_block)
+            yield cmd_block[u'Command'].value
+
+    batches = iter_batches(commands(), BATCH_SIZE)
+    for results in imap_batches(fun, batches, options.get(WORKERS_OPTION, 1), init_worker, (options,)):
+        for result in results:
+            yield pending.popleft(), result
+
+
+def run_formatter(options):
+    """
+    Get the formatter of a run
+
+    The timings and the shared subtrees are only the ones of a run, so they get a new formatter. Its cache of the
+    formatted commands is then only kept for the run, instead of the session
+
+    >>> run_formatter({SAY_TO_TELLRAW: u'No'}) is run_formatter({SAY_TO_TELLRAW: u'No'})
+    True
+    >>> run_formatter({SAY_TO_TELLRAW: u'No', SHARE_SUBTREES_OPTION: True}).subtrees is not None
+    True
+
+    :param options: The options of the filter
+    :rtype: Formatter
+    """
+    timings = options.get(TIMINGS_OPTION, False)
+    share_subtrees = options.get(SHARE_SUBTREES_OPTION, False)
+    if timings or share_subtrees:
+        return Formatter.new(options, cache_size=CACHE_SIZE, instrument=timings, share_subtrees=share_subtrees)
+
+    return Formatter.configured(options, cache_size=CACHE_SIZE)
+
+
+def format_command_blocks(cmd_blocks, options, formatter=None):
+    """
+    Format the commands of the command blocks
+
+    :param cmd_blocks: The command blocks, pymclevel or binary tags
+    :param options: The options of the filter
+    :param formatter: The formatter of the run, a new one of run_formatter whose timings are printed if None
+    :type formatter: Formatter
+    """
+    timings = options.get(TIMINGS_OPTION, False)
+    report = timings and formatter is None
+    if formatter is None:
+        formatter = run_formatter(options)
+
+    # The timings are recorded by the formatter of this process, and the workers only get the commands without their
+    # command block, so both need the serial run
+    workers = options.get(WORKERS_OPTION, 1)
+    if workers > 1 and not timings and not formatter.uses_nbt():
+        # The command blocks are changed in this process
+        for cmd_block, c in map_command_blocks(format_batch, cmd_blocks, options):
+            cmd_block[u'Command'].value = c
+
+        return
+
+    for cmd_block in cmd_blocks:
         cm = cmd_block[u'Command'].value
 
         c = formatter.format_command(cm, cmd_block)
 
         cmd_block[u'Command'].value = c
+
+    if report:
+        print(formatter.instrumentation_report())
+
+
+class CommandDiff(object):
+    """
+    Stream the commands a run would change to a JSON lines file, the unchanged ones are only counted
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), u'diff.jsonl')
+    >>> Tag = lambda value: BinaryTag(NBT_STRING if isinstance(value, unicode) else NBT_INT, value)
+    >>> with CommandDiff(path) as diff:
+    ...     diff_command_blocks([{u'x': Tag(1), u'y': Tag(2), u'z': Tag(3), u'Command': Tag(u'/testfor @p')},
+    ...                          {u'x': Tag(1), u'y': Tag(3), u'z': Tag(3),
+    ...                           u'Command': Tag(u'/summon Zombie ~ ~ ~ {Riding:{id:Pig}}')}], {SAY_TO_TELLRAW: u'No'}, diff)
+    >>> diff.summary()
+    u'1 commands would change, 1 would stay the same'
+    >>> print(open(path).read().strip())
+    {"x": 1, "y": 3, "z": 3, "old": "/summon Zombie ~ ~ ~ {Riding:{id:Pig}}", "new": "/summon Pig ~ ~ ~ {Passengers:[{id:Zombie}]}", "formatter": "summon_string"}
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the JSON lines file
+        """
+        self.file = io.open(path, u'w', encoding=u'utf-8')
+        self.changed = 0
+        self.unchanged = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def add(self, cmd_block, old, new, name):
+        """
+        Count a command and write it if it changes
+
+        :param cmd_block: The command block, used for its position
+        :param old: The command of the command block
+        :param new: The formatted command
+        :param name: The name of the command formatter that matched
+        """
+        if old == new:
+            self.unchanged += 1
+            return
+
+        self.changed += 1
+        line = OrderedDict([(u'x', cmd_block[u'x'].value), (u'y', cmd_block[u'y'].value),
+                            (u'z', cmd_block[u'z'].value), (u'old', old), (u'new', new), (u'formatter', name)])
+        self.file.write(unicode(json.dumps(line, ensure_ascii=False)) + u'\n')
+
+    def summary(self):
+        return u'{} commands would change, {} would stay the same'.format(self.changed, self.unchanged)
+
+
+def diff_command_blocks(cmd_blocks, options, diff, formatter=None):
+    """
+    Format the commands of the command blocks without changing them and add them to the diff
+
+    The commands are formatted by the worker processes like format_command_blocks does it. Either way the command
+    blocks are read as they are formatted, so the memory used doesn't depend on their number
+
+    :param cmd_blocks: The command blocks, pymclevel or binary tags
+    :param options: The options of the filter
+    :param diff: The diff the commands are added to
+    :type diff: CommandDiff
+    :param formatter: The formatter of the run, a new one of run_formatter if None
+    :type formatter: Formatter
+    """
+    if formatter is None:
+        formatter = run_formatter(options)
+
+    workers = options.get(WORKERS_OPTION, 1)
+    if workers > 1 and not formatter.uses_nbt():
+        for cmd_block, (new, name) in map_command_blocks(match_batch, cmd_blocks, options):
+            diff.add(cmd_block, cmd_block[u'Command'].value, new, name)
+
+        return
+
+    for cmd_block in cmd_blocks:
+        old = cmd_block[u'Command'].value
+        new, name = formatter.match_command(old, cmd_block)
+        diff.add(cmd_block, old, new, name)
+
+
+def manifest_key(options):
+    """
+    The version and the options that change the formatted commands, a manifest is only used with the same ones
+
+    >>> manifest_key({SAY_TO_TELLRAW: u'No'}) == manifest_key({SAY_TO_TELLRAW: u'No', WORKERS_OPTION: 4})
+    True
+    """
+    return u'{} {} {}'.format(release_version, options[SAY_TO_TELLRAW], update_num_ids)
+
+
+def open_manifest(level, options):
+    """
+    Open the manifest of the level if the unchanged chunks should be skipped
+    """
+    if not options.get(INCREMENTAL_OPTION):
+        return None
+
+    return ChunkManifest(os.path.join(os.path.dirname(level.filename), MANIFEST_NAME), manifest_key(options))
+
+
+@iter_on(lambda te: te[u'id'].value == u'Control', TILE_ENTITIES, markers=(CONTROL_ID_MARKER,), manifest=open_manifest,
+         read_only=lambda options: bool(options.get(DRY_RUN_OPTION)))
+def perform(level, box, options, tile_entities):
+    if options.get(DRY_RUN_OPTION):
+        with CommandDiff(options[DRY_RUN_OPTION]) as diff:
+            diff_command_blocks((cmd_block for cmd_block, _ in tile_entities()), options, diff)
+
+        print(diff.summary())
+        return
+
+    format_command_blocks((cmd_block for cmd_block, _ in tile_entities()), options)
+
+
+def convert_region(path, options, manifest=None, diff=None, formatter=None):
+    """
+    Format the command blocks of a region file without pymclevel
+
+    Only the chunks whose nbt contains the id of the command blocks are decoded and only the chunks whose commands
+    changed are written back. The command blocks of the whole region are formatted at once, also for the diff
+
+    :param path: The path of the region file
+    :param options: The options of the filter
+    :param manifest: The manifest used to skip the chunks whose command blocks didn't change since the last run
+    :type manifest: ChunkManifest
+    :param diff: The diff the changes are added to, nothing is written to the region file when it is given
+    :type diff: CommandDiff
+    :param formatter: The formatter of the run, shared by all its regions
+    :type formatter: Formatter
+    :return: The number of formatted command blocks, the number of written chunks and the number of skipped chunks
+    :rtype: (int, int, int)
+    """
+    match = REGION_NAME_PAT.search(path)
+    region_x, region_z = (int(match.group(1)), int(match.group(2))) if match is not None else (0, 0)
+
+    with RegionFile(path, writable=diff is None) as region:
+        chunks = []
+        skipped = 0
+        for x, z in region.chunks():
+            data = region.read_chunk(x, z)
+            if CONTROL_ID_MARKER not in data:
+                continue
+
+            name, root = decode_nbt(data)
+            tile_entities = root[u'Level'].get(u'TileEntities', ())
+            cmd_blocks = [te for te in tile_entities if te[u'id'].value == u'Control' and u'Command' in te]
+            if not cmd_blocks:
+                continue
+
+            position = (region_x * REGION_SIZE + x, region_z * REGION_SIZE + z)
+            if manifest is not None and manifest.unchanged(position, nbt_digest(cmd_blocks)):
+                skipped += 1
+                continue
+
+            chunks.append((x, z, position, name, root, cmd_blocks,
+                           [cmd_block[u'Command'].value for cmd_block in cmd_blocks]))
+
+        if diff is not None:
+            diff_command_blocks((cmd_block for chunk in chunks for cmd_block in chunk[5]), options, diff, formatter)
+            return sum(len(chunk[5]) for chunk in chunks), 0, skipped
+
+        format_command_blocks((cmd_block for chunk in chunks for cmd_block in chunk[5]), options, formatter)
+
+        written = 0
+        for x, z, position, name, root, cmd_blocks, commands in chunks:
+            if [cmd_block[u'Command'].value for cmd_block in cmd_blocks] != commands:
+                region.write_chunk(x, z, encode_nbt(name, root))
+                written += 1
+
+            if manifest is not None:
+                manifest.update(position, nbt_digest(cmd_blocks))
+
+        return sum(len(chunk[5]) for chunk in chunks), written, skipped
+
+
+def convert_world(path, options, incremental=False, diff=None):
+    """
+    Format the command blocks of all the region files of a world without pymclevel
+
+    A single formatter formats all the regions, so its cache and its shared subtrees are the ones of the whole world.
+    With several workers, each worker process has its own formatter for the region it formats
+
+    :param path: The path of the world folder
+    :param options: The options of the filter
+    :param incremental: If the chunks whose command blocks didn't change since the last run should be skipped
+    :type incremental: bool
+    :param diff: The diff the changes are added to, nothing is written to the world when it is given
+    :type diff: CommandDiff
+    :return: The number of formatted command blocks, the number of written chunks and the number of skipped chunks
+    :rtype: (int, int, int)
+    """
+    manifest = ChunkManifest(os.path.join(path, MANIFEST_NAME), manifest_key(options)) if incremental else None
+
+    formatter = run_formatter(options)
+
+    cmd_blocks = written = skipped = 0
+    for region_path in sorted(glob.glob(os.path.join(path, u'region', u'*.mca'))):
+        if os.path.getsize(region_path) == 0:
+            continue
+
+        region_cmd_blocks, region_written, region_skipped = convert_region(region_path, options, manifest, diff,
+                                                                           formatter)
+        cmd_blocks += region_cmd_blocks
+        written += region_written
+        skipped += region_skipped
+
+    # Only remembered once the run succeeded
+    if manifest is not None and diff is None:
+        manifest.save()
+
+    if options.get(TIMINGS_OPTION, False):
+        print(formatter.instrumentation_report())
+
+    return cmd_blocks, written, skipped
+
+
+def main(args=None):
+    """
+    Convert a world from the command line
+    """
+    # Only the command line needs argparse, MCEdit imports the filter without it
+    import argparse
+
+    parser = argparse.ArgumentParser(description=displayName + u' without MCEdit')
+    parser.add_argument(u'world', help=u'The folder of the world, it contains the region folder')
+    parser.add_argument(u'--say', choices=sorted(SAY_CHOICES), default=u'no', help=u'How /say commands are changed')
+    parser.add_argument(u'--workers', type=int, default=1, help=u'The number of worker processes')
+    parser.add_argument(u'--incremental', action=u'store_true',
+                        help=u'Skip the chunks whose command blocks didn\'t change since the last run')
+    parser.add_argument(u'--dry-run', metavar=u'DIFF_FILE',
+                        help=u'Write the commands that would change to a JSON lines file without changing the world')
+    parser.add_argument(u'--share-subtrees', action=u'store_true',
+                        help=u'Parse and migrate the identical parts of the nbts once for the whole world, or once per '
+                             u'region and worker process with --workers. They are all kept in memory until the end')
+    args = parser.parse_args(args)
+
+    if not os.path.isdir(os.path.join(args.world, u'region')):
+        parser.error(u'No region folder in {}'.format(args.world))
+
+    options = {SAY_TO_TELLRAW: SAY_CHOICES[args.say], WORKERS_OPTION: args.workers,
+               SHARE_SUBTREES_OPTION: args.share_subtrees}
+    if args.dry_run:
+        with CommandDiff(args.dry_run) as diff:
+            convert_world(args.world, options, args.incremental, diff)
+
+        print(diff.summary())
+        return
+
+    cmd_blocks, written, skipped = convert_world(args.world, options, args.incremental)
+    print(u'{} command blocks formatted, {} chunks written, {} unchanged chunks skipped'.format(cmd_blocks, written,
+                                                                                              skipped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Benchmark of a batch of different commands whose nbts share most of their subtrees, like the command blocks of a world
+
+Usage: python benchmarks/bench_batch.py [--commands 400] [--number 3] [--json RESULTS]
+
+Each configuration formats the whole batch with a new formatter, so the shared subtrees are only reused within the
+batch. The commands are all different, so the cache of the formatted commands is never used.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from UpdateTo1_9 import Formatter, NODE_ENGINE, CACHE_SIZE
+
+__author__ = u'Arth2000'
+
+ENCHANTMENTS = u'[' + u','.join(u'{id:' + unicode(i) + u',lvl:5}' for i in range(20)) + u']'
+
+ATTRIBUTES = u'[' + u','.join(u'{Name:generic.maxHealth,Base:' + unicode(i) + u'.0d,Modifiers:[{Name:"Mod ' +
+                              unicode(i) + u'",Amount:0.5d,Operation:1,UUIDLeast:1L,UUIDMost:2L}]}'
+                              for i in range(20)) + u']'
+
+
+def summon(i):
+    """
+    Build the i-th command of the batch, only its CustomName is different
+    """
+    return u'/summon Zombie ~ ~ ~ {CustomName:"Zombie ' + unicode(i) + u'",Equipment:[{id:276,tag:{ench:' + \
+        ENCHANTMENTS + u'}},{},{},{id:310,tag:{ench:' + ENCHANTMENTS + u'}},{id:397,Damage:1}],Attributes:' + \
+        ATTRIBUTES + u',Riding:{id:Pig},HealF:20F}'
+
+
+# The arguments of the formatter of each configuration
+CONFIGURATIONS = [
+    (u'iterative', {}),
+    (u'node', {u'snbt_engine': NODE_ENGINE}),
+    (u'shared', {u'share_subtrees': True}),
+]
+
+
+def run(commands, number):
+    results = []
+    for name, kwargs in CONFIGURATIONS:
+        durations = []
+        for _ in range(number):
+            formatter = Formatter(cache_size=CACHE_SIZE, **{str(k): v for k, v in kwargs.items()})
+            start = time.time()
+            for cmd in commands:
+                formatter.format_command(cmd)
+
+            durations.append(time.time() - start)
+
+        results.append({u'configuration': name, u'msec': min(durations) * 1e3,
+                        u'shared_nodes': len(formatter.subtrees) if formatter.subtrees is not None else None})
+
+    return results
+
+
+def print_results(results):
+    print(u'{:<14} {:>10} {:>13}'.format(u'configuration', u'msec', u'shared nodes'))
+    for result in results:
+        print(u'{:<14} {:>10.1f} {:>13}'.format(result[u'configuration'], result[u'msec'],
+                                                 result[u'shared_nodes'] if result[u'shared_nodes'] is not None
+                                                 else u'n/a'))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark of a batch of commands that share their subtrees')
+    parser.add_argument(u'--commands', type=int, default=400, help=u'The number of commands of the batch')
+    parser.add_argument(u'--number', type=int, default=3, help=u'The number of runs, the fastest is kept')
+    parser.add_argument(u'--json', help=u'Write the results to this file')
+    args = parser.parse_args(args)
+
+    results = run([summon(i) for i in range(args.commands)], args.number)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump({u'python': platform.python_version(), u'results': results}, results_file, indent=2,
+                      sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
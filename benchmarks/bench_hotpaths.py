@@ -0,0 +1,242 @@
+# coding=utf-8
+"""
+Benchmark of the parsing, stringify and command formatting hot paths on a corpus of realistic commands
+
+Usage: python benchmarks/bench_hotpaths.py [--number N] [--json RESULTS] [--save-baseline BASELINE]
+                                           [--baseline BASELINE] [--threshold 0.1]
+
+The allocations are measured with tracemalloc when it is available (Python 3, or Python 2 with pytracemalloc), they
+are the peak of traced memory per call in bytes. Without it the column shows n/a.
+
+When a baseline is given, the exit status is 1 if a case got slower than the threshold allows.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from filterutils import parse_compound, compound_string, parse_json, json_string, parse_selector, \
+    stream_compound_string, stream_json_string
+from UpdateTo1_9 import Formatter, SAY_TO_TEXT
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+__author__ = u'Arth2000'
+
+
+def escape(value):
+    """
+    Escape a command to put it in the Command string of a command block
+    """
+    return value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+
+
+def riding_stack(depth):
+    """
+    Build the nbt of an entity riding depth other entities
+    """
+    nbt = u'{id:Bat}'
+    for i in range(depth):
+        nbt = u'{id:Zombie,CustomName:"Rider ' + unicode(i) + u'",Equipment:[{id:276},{},{},{},{id:397,Damage:1}],' \
+              u'DropChances:[1F,0F,0F,0F,0.5F],Riding:' + nbt + u'}'
+
+    return nbt
+
+
+def nested_command(depth):
+    """
+    Build a /setblock of a command block whose command places a command block, depth times
+    """
+    cmd = u'/summon Zombie ~ ~ ~ {Riding:{id:Pig},CustomName:"Deep"}'
+    for _ in range(depth):
+        cmd = u'/setblock ~ ~1 ~ command_block 0 replace {Command:"' + escape(cmd) + u'"}'
+
+    return cmd
+
+
+SUMMON_NBT = riding_stack(16)
+
+TELLRAW_JSON = u'["",' + u','.join(
+    u'{text:"Part ' + unicode(i) + u' of a long message",color:gold,bold:true,clickEvent:{action:run_command,' +
+    u'value:"/tp @p ~ ~' + unicode(i) + u' ~"},hoverEvent:{action:show_text,value:{text:"Go up",italic:true}}}'
+    for i in range(100)) + u']'
+
+def nested_extra(depth):
+    """
+    Build a json text whose extra array contains another json text, depth times
+    """
+    json_value = u'{text:"Bottom"}'
+    for i in range(depth):
+        json_value = u'{text:"Level ' + unicode(i) + u'",color:red,bold:true,extra:[' + json_value + u',"!"]}'
+
+    return json_value
+
+
+NESTED_EXTRA_JSON = nested_extra(100)
+
+SAY_TEXT = u' '.join(u'§' + u'0123456789abcdef'[i % 16] + u'§' + u'lmnok'[i % 5] + u'Word' + unicode(i) +
+                     (u' @p' if i % 7 == 0 else u'') + u'§r' for i in range(60))
+
+SETBLOCK_COMMAND = nested_command(3)
+
+SELECTOR = u'@e[type=Zombie,r=10,rm=2,c=5,m=0,l=30,lm=1,team=red,name=Bob,rx=90,rxm=-90,ry=180,rym=-180,' + \
+           u','.join(u'score_objective{}_min={}'.format(i, i) for i in range(20)) + u']'
+
+# The commands of the benchmark
+COMMANDS = [
+    (u'summon_riding', u'/summon Skeleton ~ ~ ~ ' + SUMMON_NBT),
+    (u'tellraw_long', u'/tellraw @a ' + TELLRAW_JSON),
+    (u'say_formatting', u'/say ' + SAY_TEXT),
+    (u'setblock_nested', SETBLOCK_COMMAND),
+    (u'testfor_selector', u'/testfor ' + SELECTOR + u' {HealF:20F}'),
+]
+
+# The nbt tags of the benchmark
+COMPOUNDS = [
+    (u'summon_riding', SUMMON_NBT),
+    (u'setblock_nested', SETBLOCK_COMMAND[SETBLOCK_COMMAND.index(u'{'):]),
+]
+
+JSONS = [
+    (u'tellraw_long', TELLRAW_JSON),
+    (u'nested_extra', NESTED_EXTRA_JSON),
+]
+
+SELECTORS = [
+    (u'testfor_selector', SELECTOR),
+]
+
+
+def cases():
+    """
+    The functions to benchmark with their cases
+    """
+    for case, nbt in COMPOUNDS:
+        yield u'parse_compound', case, parse_compound, nbt
+        yield u'compound_string', case, compound_string, parse_compound(nbt)
+        yield u'stream_compound_string', case, stream_compound_string, parse_compound(nbt)
+
+    for case, json_value in JSONS:
+        yield u'parse_json', case, parse_json, json_value
+        yield u'json_string', case, json_string, parse_json(json_value)
+        yield u'stream_json_string', case, stream_json_string, parse_json(json_value)
+
+    for case, sel in SELECTORS:
+        yield u'parse_selector', case, parse_selector, sel
+
+    formatter = Formatter(SAY_TO_TEXT)
+    for case, cmd in COMMANDS:
+        yield u'format_command', case, formatter.format_command, cmd
+
+
+def ops_per_sec(fun, value, number):
+    return number / min(timeit.repeat(lambda: fun(value), number=number, repeat=3))
+
+
+def allocations(fun, value, number=10):
+    """
+    The peak of traced memory per call in bytes, None without tracemalloc
+    """
+    if tracemalloc is None:
+        return None
+
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(number):
+            tracemalloc.clear_traces()
+            fun(value)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+
+        return min(peaks)
+
+    finally:
+        tracemalloc.stop()
+
+
+def run(number):
+    results = []
+    for function, case, fun, value in cases():
+        results.append({u'function': function, u'case': case, u'ops_per_sec': ops_per_sec(fun, value, number),
+                        u'allocations': allocations(fun, value)})
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results with the ones of a baseline
+
+    :return: The cases slower than the baseline by more than the threshold
+    """
+    reference = {(r[u'function'], r[u'case']): r for r in baseline[u'results']}
+    regressions = []
+    for result in results:
+        old = reference.get((result[u'function'], result[u'case']))
+        if old is None:
+            result[u'change'] = None
+            continue
+
+        result[u'change'] = result[u'ops_per_sec'] / old[u'ops_per_sec'] - 1
+        if result[u'change'] < -threshold:
+            regressions.append(result)
+
+    return regressions
+
+
+def print_results(results):
+    print(u'{:<22} {:<18} {:>12} {:>14} {:>10}'.format(u'function', u'case', u'ops/sec', u'bytes/call', u'change'))
+    for result in results:
+        alloc = result[u'allocations']
+        change = result.get(u'change')
+        print(u'{:<22} {:<18} {:>12.1f} {:>14} {:>10}'.format(
+            result[u'function'], result[u'case'], result[u'ops_per_sec'], u'n/a' if alloc is None else alloc,
+            u'' if change is None else u'{:+.1%}'.format(change)))
+
+
+def write_json(path, results):
+    with open(path, 'w') as results_file:
+        json.dump({u'python': platform.python_version(), u'results': results}, results_file, indent=2,
+                  sort_keys=True)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark of the parsing, stringify and formatting hot paths')
+    parser.add_argument(u'--number', type=int, default=100, help=u'The number of calls of each timing')
+    parser.add_argument(u'--json', help=u'Write the results to this file')
+    parser.add_argument(u'--save-baseline', help=u'Write the results to this file to compare the next runs with')
+    parser.add_argument(u'--baseline', help=u'Compare the results with the ones written by --save-baseline')
+    parser.add_argument(u'--threshold', type=float, default=0.1,
+                        help=u'The relative loss of ops/sec above which a case is reported as slower')
+    args = parser.parse_args(args)
+
+    results = run(args.number)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+
+    print_results(results)
+
+    if args.json:
+        write_json(args.json, results)
+
+    if args.save_baseline:
+        write_json(args.save_baseline, results)
+
+    for result in regressions:
+        print(u'SLOWER: {} {} {:+.1%}'.format(result[u'function'], result[u'case'], result[u'change']))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
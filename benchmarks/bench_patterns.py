@@ -0,0 +1,126 @@
+# coding=utf-8
+"""
+Benchmark of the command patterns on pathological commands, with the regexes and with the compiled patterns
+
+Usage: python benchmarks/bench_patterns.py [--sizes 100,200,400,800] [--json RESULTS] [--max-exponent 1.5]
+
+Each case is a command that almost matches its pattern, built with a growing size. The growth column is the
+exponent of the time as a function of the size: 1 when matching is linear, 2 when it is quadratic.
+
+The compiled patterns are the ones of CommandPatternFormatter.compile: a TokenPattern when an {nbt} or {json}
+placeholder or a glued word is followed by more of the pattern, the regex otherwise.
+
+The exit status is 1 if the compiled pattern grows faster than the max exponent on a case.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from UpdateTo1_9 import CommandPatternFormatter
+
+__author__ = u'Arth2000'
+
+
+def nbt_with_closings(size):
+    """
+    Build a compound whose strings contain size '} {' and '} 1 2 3', the places a regex can try to end it at
+    """
+    return u'{' + u','.join(u'a' + unicode(i) + u':"} {b:1} 1 2 3"' for i in range(size)) + u'}'
+
+
+# The pattern, and the function that builds a command of the given size that almost matches it
+CASES = [
+    (u'two_nbt', u'try {nbt1} {nbt2} {block}',
+     lambda size: u'try ' + nbt_with_closings(size) + u' ' + nbt_with_closings(size) + u' stone extra'),
+    (u'summon_at', u'summon-at {entity} {nbt} {pos}',
+     lambda size: u'/summon-at Zombie ' + nbt_with_closings(size) + u' ~ ~1 ~ extra'),
+    (u'summon_if_at', u'summon-if-at {entity} {nbt} {sel} {pos}',
+     lambda size: u'/summon-if-at Zombie ' + nbt_with_closings(size) + u' @p ~ ~1'),
+    (u'give_unclosed', u'/give {sel} {item} {amount} {data} {nbt}',
+     lambda size: u'/give @p stone 1 0 ' + nbt_with_closings(size)[:-1]),
+    (u'execute_long', u'execute {sel} {pos} {cmd}',
+     lambda size: u'execute @p ~ ~ ' + u'1' * size + u'x /say ' + nbt_with_closings(size)),
+    (u'glued_word', u'summon-at {entity}: {nbt} {pos}',
+     lambda size: u'/summon-at Zombie: ' + nbt_with_closings(size) + u' ~ ~1 ~ extra'),
+]
+
+
+def per_call(fun, value, min_time=0.02):
+    """
+    The time of a call in seconds, with enough calls to be measured
+    """
+    number = 1
+    while True:
+        duration = min(timeit.repeat(lambda: fun(value), number=number, repeat=3))
+        if duration >= min_time:
+            return duration / number
+
+        number *= 10
+
+
+def growth(sizes, times):
+    """
+    The exponent of the time as a function of the size, between the smallest and the largest size
+    """
+    return math.log(times[-1] / times[0]) / math.log(float(sizes[-1]) / sizes[0])
+
+
+def run(sizes):
+    formatter = CommandPatternFormatter()
+    results = []
+    for case, format_string, build in CASES:
+        commands = [build(size) for size in sizes]
+        for matcher, pattern in ((u'regex', re.compile(formatter.format(format_string))),
+                                 (u'compiled', formatter.compile(format_string))):
+            if any(pattern.match(cmd) is not None for cmd in commands):
+                raise AssertionError(u'The {} matcher matches a command of the {} case'.format(matcher, case))
+
+            times = [per_call(pattern.match, cmd) for cmd in commands]
+            results.append({u'case': case, u'matcher': matcher, u'sizes': sizes, u'usec': [t * 1e6 for t in times],
+                            u'growth': growth(sizes, times)})
+
+    return results
+
+
+def print_results(results):
+    sizes = results[0][u'sizes']
+    print(u'{:<14} {:<11} '.format(u'case', u'matcher') + u' '.join(u'{:>12}'.format(size) for size in sizes) +
+          u' {:>7}'.format(u'growth'))
+    for result in results:
+        print(u'{:<14} {:<11} '.format(result[u'case'], result[u'matcher']) +
+              u' '.join(u'{:>12.1f}'.format(t) for t in result[u'usec']) + u' {:>7.2f}'.format(result[u'growth']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark of the command patterns on pathological commands')
+    parser.add_argument(u'--sizes', default=u'100,200,400,800',
+                        help=u'The sizes of the commands of each case, separated by commas')
+    parser.add_argument(u'--json', help=u'Write the results to this file')
+    parser.add_argument(u'--max-exponent', type=float, default=1.5,
+                        help=u'The growth above which a case of the compiled patterns is reported')
+    args = parser.parse_args(args)
+
+    results = run([int(size) for size in args.sizes.split(u',')])
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump({u'python': platform.python_version(), u'results': results}, results_file, indent=2,
+                      sort_keys=True)
+
+    slower = [r for r in results if r[u'matcher'] == u'compiled' and r[u'growth'] > args.max_exponent]
+    for result in slower:
+        print(u'NOT LINEAR: {} {:.2f}'.format(result[u'case'], result[u'growth']))
+
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# coding=utf-8
+"""
+Benchmark of the literal nbt tags parsing engines and of the commands formatted with each of them
+
+Usage: python benchmarks/bench_snbt.py [--number 200] [--json RESULTS]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from filterutils import SNBT_ENGINES, CHAR_ENGINE, materialize, SNBTCompound, SNBTScalar
+from UpdateTo1_9 import Formatter
+
+__author__ = u'Arth2000'
+
+ENCHANTMENTS = u'[' + u','.join(u'{id:' + unicode(i) + u',lvl:5}' for i in range(20)) + u']'
+
+PAGES = u'[' + u','.join(u'"{text:\\"Page ' + unicode(i) + u' of a long written book\\",color:gold}"'
+                         for i in range(50)) + u']'
+
+ATTRIBUTES = u'[' + u','.join(u'{Name:generic.maxHealth,Base:' + unicode(i) + u'.0d,Modifiers:[{Name:"Mod ' +
+                              unicode(i) + u'",Amount:0.5d,Operation:1,UUIDLeast:1L,UUIDMost:2L}]}'
+                              for i in range(20)) + u']'
+
+# The nbt tags of the benchmark
+COMPOUNDS = [
+    (u'summon', u'{Equipment:[{id:276,tag:{ench:' + ENCHANTMENTS + u'}},{},{},{},{id:397,Damage:1}],Attributes:' +
+     ATTRIBUTES + u',Riding:{id:Pig,Riding:{id:Bat}},HealF:20F,DropChances:[1F,0F,0F,0F,0.5F]}'),
+    (u'give', u'{pages:' + PAGES + u',title:"A Book",author:Arth2000}'),
+    (u'setblock', u'{Command:"/summon Zombie ~ ~ ~ {Riding:{id:Pig},CustomName:\\"The \\\\\\"Zombie\\\\\\"\\"}"}'),
+]
+
+JSONS = [
+    (u'tellraw', u'["",{text:"Hello ",color:red,extra:[' +
+     u','.join(u'{text:"part ' + unicode(i) + u'",bold:true,clickEvent:{action:run_command,value:"/say hi"}}'
+               for i in range(30)) + u']}]'),
+]
+
+
+# The commands of the benchmark
+COMMANDS = [
+    (u'summon', u'/summon Zombie ~ ~ ~ ' + COMPOUNDS[0][1]),
+    (u'give', u'/give @p written_book 1 0 ' + COMPOUNDS[1][1]),
+    (u'setblock', u'/setblock ~ ~1 ~ command_block 0 replace ' + COMPOUNDS[2][1]),
+    (u'tellraw', u'/tellraw @a ' + JSONS[0][1]),
+]
+
+
+def materialize_all(value):
+    """
+    Parse every raw tag left by the lazy engine and turn the nodes of the node engine back into builtin types
+    """
+    value = materialize(value)
+    if isinstance(value, SNBTCompound):
+        return {key: materialize_all(node) for key, node in value.items()}
+
+    elif isinstance(value, SNBTScalar):
+        return value.text
+
+    elif isinstance(value, dict):
+        return {key: materialize_all(dict.__getitem__(value, key)) for key in value}
+
+    elif isinstance(value, list):
+        return [materialize_all(list.__getitem__(value, i)) for i in range(len(value))]
+
+    return value
+
+
+def bench(fun, value, number):
+    return min(timeit.repeat(lambda: fun(value), number=number, repeat=3)) / number
+
+
+def run(number):
+    results = []
+
+    for function, cases in ((u'compound', COMPOUNDS), (u'json', JSONS)):
+        for case, value in cases:
+            reference = None
+            for name in sorted(SNBT_ENGINES, key=lambda n: n != CHAR_ENGINE):
+                engine = SNBT_ENGINES[name]
+                fun = engine.parse_compound if function == u'compound' else engine.parse_json
+
+                if reference is None:
+                    reference_result = fun(value)
+
+                elif materialize_all(fun(value)) != reference_result:
+                    raise AssertionError(u'The {} engine gives a different result for {}'.format(name, case))
+
+                duration = bench(fun, value, number)
+                reference = reference or duration
+
+                results.append({u'function': function, u'case': case, u'engine': name, u'usec': duration * 1e6,
+                                u'speedup': reference / duration})
+
+    for case, cmd in COMMANDS:
+        reference = None
+        for name in sorted(SNBT_ENGINES, key=lambda n: n != CHAR_ENGINE):
+            formatter = Formatter(snbt_engine=name)
+
+            duration = bench(formatter.format_command, cmd, number)
+            reference = reference or duration
+
+            results.append({u'function': u'command', u'case': case, u'engine': name, u'usec': duration * 1e6,
+                            u'speedup': reference / duration})
+
+    return results
+
+
+def print_results(results):
+    print(u'{:<10} {:<10} {:<10} {:>12} {:>10}'.format(u'function', u'case', u'engine', u'usec/call', u'speedup'))
+    for result in results:
+        print(u'{:<10} {:<10} {:<10} {:>12.1f} {:>9.2f}x'.format(result[u'function'], result[u'case'],
+                                                               result[u'engine'], result[u'usec'],
+                                                               result[u'speedup']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark of the literal nbt tags parsing engines')
+    parser.add_argument(u'--number', type=int, default=200, help=u'The number of calls of each timing')
+    parser.add_argument(u'--json', help=u'Write the results to this file')
+    args = parser.parse_args(args)
+
+    results = run(args.number)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump({u'python': platform.python_version(), u'results': results}, results_file, indent=2,
+                      sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# coding=utf-8
+"""
+Benchmark of the startup of the filter: the import of the module, the first formatter and the first command
+
+Usage: python benchmarks/bench_startup.py [--number 10] [--json RESULTS]
+
+Each measure runs in a new interpreter, like MCEdit opening its Filter panel. The first interpreter only writes the
+bytecode of the modules, unless PYTHONDONTWRITEBYTECODE is set: then every import also compiles the sources.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+__author__ = u'Arth2000'
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# The script run by each interpreter, it prints the durations in seconds
+MEASURE = u'''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.time()
+import UpdateTo1_9
+imported = time.time()
+options = {{UpdateTo1_9.SAY_TO_TELLRAW: u'No'}}
+formatter = UpdateTo1_9.Formatter.configured(options, cache_size=UpdateTo1_9.CACHE_SIZE)
+created = time.time()
+formatter.format_command(u'/summon Zombie ~ ~ ~ {{Riding:{{id:Pig}}}}')
+formatted = time.time()
+UpdateTo1_9.Formatter.configured(options, cache_size=UpdateTo1_9.CACHE_SIZE)
+print(' '.join(str(t) for t in (imported - start, created - imported, formatted - created, time.time() - formatted)))
+'''
+
+STEPS = [u'import', u'first_formatter', u'first_command', u'next_formatter']
+
+
+def measure():
+    """
+    :return: The duration of each step in a new interpreter, in seconds
+    """
+    output = subprocess.check_output([sys.executable, u'-c', MEASURE.format(root=os.path.abspath(ROOT))])
+    return [float(t) for t in output.split()]
+
+
+def run(number):
+    measure()
+    runs = [measure() for _ in range(number)]
+    return [{u'step': step, u'msec': min(r[i] for r in runs) * 1e3} for i, step in enumerate(STEPS)]
+
+
+def print_results(results):
+    print(u'{:<16} {:>10}'.format(u'step', u'msec'))
+    for result in results:
+        print(u'{:<16} {:>10.2f}'.format(result[u'step'], result[u'msec']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=u'Benchmark of the startup of the filter')
+    parser.add_argument(u'--number', type=int, default=10, help=u'The number of interpreters, the fastest is kept')
+    parser.add_argument(u'--json', help=u'Write the results to this file')
+    args = parser.parse_args(args)
+
+    results = run(args.number)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump({u'python': platform.python_version(), u'results': results}, results_file, indent=2,
+                      sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,12 +4,47 @@ MCEdit filter utilities
 
 Current utilities:
     iter_tile_entities: A decorator to use on the perform function to iter some of the tile entities
+    imap_batches: Map a stream of batches in a pool of worker processes
+    iter_batches and BatchStats: Split a stream of values in batches and count what is done with them
+    ChunkManifest: Remember a hash of the formatted entities of each chunk to skip them on the next run
     use_if: A decorator to use on command declarations that will disable their use if the given value is False
     make_place_around: A function that create a place_around function using the given prefix
+    LazyPattern: A regex compiled the first time it is used
+    LRUCache: A size-bounded least recently used cache
+    IdRegistry and ITEM_IDS: The names of the numeric ids, with their quoted namespaced names built once
+    Instrumentation: Counters and cumulative timers grouped by name
     Some parsing commands for literal nbt tags
+    scan_compound, scan_list and scan_json: Faster parsing commands that scan the literal nbt tags with regexes
+    scan_entry: Scan the next key and value of a literal nbt tag, the faster parsing commands read the tags with it
+    SNBT_ENGINES: The sets of parsing commands that can be used for literal nbt tags
     Some stringify commands for builtin nbt tags
+    iter_parse_compound, iter_parse_list and iter_parse_json: Versions of the parsing commands that don't use recursion
+    stream_compound_string and stream_json_string: Stringify commands that don't use recursion and write in a single
+        buffer or in a file
+    lazy_parse_compound and lazy_parse_list: Parsing commands that keep the tags they contain as raw spans until they
+        are read
+    SNBTScalar and SNBTCompound: Compact nodes of the parsed tags, made by node_parse_compound and node_parse_list
+    SubtreeTable and thaw: Share the identical subtrees of the parsed tags as frozen nodes, and copy them to change them
+    rewrite_command_strings: Rewrite the Command strings of a raw tag in place, one escape level at a time
+    pattern_keyword and command_keyword: Find the command word used to index the command formatters
+    balanced_end: Find the end of a bracketed span or of a quoted string in a command in a single pass
+    CommandTokens: A command that splits itself in typed tokens, scanned once and shared by the command patterns
+    decode_nbt and encode_nbt: Read and write binary nbt without pymclevel, only decoding and copying the tags
+        that are read
+    RegionFile: Read and write the chunks of an Anvil region file through a memory map
 """
+import hashlib
+import itertools
+import json
+import mmap
+import os
 import re
+import struct
+import sys
+import time
+import timeit
+import zlib
+from collections import OrderedDict, deque, namedtuple
 try:
     from pymclevel.nbt import TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, TAG_FLOAT, TAG_DOUBLE, TAG_STRING, \
         TAG_Compound, TAG_List
@@ -31,6 +66,41 @@ WHOLE_WORLD_OPTION = u'On'
 WHOLE_WORLD = u'Whole World'
 BOX = u'Box'
 
+
+class LazyPattern(object):
+    """
+    A regex compiled the first time it is used, so that importing the filters doesn't compile all their patterns
+
+    The attributes of the compiled pattern are kept on the lazy pattern once they are read, so reading them again
+    costs the same as with the compiled pattern. A lazy pattern isn't a compiled pattern for the functions of re, so
+    the patterns that were public before, SEL_PAT and json_values, are still compiled when the module is imported
+
+    >>> pattern = LazyPattern(r'(?P<number>[0-9]+)')
+    >>> pattern.compiled is None
+    True
+    >>> pattern.match(u'42').group(u'number')
+    u'42'
+    >>> pattern.pattern, pattern.compiled is None
+    ('(?P<number>[0-9]+)', False)
+    """
+
+    def __init__(self, pattern, flags=0):
+        """
+        :param pattern: The source of the regex
+        :param flags: The flags of the regex
+        """
+        self.source = pattern
+        self.source_flags = flags
+        self.compiled = None
+
+    def __getattr__(self, name):
+        if self.compiled is None:
+            self.compiled = re.compile(self.source, self.source_flags)
+
+        value = getattr(self.compiled, name)
+        setattr(self, name, value)
+        return value
+
 ITEMS_TABLE = {0: u'air', 1: u'stone', 2: u'grass', 3: u'dirt', 4: u'cobblestone', 5: u'planks', 6: u'sapling',
                7: u'bedrock',
                8: u'flowing_water', 9: u'water', 10: u'flowing_lava', 11: u'lava', 12: u'sand', 13: u'gravel',
@@ -151,6 +221,148 @@ ITEMS_TABLE = {0: u'air', 1: u'stone', 2: u'grass', 3: u'dirt', 4: u'cobblestone
                424: u'cooked_mutton', 425: u'banner', 427: u'spruce_door', 428: u'birch_door', 429: u'jungle_door',
                430: u'acacia_door', 431: u'dark_oak_door'}
 
+# A numeric id as it is written in a tag, with its optional type suffix
+NUMERIC_ID_TEXT_PAT = LazyPattern(r'^-?\d+(?P<type>[bBsSlL])?$')
+
+
+class IdRegistry(object):
+    """
+    The names of the numeric ids, in lists indexed by the id
+
+    The quoted namespaced names are built once, and so is the quoted name of each id written as in a tag, so that
+    changing a numeric id is a single lookup. The data values can have their own names. The tables are built the
+    first time one of them is read.
+
+    >>> ids = IdRegistry({1: u'stone', 2: u'grass', 26: u'bed', 355: u'bed'}, variants={(1, 1): u'granite'})
+    >>> ids.quoted(2)
+    u'"minecraft:grass"'
+    >>> ids.quote_text(u'2s'), ids.quote_text(u'002'), ids.quote_text(u'stone')
+    (u'"minecraft:grass"', u'"minecraft:grass"', None)
+    >>> ids.id(u'bed'), ids.name(1, 1), ids.name(1, 2)
+    (355, u'granite', u'stone')
+    >>> ids.quoted(3)
+    Traceback (most recent call last):
+    ...
+    KeyError: 3
+    """
+
+    def __init__(self, names, namespace=u'minecraft', variants=None):
+        """
+        :param names: The names of the ids
+        :type names: dict
+        :param namespace: The namespace of the names
+        :param variants: The names of some data values of the ids, by (id, data)
+        :type variants: dict
+        """
+        self.table = names
+        self.namespace = namespace
+        self.variants = dict(variants or {})
+
+    def __getattr__(self, name):
+        if name not in (u'names', u'quoted_names', u'ids', u'texts'):
+            raise AttributeError(name)
+
+        self.build()
+        return getattr(self, name)
+
+    def build(self):
+        """
+        Build the tables of the ids
+        """
+        size = max(self.table) + 1 if self.table else 0
+        names = [None] * size
+        quoted_names = [None] * size
+
+        # The id of each name, the item id when a block and an item share the name
+        ids = {}
+
+        # The quoted names of the ids written with each type suffix
+        texts = {}
+
+        for id, name in sorted(self.table.items()):
+            quoted = u'"' + self.namespace + u':' + name + u'"'
+            names[id] = name
+            quoted_names[id] = quoted
+            ids[name] = id
+
+            text = unicode(id)
+            texts[text] = quoted
+            for suffix in u'bBsSlL':
+                texts[text + suffix] = quoted
+
+        self.names = names
+        self.quoted_names = quoted_names
+        self.ids = ids
+        self.texts = texts
+
+    def name(self, id, data=None):
+        """
+        :param id: The id
+        :param data: The data value, None for the name of the id itself
+        :return: The name of the data value of the id if it has one, else the name of the id
+        """
+        if data is not None:
+            variant = self.variants.get((id, data))
+            if variant is not None:
+                return variant
+
+        return self.__get(self.names, id)
+
+    def quoted(self, id):
+        """
+        :param id: The id
+        :return: The quoted namespaced name of the id, as it is written in a tag
+        """
+        return self.__get(self.quoted_names, id)
+
+    def quote_text(self, text):
+        """
+        :param text: The id as it is written in a tag
+        :return: The quoted namespaced name of the id, None if the text isn't a numeric id
+        """
+        quoted = self.texts.get(text)
+        if quoted is not None:
+            return quoted
+
+        # The ids written with leading zeros, and the unknown ids that raise a KeyError
+        match = NUMERIC_ID_TEXT_PAT.match(text)
+        if match is None:
+            return None
+
+        return self.quoted(int(text[:-1] if match.group(u'type') is not None else text))
+
+    def quote_value(self, value):
+        """
+        >>> ids = IdRegistry({1: u'stone'})
+        >>> ids.quote_value(SNBTScalar.parse(u'1b')), ids.quote_value(SNBTScalar.parse(u'1.0')), ids.quote_value(u'1')
+        (u'"minecraft:stone"', None, u'"minecraft:stone"')
+
+        :param value: The id as it is written in a tag, or its scalar node whose decoded number is used as it is
+        :return: The quoted namespaced name of the id, None if the value isn't a numeric id
+        """
+        if isinstance(value, SNBTScalar):
+            return self.quoted(value.number) if value.type in SCALAR_INTEGER_TYPES else None
+
+        return self.quote_text(value)
+
+    def id(self, name):
+        """
+        :param name: The name, without namespace
+        :return: The id with that name, None if there isn't one
+        """
+        return self.ids.get(name)
+
+    @staticmethod
+    def __get(values, id):
+        value = values[id] if 0 <= id < len(values) else None
+        if value is None:
+            raise KeyError(id)
+
+        return value
+
+
+ITEM_IDS = IdRegistry(ITEMS_TABLE)
+
 # Parsing functions
 SEL_PAT = re.compile(r'^@[apre](\[.*\])?$')
 IMPLICIT_KEYS = [u'x', u'y', u'z', u'r']
@@ -167,7 +379,129 @@ objects = {
 }
 
 
-def iter_on(predicate, what=TILE_AND_ENTITIES, whole_world_option=WHOLE_WORLD_OPTION, whole_world_=WHOLE_WORLD):
+def chunk_may_match(level, cx, cz, markers):
+    """
+    Check if the saved bytes of a chunk contain one of the markers without loading the chunk
+
+    The chunks already loaded by the level, whose saved bytes may be outdated, and the chunks that can't be read
+    always match
+
+    Args:
+        level: The level
+        cx: The x coordinate of the chunk
+        cz: The z coordinate of the chunk
+        markers: The byte strings to search
+
+    Returns (bool): False if the chunk can't contain any of the markers
+
+    """
+    position = (cx, cz)
+    if position in getattr(level, '_loadedChunks', ()) or position in getattr(level, '_loadedChunkData', ()):
+        return True
+
+    try:
+        data = level.worldFolder.readChunk(cx, cz)
+
+    except Exception:
+        return True
+
+    return any(marker in data for marker in markers)
+
+
+def nbt_digest(tags):
+    """
+    Hash the content of some pymclevel or binary tags
+
+    >>> tag = BinaryTag(NBT_COMPOUND, OrderedDict([(u'Command', BinaryTag(NBT_STRING, u'/say hi'))]))
+    >>> nbt_digest([tag]) == nbt_digest([tag])
+    True
+    >>> tag[u'Command'].value = u'/say ho'
+    >>> nbt_digest([tag]) == nbt_digest([])
+    False
+
+    Args:
+        tags: The tags
+
+    Returns (unicode): The hex digest of the tags
+
+    """
+    digest = hashlib.sha1()
+    for tag in tags:
+        if isinstance(tag, BinaryTag):
+            data = bytearray()
+            data.append(tag.type)
+            encode_nbt_tag(tag, data)
+            digest.update(buffer(data))
+
+        else:
+            digest.update(nbt_string(tag).encode('utf-8'))
+
+    return unicode(digest.hexdigest())
+
+
+class ChunkManifest(object):
+    """
+    A file next to a world that remembers a hash of the formatted entities of each chunk after the last run
+
+    The hashes are only kept while the key, made of the version and the options of the filter, stays the same
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), u'manifest.json')
+    >>> manifest = ChunkManifest(path, u'1.1.3 No')
+    >>> manifest.update((0, -1), u'abc')
+    >>> manifest.save()
+    >>> ChunkManifest(path, u'1.1.3 No').unchanged((0, -1), u'abc')
+    True
+    >>> ChunkManifest(path, u'1.1.3 Use text').unchanged((0, -1), u'abc')
+    False
+    """
+
+    def __init__(self, path, key):
+        """
+        Args:
+            path: The path of the manifest, it doesn't need to exist
+            key: The version and the options of the filter
+        """
+        self.path = path
+        self.key = key
+        self.digests = {}
+
+        try:
+            with open(path) as manifest_file:
+                content = json.load(manifest_file)
+
+        except (IOError, ValueError):
+            content = None
+
+        if isinstance(content, dict) and content.get(u'key') == key:
+            self.digests = content.get(u'chunks', {})
+
+    @staticmethod
+    def position_key(position):
+        return u'{},{}'.format(*position)
+
+    def unchanged(self, position, digest):
+        """
+        Check if the hash of a chunk is the one remembered from the last run
+        """
+        return self.digests.get(self.position_key(position)) == digest
+
+    def update(self, position, digest):
+        self.digests[self.position_key(position)] = digest
+
+    def save(self):
+        temp_path = self.path + u'.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump({u'key': self.key, u'chunks': self.digests}, manifest_file, sort_keys=True)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        os.rename(temp_path, self.path)
+
+
+def iter_on(predicate, what=TILE_AND_ENTITIES, whole_world_option=WHOLE_WORLD_OPTION, whole_world_=WHOLE_WORLD,
+            markers=None, manifest=None, read_only=None):
     """
     Iterate on the entities and/or tile entities in the box or the whole world
 
@@ -176,6 +510,12 @@ def iter_on(predicate, what=TILE_AND_ENTITIES, whole_world_option=WHOLE_WORLD_OP
         what: On what (Entities, TileEntities or both) this should iterate
         whole_world_option: The name of the option used to know if the filter should be applied on the whole world
         whole_world_: The value if it should be used on the whole world
+        markers: Byte strings, like the binary nbt of an id, that the chunks must contain to be loaded. None to load
+            all the chunks
+        manifest: A function that given the level and the options returns the ChunkManifest used to skip the chunks
+            whose entities didn't change since the last run, or None to not use one
+        read_only: A function that given the options returns True if the level must not be changed, then no chunk
+            is marked as dirty and the manifest isn't updated
 
     Returns:
 
@@ -189,31 +529,160 @@ def iter_on(predicate, what=TILE_AND_ENTITIES, whole_world_option=WHOLE_WORLD_OP
 
             dirty_chunks = []
 
-            all_chunks = (chunk for chunk, slices, point in level.getChunkSlices(box))
+            dry_run = read_only is not None and read_only(options)
+
+            chunk_manifest = manifest(level, options) if manifest is not None else None
+            formatted_chunks = []
+
+            if markers is None:
+                all_chunks = (chunk for chunk, slices, point in level.getChunkSlices(box))
+
+            else:
+                # The chunks are searched before they are loaded, most of them don't need to be
+                all_chunks = (level.getChunk(cx, cz) for cx, cz in box.chunkPositions
+                              if level.containsChunk(cx, cz) and chunk_may_match(level, cx, cz, markers))
 
             # Generator that yields that tile entities
             def get_tile_entities():
                 for chunk in all_chunks:
-                    dirty = False
-                    for key, name in objects.iteritems():
-                        if what & key:
-                            for entity in chunk.__getattribute__(name)(box):
-                                if predicate(entity):
-                                    yield entity, key
+                    entities = [(entity, key) for key, name in objects.iteritems() if what & key
+                                for entity in chunk.__getattribute__(name)(box) if predicate(entity)]
+                    if not entities:
+                        continue
 
-                                    if not dirty:  # Stock the dirty chunks to not mark as dirty not dirty chunks
-                                        dirty = True
-                                        dirty_chunks.append(chunk)
+                    if chunk_manifest is not None:
+                        if chunk_manifest.unchanged(chunk.chunkPosition, nbt_digest(e for e, _ in entities)):
+                            continue
+
+                        if not dry_run:
+                            formatted_chunks.append((chunk.chunkPosition, entities))
+
+                    # Stock the dirty chunks to not mark as dirty not dirty chunks
+                    if not dry_run:
+                        dirty_chunks.append(chunk)
+
+                    for item in entities:
+                        yield item
 
             fun(level, box, options, get_tile_entities)
 
             for chunk in dirty_chunks:
                 level.markDirtyChunk(*chunk.chunkPosition)
 
+            # Only remembered once the run succeeded
+            if chunk_manifest is not None and not dry_run:
+                for position, entities in formatted_chunks:
+                    chunk_manifest.update(position, nbt_digest(e for e, _ in entities))
+
+                chunk_manifest.save()
+
         return __iter_on
 
     return _iter_on
 
+
+def iter_batches(values, batch_size):
+    """
+    Split the values in lists of at most batch_size values without reading more than one batch at a time
+
+    >>> list(iter_batches(iter(range(5)), 2))
+    [[0, 1], [2, 3], [4]]
+
+    :param values: The values to split, can be a generator
+    :param batch_size: The maximum number of values in each batch
+    :type batch_size: int
+    :return: A generator of the batches in the order of the values
+    """
+    values = iter(values)
+    while True:
+        batch = list(itertools.islice(values, batch_size))
+        if not batch:
+            return
+
+        yield batch
+
+
+class BatchStats(namedtuple('BatchStats', ['index', 'commands', 'formatted', 'seconds'])):
+    """
+    The counters of a batch of commands: its index, the number of commands in it, the number of commands that had to
+    be formatted because they weren't seen before and the time spent on it
+    """
+
+    @property
+    def throughput(self):
+        """
+        The number of commands per second
+        """
+        return self.commands / self.seconds if self.seconds > 0 else float('inf')
+
+
+def imap_batches(fun, batches, workers=1, initializer=None, initargs=(), window=None):
+    """
+    Apply fun on each batch, in a pool of worker processes if more than one worker is asked, and yield the results in
+    the order of the batches
+
+    The batches are read as the workers need them: at most window batches are sent ahead of the result yielded last,
+    so the memory used doesn't depend on the number of batches. fun, the batches and the results must be picklable.
+    When the pool can't be created, or when there is a single batch, the batches are mapped in this process. So are
+    they in a frozen executable, like MCEdit on Windows, whose worker processes would start the executable again
+    instead of python
+
+    >>> list(imap_batches(sum, iter([[1, 2], [3], [4, 5, 6]]), workers=2, window=2))
+    [3, 3, 15]
+    >>> list(imap_batches(sum, iter([[1, 2], [3]])))
+    [3, 3]
+
+    :param fun: The function applied on each batch
+    :param batches: The batches, can be a generator
+    :param workers: The number of worker processes, 1 or less to not use any
+    :type workers: int
+    :param initializer: A function called with initargs in each worker before it maps its first batch
+    :param initargs: The arguments of initializer
+    :param window: The number of batches sent to the workers ahead of the result yielded last, two by worker if None
+    :type window: int
+    :return: A generator of the results of fun in the order of the batches
+    """
+    batches = iter(batches)
+    first = list(itertools.islice(batches, 2))
+    batches = itertools.chain(first, batches)
+
+    pool = None
+    if workers > 1 and len(first) > 1 and not getattr(sys, u'frozen', False):
+        try:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers, initializer, initargs)
+
+        except (ImportError, OSError, NotImplementedError):
+            pool = None
+
+    if pool is None:
+        if initializer is not None:
+            initializer(*initargs)
+
+        for batch in batches:
+            yield fun(batch)
+
+        return
+
+    # pool.imap would read all the batches at once in its task thread, so the pending batches are sent one by one
+    window = window or 2 * workers
+    try:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(fun, (batch,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+        pool.close()
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 def use_if(use):
     """
     decorator that returns None is use is False
@@ -304,6 +773,184 @@ def make_place_around(around, exceptions=None, for_class=False):
     return place_around
 
 
+class LRUCache(object):
+    """
+    A size-bounded cache that evicts the least recently used entries first
+
+    >>> cache = LRUCache(2)
+    >>> cache.put(u'a', 1)
+    >>> cache.put(u'b', 2)
+    >>> cache.get(u'a')
+    1
+    >>> cache.put(u'c', 3)
+    >>> cache.get(u'b') is None
+    True
+    >>> sorted(cache.keys())
+    [u'a', u'c']
+    >>> sorted(cache.stats().items())
+    [('evictions', 1), ('hits', 1), ('max_size', 2), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: The maximum number of entries kept in the cache
+        :type max_size: int
+        """
+        if max_size <= 0:
+            raise ValueError(u'The size of the cache must be positive. Found {}'.format(max_size))
+
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Get the value of a key and mark it as the most recently used
+
+        :param key: The key
+        :param default: The value returned if the key isn't in the cache
+        :return: The cached value or default
+        """
+        try:
+            value = self.entries.pop(key)
+
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Add a value to the cache, evicting the least recently used entry if the cache is full
+
+        :param key: The key
+        :param value: The value
+        """
+        if key in self.entries:
+            del self.entries[key]
+
+        elif len(self.entries) >= self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        self.entries[key] = value
+
+    def keys(self):
+        return self.entries.keys()
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def stats(self):
+        """
+        :return: The counters of the cache
+        :rtype: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.entries),
+                'max_size': self.max_size}
+
+
+class Instrumentation(object):
+    """
+    Counters and cumulative timers grouped by name, used to see where the time goes
+
+    >>> instrumentation = Instrumentation(clock=iter([0.0, 0.25]).next)
+    >>> instrumentation.record(u'pattern', attempts=2, matches=1)
+    >>> square = instrumentation.timed(u'square', lambda x: x * x)
+    >>> square(3)
+    9
+    >>> print(instrumentation.table())
+    name                                                               attempts    matches      calls       time
+    pattern                                                                   2          1
+    square                                                                                          1     0.2500
+    """
+
+    # The order of the columns of the table
+    COLUMNS = (u'attempts', u'matches', u'match_time', u'format_time', u'calls', u'time')
+
+    def __init__(self, clock=timeit.default_timer):
+        """
+        :param clock: The function giving the current time in seconds
+        """
+        self.clock = clock
+        self.stats = OrderedDict()
+        self.running = set()
+
+    def record(self, name, **values):
+        """
+        Add the values to the counters of the name
+        """
+        entry = self.stats.setdefault(name, {})
+        for key, value in values.iteritems():
+            entry[key] = entry.get(key, 0) + value
+
+    def timed(self, name, fun):
+        """
+        Wrap fun so that its calls and the time spent in it are recorded under name
+
+        Only the outermost call is timed when fun calls itself
+        """
+
+        def _timed(*args, **kwargs):
+            if name in self.running:
+                return fun(*args, **kwargs)
+
+            self.running.add(name)
+            start = self.clock()
+            try:
+                return fun(*args, **kwargs)
+
+            finally:
+                self.running.discard(name)
+                self.record(name, calls=1, time=self.clock() - start)
+
+        return _timed
+
+    def json(self):
+        """
+        :return: The counters and timers as a JSON object
+        :rtype: unicode
+        """
+        return unicode(json.dumps(self.stats, indent=2, sort_keys=True))
+
+    def table(self, name_width=64):
+        """
+        :param name_width: The width of the name column, longer names are cut
+        :return: The counters and timers as a text table, one line by name
+        :rtype: unicode
+        """
+        columns = [column for column in self.COLUMNS if any(column in entry for entry in self.stats.itervalues())]
+        lines = [u'{:<{}} '.format(u'name', name_width) + u' '.join(u'{:>10}'.format(c) for c in columns)]
+        for name, entry in self.stats.iteritems():
+            cells = []
+            for column in columns:
+                value = entry.get(column)
+                if value is None:
+                    cells.append(u' ' * 10)
+
+                elif isinstance(value, float):
+                    cells.append(u'{:>10.4f}'.format(value))
+
+                else:
+                    cells.append(u'{:>10}'.format(value))
+
+            lines.append((u'{:<{}} '.format(name[:name_width], name_width) + u' '.join(cells)).rstrip())
+
+        return u'\n'.join(lines)
+
+
 def make_get_value(is_nbt):
     if is_nbt:
         def get_value(tag, key):
@@ -662,146 +1309,1984 @@ def parse_string(nbt, index=0):
     raise ValueError(u'String tag isn\'t closed in {}'.format(nbt))
 
 
-# Stringify methods
-def selector_string(type, entries):
+# Scanning functions
+# They give the same results as the parsing functions but scan whole spans with regexes and return slices, scan_entry
+# reads the tags for the iterative, lazy and node parsing functions too
+KEY_SPAN_PAT = LazyPattern(r'[^:\s]*', re.UNICODE)
+COMPOUND_VALUE_SPAN_PAT = LazyPattern(r'[^,}]*')
+LIST_VALUE_SPAN_PAT = LazyPattern(r'[^,\]]*')
+STRING_SPAN_PAT = LazyPattern(r'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+ESCAPED_CHAR_PAT = LazyPattern(r'\\(.)', re.DOTALL)
+
+
+def scan_json(json, return_size=False):
     """
-    Build a selector based on the given type and entries
+    Scan a json
 
-    >>> type = u'a'
-    >>> entries = {u'score_test_min': u'1'}
-    >>> selector_string(type=type, entries=entries)
-    u'@a[score_test_min=1]'
+    >>> json = u'["",{text:"This is some text",color:red,extra:[{text:" This is some other text",bold:true}]}]'
+    >>> scan_json(json) == parse_json(json)
+    True
 
-    :param type: The type of the selector (a, p, r or e)
-    :type type: unicode
-    :param entries: The key -> value pairs of this selector
-    :type entries: dict[unicode, unicode]
-    :return: A string made of type and entries
-    :rtype: unicode
+    :param json: The json
+    :type json: unicode
+    :param return_size: If the size should be returned or not
+    :type return_size: bool
+    :return: The parsed json
     """
-    return u'@{}{}'.format(
-        type, u'[' + u','.join(k + u'=' + v for k, v in entries.items()) + u']' if len(entries) > 0 else u'')
+    json = json.strip()
+    try:
+        return scan_compound(json, return_size)
 
+    except Exception:
+        pass
 
-def make_get_value_from_value(is_nbt):
-    if is_nbt:
-        return lambda value: value if isinstance(value, TAG_List) or isinstance(value,
-                                                                                TAG_Compound) else value.value
+    try:
+        value = scan_list(json)
+        return value if return_size else value[1]
 
-    else:
-        return lambda value: value
+    except ValueError:
+        raise ValueError(u'Invalid Json {}'.format(json))
 
 
-def compound_string(tag, fun=lambda v, force=False: v, is_nbt=False, get_value=None):
+def scan_compound(nbt, index=0, return_size=False):
     """
-    Build a new string in the format of a compound tag with the given tag and function to apply to every value
-
-    >>> compound_string({u'Key': u'Value'})
-    u'{Key:Value}'
+    Scan a compound tag
 
     >>> tag = u'{Equipment:[{id:269},{id:10},{id:100},{id:"minecraft:iron_chestplate"},{id:"minecraft:skull",' + \
                u'Damage:1}],Riding:{id:Pig}}'
-    >>> parse_compound(compound_string(parse_compound(tag))) == \
-            parse_compound(tag)
+    >>> scan_compound(tag) == parse_compound(tag)
     True
+    >>> sorted(scan_compound(u'{ key one :value, "two":"a \\\\"b\\\\"",}').items())
+    [(u'"two"', u'"a "b""'), (u'keyone', u'value')]
 
-    :param tag: The tag
-    :param fun: A function to apply on every values
-    :param is_nbt: True if the value is made using nbt tags in place of builtin types
-    :param get_value: A function used to get a value
-    :return: A string built using the given tag
-    """
-    get_value = get_value or make_get_value_from_value(is_nbt)
+    >>> scan_compound(u'{Equipment:[{}]')
+    Traceback (most recent call last):
+        ...
+    ValueError: Compound Tag is never closed in {Equipment:[{}]
+
+    >>> scan_compound(u'{name:[value,othervalue]othername:othervalue}')
+    Traceback (most recent call last):
+        ...
+    ValueError: Could not find "," in "{name:[value,othervalue]othername:othervalue}" from index 24 up to index 25.
+
+    :param nbt: The compound tag
+    :param index: The index at which the compound tag starts
+    :param return_size: If the size should be returned or not
+    :return: The parsed compound tag
+    """
+    if nbt[index] != u'{':
+        raise ValueError(u'Expected character {{. Found character {} in {}'.format(nbt[index], nbt))
+
+    tag = {}
+
+    i = index + 1
+    empty = True
+    while True:
+        i, key, value = scan_entry(nbt, i, True, empty)
+        if value is None:
+            return (i, tag) if return_size else tag
+
+        if value == u'{' or value == u'[':
+            i, value = scan_value(nbt, i - 1, in_compound=True)
+
+        tag[key] = value
+        empty = False
+
+
+def scan_list(nbt, index=0, return_size=True):
+    """
+    Scan a list tag
+
+    >>> scan_list(u'[1,2,3,4,5]')
+    (11, [u'1', u'2', u'3', u'4', u'5'])
+    >>> scan_list(u'[[a,b],{c:d},"e,f"]', return_size=False)
+    [[u'a', u'b'], {u'c': u'd'}, u'"e,f"']
+
+    :param nbt: The list tag
+    :param index: The index at which it should start to read the tag
+    :param return_size: If the size of the tag should be returned or not
+    :return: The parsed list tag and the index at which it ends
+    """
+    if nbt[index] != u'[':
+        raise ValueError(u'Expected character [. Found character {} in {}'.format(nbt[index], nbt))
+
+    tag = []
+
+    i = index + 1
+    empty = True
+    while True:
+        i, _, value = scan_entry(nbt, i, False, empty)
+        if value is None:
+            return (i, tag) if return_size else tag
+
+        if value == u'{' or value == u'[':
+            i, value = scan_value(nbt, i - 1, in_compound=False)
+
+        tag.append(value)
+        empty = False
+
+
+def scan_value(nbt, index=0, in_compound=False):
+    """
+    Scan a value in a compound or list tag
+
+    >>> scan_value(u'{key:value}') == parse_value(u'{key:value}')
+    True
+    >>> scan_value(u'This is a value, it ended at the ,')
+    (15, u'This is a value')
+
+    :param nbt: the value
+    :param index: The index at which the value starts
+    :param in_compound: If the value is inside a compound or a list tag
+    :return: The parsed value and the index at which it ends
+    """
+    if index >= len(nbt):
+        raise ValueError(u'Expected a value in {} at index {}'.format(nbt, index))
+
+    first_char = nbt[index]
+    if first_char == u'{':
+        return scan_compound(nbt, index=index, return_size=True)
+
+    elif first_char == u'[':
+        return scan_list(nbt, index=index)
+
+    elif first_char == u'"':
+        return scan_string(nbt, index=index)
+
+    else:
+        end = (COMPOUND_VALUE_SPAN_PAT if in_compound else LIST_VALUE_SPAN_PAT).match(nbt, index).end()
+        if end == len(nbt):
+            raise ValueError(u'Value is never closed in {}'.format(nbt))
+
+        return end, nbt[index:end]
+
+
+def scan_string(nbt, index=0):
+    """
+    Scan a string
+
+    >>> scan_string(u'"This is a string" It ended at the "')
+    (18, u'"This is a string"')
+    >>> scan_string(u'"An \\\\"escaped\\\\" string"')
+    (23, u'"An "escaped" string"')
+
+    :param nbt: The string
+    :param index: The index at which the string starts
+    :return: The parsed string and the index at which it ends
+    """
+    if nbt[index] != u'"':
+        raise ValueError(u'Invalid character. Expected character ". Found {} in {}'.format(nbt[index], nbt))
+
+    match = STRING_SPAN_PAT.match(nbt, index)
+    if match is None:
+        raise ValueError(u'String tag isn\'t closed in {}'.format(nbt))
+
+    end = match.end()
+    if u'\\' not in match.group(1):
+        return end, nbt[index:end]
+
+    return end, u'"' + ESCAPED_CHAR_PAT.sub(lambda m: m.group(1), match.group(1)) + u'"'
+
+
+def scan_entry(nbt, index, in_compound, empty):
+    """
+    Scan the next entry of a compound or list tag
+
+    The entry is the end of the tag, or the , after the previous value (a compound tag can also end after it), then
+    the key in a compound tag and the value. Only the bracket that opens a compound or list value is read, its content
+    is read by the next entries. All the parsers but parse_compound and parse_list read the tags with it
+
+    >>> scan_entry(u'{ key one :"a,b"}', 1, True, True)
+    (16, u'keyone', u'"a,b"')
+    >>> scan_entry(u'{a:[1,2]}', 1, True, True)
+    (4, u'a', u'[')
+    >>> scan_entry(u'[1,2]', 2, False, False)
+    (4, None, u'2')
+    >>> scan_entry(u'{a:1,}', 4, True, False)
+    (6, None, None)
+
+    :param nbt: The tag
+    :param index: The index after the bracket that opens the tag or after the previous value
+    :param in_compound: If the tag is a compound tag
+    :param empty: If the tag doesn't have any value yet
+    :return: The index at which the entry ends, its key (None in a list tag) and its value: None at the end of the
+             tag, { or [ when a compound or list tag starts and the string or the bare value otherwise
+    """
+    len_nbt = len(nbt)
+    if index >= len_nbt:
+        raise ValueError(u'{} Tag is never closed in {}'.format(u'Compound' if in_compound else u'List', nbt))
+
+    if nbt[index] == (u'}' if in_compound else u']'):
+        return index + 1, None, None
+
+    if not empty:
+        index = expect(nbt, index, u',')
+
+        if in_compound and nbt[index] == u'}':
+            return index + 1, None, None
+
+    key = None
+    if in_compound:
+        # The key ends at the first :, the spaces in it are ignored
+        end = KEY_SPAN_PAT.match(nbt, index).end()
+        if end < len_nbt and nbt[end] == u':':
+            key = nbt[index:end]
+
+        else:
+            end = nbt.find(u':', end)
+            if end == -1:
+                raise ValueError(u'Could not find ":" in "{}" from index {}.'.format(nbt, index))
+
+            key = u''.join(nbt[index:end].split())
+
+        index = end + 1
+
+    if index < len_nbt and (nbt[index] == u'{' or nbt[index] == u'['):
+        return index + 1, key, nbt[index]
+
+    index, value = scan_value(nbt, index, in_compound)
+    return index, key, value
+
+
+# Iterative parsing functions
+# They give the same results as the scanning functions but use an explicit stack in place of recursion
+def iter_parse_json(json, return_size=False):
+    """
+    Parse a json without recursion
+
+    >>> json = u'["",{text:"This is some text",color:red,extra:[{text:" This is some other text",bold:true}]}]'
+    >>> iter_parse_json(json) == parse_json(json)
+    True
+
+    :param json: The json
+    :type json: unicode
+    :param return_size: If the size should be returned or not
+    :type return_size: bool
+    :return: The parsed json
+    """
+    json = json.strip()
+    try:
+        return iter_parse_compound(json, return_size)
+
+    except Exception:
+        pass
+
+    try:
+        value = iter_parse_list(json)
+        return value if return_size else value[1]
+
+    except ValueError:
+        raise ValueError(u'Invalid Json {}'.format(json))
+
+
+def iter_parse_compound(nbt, index=0, return_size=False):
+    """
+    Parse a compound tag without recursion
+
+    >>> tag = u'{Equipment:[{id:269},{id:10},{id:100},{id:"minecraft:iron_chestplate"},{id:"minecraft:skull",' + \
+               u'Damage:1}],Riding:{id:Pig}}'
+    >>> iter_parse_compound(tag) == parse_compound(tag)
+    True
+
+    It can parse tags of any depth:
+
+    >>> depth = 10000
+    >>> tag = iter_parse_compound(u'{Riding:' * depth + u'{id:Pig}' + u'}' * depth)
+    >>> for _ in range(depth):
+    ...     tag = tag[u'Riding']
+    >>> tag
+    {u'id': u'Pig'}
+
+    >>> iter_parse_compound(u'{Equipment:[{}]')
+    Traceback (most recent call last):
+        ...
+    ValueError: Compound Tag is never closed in {Equipment:[{}]
+
+    :param nbt: The compound tag
+    :param index: The index at which the compound tag starts
+    :param return_size: If the size should be returned or not
+    :return: The parsed compound tag
+    """
+    if nbt[index] != u'{':
+        raise ValueError(u'Expected character {{. Found character {} in {}'.format(nbt[index], nbt))
+
+    i, tag = _iter_parse_tag(nbt, index)
+    return (i, tag) if return_size else tag
+
+
+def iter_parse_list(nbt, index=0, return_size=True):
+    """
+    Parse a list tag without recursion
+
+    >>> iter_parse_list(u'[1,2,3,4,5]')
+    (11, [u'1', u'2', u'3', u'4', u'5'])
+    >>> iter_parse_list(u'[[a,b],{c:d},"e,f",]', return_size=False)
+    [[u'a', u'b'], {u'c': u'd'}, u'"e,f"', u'']
+
+    :param nbt: The list tag
+    :param index: The index at which it should start to read the tag
+    :param return_size: If the size of the tag should be returned or not
+    :return: The parsed list tag and the index at which it ends
+    """
+    if nbt[index] != u'[':
+        raise ValueError(u'Expected character [. Found character {} in {}'.format(nbt[index], nbt))
+
+    i, tag = _iter_parse_tag(nbt, index)
+    return (i, tag) if return_size else tag
+
+
+def _iter_parse_tag(nbt, index):
+    """
+    Parse the compound or list tag that starts at index using a stack of the opened tags
+
+    :param nbt: The tag
+    :param index: The index of the { or [ that opens the tag
+    :return: The index at which the tag ends and the parsed tag
+    """
+    root = {} if nbt[index] == u'{' else []
+
+    # The opened tags with, for each, if it is a compound tag
+    stack = [(root, isinstance(root, dict))]
+    empty = True
+
+    i = index + 1
+    while True:
+        tag, in_compound = stack[-1]
+
+        i, key, value = scan_entry(nbt, i, in_compound, empty)
+        if value is None:
+            stack.pop()
+            if not stack:
+                return i, root
+
+            empty = False
+            continue
+
+        empty = False
+        if value == u'{' or value == u'[':
+            value = {} if value == u'{' else []
+            stack.append((value, isinstance(value, dict)))
+            empty = True
+
+        if in_compound:
+            tag[key] = value
+
+        else:
+            tag.append(value)
+
+
+# Lazy parsing functions
+# They only parse the first level of a tag and keep the compound and list tags it contains as raw spans
+class RawSNBT(unicode):
+    """
+    A compound or list tag that is kept as its source text until it is parsed
+
+    It is written back as it is by the stringify commands
+
+    >>> raw = RawSNBT(u'{id:Pig,Tags:[a,b]}')
+    >>> compound_string({u'Riding': raw})
+    u'{Riding:{id:Pig,Tags:[a,b]}}'
+    >>> raw.parse()[u'Tags']
+    [u'a', u'b']
+    """
+
+    def parse(self):
+        """
+        Parse the first level of the tag
+
+        :return: The parsed tag
+        :rtype: LazyCompound | LazyList
+        """
+        end, tag = _lazy_parse_tag(self, 0)
+        if end != len(self):
+            raise ValueError(u'Unexpected characters after the end of the tag in {}'.format(self))
+
+        return tag
+
+
+def materialize(value):
+    """
+    Parse the value if it is a raw tag
+
+    :param value: The value
+    :return: The parsed value
+    """
+    return value.parse() if isinstance(value, RawSNBT) else value
+
+
+class LazyCompound(dict):
+    """
+    A compound tag whose values are parsed the first time they are read with [], get or pop
+
+    items and values give the raw tags as they are, so the stringify commands write them back as they are
+
+    >>> tag = lazy_parse_compound(u'{id:Zombie,Equipment:[{id:269},{}],Riding:{id:Pig}}')
+    >>> isinstance(dict.get(tag, u'Riding'), RawSNBT)
+    True
+    >>> tag[u'Riding']
+    {u'id': u'Pig'}
+    >>> isinstance(dict.get(tag, u'Riding'), RawSNBT)
+    False
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, RawSNBT):
+            value = value.parse()
+            dict.__setitem__(self, key, value)
+
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        return materialize(dict.pop(self, key, *default))
+
+
+class LazyList(list):
+    """
+    A list tag whose values are parsed the first time they are read with [] or pop
+
+    >>> tag = lazy_parse_list(u'[{id:1},[a]]', return_size=False)
+    >>> tag[0]
+    {u'id': u'1'}
+    >>> tag[1]
+    [u'a']
+    """
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if isinstance(value, RawSNBT):
+            value = value.parse()
+            list.__setitem__(self, index, value)
+
+        return value
+
+    def pop(self, *index):
+        return materialize(list.pop(self, *index))
+
+
+def lazy_parse_compound(nbt, index=0, return_size=False):
+    """
+    Parse the first level of a compound tag
+
+    The compound and list tags it contains are kept as raw spans until they are read
+
+    >>> tag = u'{Equipment:[{id:269},{id:10},{id:100},{id:"minecraft:iron_chestplate"},{id:"minecraft:skull",' + \
+               u'Damage:1}],Riding:{id:Pig}}'
+    >>> lazy_parse_compound(tag)[u'Riding'] == parse_compound(tag)[u'Riding']
+    True
+    >>> lazy_parse_compound(tag)[u'Equipment'][4] == parse_compound(tag)[u'Equipment'][4]
+    True
+    >>> print(compound_string(lazy_parse_compound(u'{pages:["a \\\\"b\\\\"", c ]}')))
+    {pages:["a \\"b\\"", c ]}
+
+    >>> lazy_parse_compound(u'{Equipment:[{}]')
+    Traceback (most recent call last):
+        ...
+    ValueError: Compound Tag is never closed in {Equipment:[{}]
+
+    :param nbt: The compound tag
+    :param index: The index at which the compound tag starts
+    :param return_size: If the size should be returned or not
+    :return: The parsed compound tag
+    :rtype: LazyCompound
+    """
+    if nbt[index] != u'{':
+        raise ValueError(u'Expected character {{. Found character {} in {}'.format(nbt[index], nbt))
+
+    i, tag = _lazy_parse_tag(nbt, index)
+    return (i, tag) if return_size else tag
+
+
+def lazy_parse_list(nbt, index=0, return_size=True):
+    """
+    Parse the first level of a list tag
+
+    >>> lazy_parse_list(u'[1,[2,3],4]')
+    (11, [u'1', u'[2,3]', u'4'])
+
+    :param nbt: The list tag
+    :param index: The index at which it should start to read the tag
+    :param return_size: If the size of the tag should be returned or not
+    :return: The parsed list tag and the index at which it ends
+    :rtype: LazyList
+    """
+    if nbt[index] != u'[':
+        raise ValueError(u'Expected character [. Found character {} in {}'.format(nbt[index], nbt))
+
+    i, tag = _lazy_parse_tag(nbt, index)
+    return (i, tag) if return_size else tag
+
+
+def _lazy_parse_tag(nbt, index):
+    """
+    Parse the first level of the compound or list tag that starts at index
+
+    :param nbt: The tag
+    :param index: The index of the { or [ that opens the tag
+    :return: The index at which the tag ends and the parsed tag
+    """
+    in_compound = nbt[index] == u'{'
+    tag = LazyCompound() if in_compound else LazyList()
+
+    i = index + 1
+    empty = True
+    while True:
+        i, key, value = scan_entry(nbt, i, in_compound, empty)
+        if value is None:
+            return i, tag
+
+        empty = False
+        if value == u'{' or value == u'[':
+            end = skip_tag(nbt, i - 1)
+            i, value = end, RawSNBT(nbt[i - 1:end])
+
+        if in_compound:
+            dict.__setitem__(tag, key, value)
+
+        else:
+            tag.append(value)
+
+
+def skip_tag(nbt, index):
+    """
+    Find the end of the compound or list tag that starts at index without building it
+
+    >>> skip_tag(u'{a:[1,{b:"}"}],c:x]y}, rest', 0)
+    21
+    >>> skip_tag(u'[[1],[2]]', 1)
+    4
+
+    :param nbt: The tag
+    :param index: The index of the { or [ that opens the tag
+    :return: The index at which the tag ends
+    :rtype: int
+    """
+    # For each opened tag, if it is a compound tag
+    stack = [nbt[index] == u'{']
+    empty = True
+
+    i = index + 1
+    while True:
+        i, _, value = scan_entry(nbt, i, stack[-1], empty)
+        if value is None:
+            stack.pop()
+            if not stack:
+                return i
+
+            empty = False
+
+        elif value == u'{' or value == u'[':
+            stack.append(value == u'{')
+            empty = True
+
+        else:
+            empty = False
+
+
+# A quoted string, a bracket, or the quote of a string that isn't closed
+BRACKET_PAT = LazyPattern(r'"(?:[^"\\]|\\.)*"|[][{}"]', re.DOTALL)
+CLOSING_BRACKETS = {u'{': u'}', u'[': u']'}
+
+
+def balanced_end(text, index):
+    """
+    Find the end of the {} or [] span, or of the quoted string, that starts at index
+
+    Only the brackets and the quoted strings are read so it works on any text, not only on valid tags, and each
+    character is read at most once
+
+    >>> balanced_end(u'{a:[1,{b:"}"}],c:x} rest', 0)
+    19
+    >>> balanced_end(u'"a \\\\" b" rest', 0)
+    8
+    >>> balanced_end(u'{a:[1}]', 0) is None
+    True
+    >>> balanced_end(u'{a:"}', 0) is None
+    True
+
+    :param text: The text
+    :param index: The index of the {, [ or " that opens the span
+    :return: The index after the closing bracket or quote, None if the span isn't closed or the brackets don't match
+    :rtype: int
+    """
+    stack = []
+    i = index
+    while True:
+        match = BRACKET_PAT.match(text, i) if i == index else BRACKET_PAT.search(text, i)
+        if match is None:
+            return None
+
+        token = match.group()
+        i = match.end()
+        if token in CLOSING_BRACKETS:
+            stack.append(CLOSING_BRACKETS[token])
+
+        elif token == u'"' or (token[0] != u'"' and (not stack or stack.pop() != token)):
+            return None
+
+        if not stack:
+            return i
+
+
+# The kinds of the tokens of a command
+WORD_TOKEN = u'word'
+COORDINATE_TOKEN = u'coordinate'
+SELECTOR_TOKEN = u'selector'
+COMPOUND_TOKEN = u'compound'
+LIST_TOKEN = u'list'
+STRING_TOKEN = u'string'
+
+SPAN_TOKENS = {u'{': COMPOUND_TOKEN, u'[': LIST_TOKEN, u'"': STRING_TOKEN}
+
+COORDINATE_PAT = LazyPattern(r'(?:~?-?(?:\d+(?:\.\d*)?|\.\d+)|~)\Z')
+COORDINATE_STARTS = frozenset(u'~-.0123456789')
+OTHER_SPACES_PAT = LazyPattern(r'[\t\n\r\f\v]')
+
+CommandToken = namedtuple('CommandToken', ['kind', 'text', 'start', 'end'])
+
+
+def word_kind(word):
+    """
+    The kind of a word of a command
+
+    >>> word_kind(u'~-1.5'), word_kind(u'@e[type=Pig]'), word_kind(u'Pig')
+    (u'coordinate', u'selector', u'word')
+    """
+    if word[:1] == u'@':
+        return SELECTOR_TOKEN
+
+    if word[:1] in COORDINATE_STARTS and COORDINATE_PAT.match(word):
+        return COORDINATE_TOKEN
+
+    return WORD_TOKEN
+
+
+class CommandTokens(unicode):
+    """
+    A command that splits itself in typed tokens the first time they are read
+
+    The words are separated by single spaces, like the arguments of the game: two spaces make an empty word. A
+    compound, list or string span starts at a word and ends with the word its closing bracket or quote ends, it can
+    contain spaces. The words are split only up to the last one that is read, so the end of a command can be taken
+    as a whole without being scanned. The spans are only scanned when they are read.
+
+    >>> tokens = CommandTokens(u'/summon Zombie ~ ~1 ~ {CustomName:"A B"} @p')
+    >>> [(t.kind, t.text) for t in tokens.token_list()]  # doctest: +NORMALIZE_WHITESPACE
+    [(u'word', u'/summon'), (u'word', u'Zombie'), (u'coordinate', u'~'), (u'coordinate', u'~1'),
+     (u'coordinate', u'~'), (u'word', u'{CustomName:"A'), (u'word', u'B"}'), (u'selector', u'@p')]
+    >>> tokens.span(5)
+    (CommandToken(kind=u'compound', text=u'{CustomName:"A B"}', start=22, end=40), 7)
+    >>> tokens = CommandTokens(u'/execute @p ~ ~ ~ /say {hi')
+    >>> tokens.tail(5)
+    u'/say {hi'
+    >>> tokens.tail(5).token(1)
+    CommandToken(kind=u'word', text=u'{hi', start=5, end=8)
+    """
+
+    def __new__(cls, value, spaced=None):
+        self = unicode.__new__(cls, value)
+
+        # The words split so far
+        self.words = []
+
+        self.spans = {}
+
+        # The index at which the next word starts, None when the whole command is split
+        self.scanned = 0
+
+        # If there are white spaces other than the spaces that separate the words
+        self.spaced = OTHER_SPACES_PAT.search(value) is not None if spaced is None else spaced
+
+        return self
+
+    def scan(self, count):
+        """
+        Split the given number of words, the rest of the command is left as it is
+
+        :return: If the command has that many words
+        :rtype: bool
+        """
+        words = self.words
+        missing = count - len(words)
+        if missing <= 0:
+            return True
+
+        i = self.scanned
+        if i is None:
+            return False
+
+        parts = self[i:].split(u' ', missing)
+        if len(parts) > missing:
+            self.scanned = len(self) - len(parts.pop())
+
+        else:
+            self.scanned = None
+
+        words.extend(parts)
+        return len(words) >= count
+
+    def start(self, index):
+        """
+        :return: The index at which the word at the given index starts, it has to be split already
+        :rtype: int
+        """
+        if index == len(self.words):
+            return self.scanned
+
+        return sum(len(word) for word in self.words[:index]) + index
+
+    def token(self, index):
+        """
+        :return: The word at the given index, None after the last word
+        :rtype: CommandToken
+        """
+        if not self.scan(index + 1):
+            return None
+
+        word = self.words[index]
+        start = self.start(index)
+        return CommandToken(word_kind(word), word, start, start + len(word))
+
+    def token_list(self):
+        """
+        :return: All the words
+        :rtype: list
+        """
+        self.scan(len(self) + 1)
+        return [self.token(index) for index in range(len(self.words))]
+
+    def span(self, index):
+        """
+        Read the compound, list or string span that starts at the word at the given index
+
+        :return: The token of the span and the index of the word after it. None if the word doesn't start a span, if
+                 the span isn't closed or if it ends inside a word
+        :rtype: (CommandToken, int)
+        """
+        if index in self.spans:
+            return self.spans[index]
+
+        span = None
+        if self.scan(index + 1):
+            words = self.words
+            start = self.start(index)
+            kind = SPAN_TOKENS.get(words[index][:1])
+            end = None if kind is None else balanced_end(self, start)
+            # The span has to end where a word ends, its words are split at once
+            if end is not None and self[end:end + 1] in (u'', u' '):
+                text = self[start:end]
+                after = index + text.count(u' ') + 1
+                self.scan(after)
+                span = CommandToken(kind, text, start, end), after
+
+        self.spans[index] = span
+        return span
+
+    def rest(self, index):
+        """
+        :return: The index at which the word at the given index starts, without splitting it. None after the last word
+        :rtype: int
+        """
+        if not self.scan(index):
+            return None
+
+        return self.start(index)
+
+    def tail(self, index):
+        """
+        The end of the command, from the word at the given index, with the words already split in it
+
+        :rtype: CommandTokens
+        """
+        start = self.rest(index)
+        if start is None:
+            return None
+
+        # The tail of a command without other white spaces doesn't have any either
+        tail = CommandTokens(self[start:], spaced=None if self.spaced else False)
+        tail.words = self.words[index:]
+        tail.scanned = None if self.scanned is None else self.scanned - start
+        return tail
+
+
+def make_key_pattern(keys):
+    """
+    Make a pattern that finds the given keys in a raw tag
+
+    The spaces in the keys are ignored by the parsers so they are allowed between the characters of the keys
+
+    >>> pattern = make_key_pattern([u'Riding', u'HealF'])
+    >>> pattern.search(u'{Passengers:[{id:Pig}]}') is None
+    True
+    >>> pattern.search(u'{Passengers:[{id:Pig, Ri ding :{}}]}') is None
+    False
+
+    :param keys: The keys
+    :return: The compiled pattern
+    """
+    return re.compile(u'|'.join(u'\\s*'.join(re.escape(char) for char in key) + u'\\s*:' for key in keys),
+                      re.UNICODE)
+
+
+# The Command strings of a raw tag, the other strings are matched whole so that nothing inside them is read
+COMMAND_STRING_PAT = LazyPattern(r'([{,]\s*Command\s*:\s*)(?:"((?:[^"\\]|\\.)*)")?|"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+
+def escape_string(value):
+    """
+    Escape a value to write it in a string tag
+
+    >>> print(escape_string(u'/say "a\\\\b"'))
+    /say \\"a\\\\b\\"
+    """
+    return value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+
+
+def unescape_string(value):
+    """
+    Read the value of a string tag, without its quotes
+
+    >>> print(unescape_string(u'/say \\\\"a\\\\\\\\b\\\\"'))
+    /say "a\\b"
+    """
+    return ESCAPED_CHAR_PAT.sub(lambda m: m.group(1), value) if u'\\' in value else value
+
+
+def escape_quoted(value, force=False):
+    """
+    Escape again the content of a quoted value, the parsing functions keep the strings unescaped between their quotes
+
+    >>> print(escape_quoted(u'"/say "hi""'))
+    "/say \\"hi\\""
+    >>> print(escape_quoted(u'Value'))
+    Value
+
+    :param value: The value
+    :param force: If the value is a key, unused
+    :type value: unicode
+    :return: The value to write in a tag
+    """
+    if len(value) > 1 and value[0] == u'"' == value[-1]:
+        content = value[1:-1]
+        if u'"' in content or u'\\' in content:
+            return u'"' + escape_string(content) + u'"'
+
+    return value
+
+
+def place_escaped_quotes(value, force=False):
+    """
+    Place the quotes of json around a value and escape its content
+
+    >>> print(place_escaped_quotes(u'say "hi"'))
+    "say \\"hi\\""
+    """
+    return escape_quoted(place_quotes(value, force))
+
+
+def rewrite_command_strings(nbt, rewrite, screen=None):
+    """
+    Rewrite the Command strings of a raw tag in place, with a single pass over this level of the tag
+
+    The content of a Command string is unescaped once before it is rewritten and the result is escaped again, so the
+    commands nested in it keep their own escapes whatever their depth. The rest of the tag is copied as it is. The
+    nested commands are rewritten by rewrite when it formats the command that contains them, so a command nested n
+    levels deep is unescaped, scanned and escaped again n times.
+
+    >>> nbt = u'{CustomName:"Command:\\\\"x\\\\"",Command:"/say \\\\"hi\\\\"",id:MinecartCommandBlock}'
+    >>> print(rewrite_command_strings(nbt, lambda cmd: cmd.replace(u'say', u'tellraw')))
+    {CustomName:"Command:\\"x\\"",Command:"/tellraw \\"hi\\"",id:MinecartCommandBlock}
+    >>> rewrite_command_strings(nbt, lambda cmd: cmd, screen=re.compile(u'id:')) is None
+    True
+    >>> rewrite_command_strings(u'{Command:say}', lambda cmd: cmd) is None
+    True
+
+    :param nbt: The raw tag
+    :param rewrite: The function that rewrites a command
+    :param screen: A compiled pattern searched in the rest of the tag, None is returned if it is found there
+    :return: The new tag, None if a Command isn't a string or if the screen is found
+    :rtype: unicode
+    """
+    parts = []
+    last = 0
+    for match in COMMAND_STRING_PAT.finditer(nbt):
+        if match.group(1) is None:
+            continue
+
+        if match.group(2) is None:
+            return None
+
+        start, end = match.span(2)
+        if screen is not None and screen.search(nbt, last, start) is not None:
+            return None
+
+        parts.append(nbt[last:start])
+        parts.append(escape_string(rewrite(unescape_string(match.group(2)))))
+        last = end
+
+    if screen is not None and screen.search(nbt, last) is not None:
+        return None
+
+    parts.append(nbt[last:])
+    return u''.join(parts)
+
+
+# Command dispatch functions
+KEYWORD_PAT = LazyPattern(r'^\^?(?:\\?/\??)*(?P<keyword>[\w:-]+)(?: |\\s|\\ |\$|$)')
+
+
+def has_top_level_alternation(pattern):
+    """
+    Check if a pattern source contains a | that isn't inside a group or a character class
+
+    >>> has_top_level_alternation(r'^/?say (?P<value>.*)$|^/?tell (?P<value2>.*)$')
+    True
+    >>> has_top_level_alternation(r'^/?replaceitem (?P<where>block|entity \S+)$')
+    False
+    >>> has_top_level_alternation(r'^/?say [|\|] \|$')
+    False
+
+    :param pattern: The source of the pattern
+    :type pattern: basestring
+    :rtype: bool
+    """
+    depth = 0
+    in_class = False
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+
+        elif char == u'\\':
+            escaped = True
+
+        elif in_class:
+            if char == u']':
+                in_class = False
+
+        elif char == u'[':
+            in_class = True
+
+        elif char == u'(':
+            depth += 1
+
+        elif char == u')':
+            depth -= 1
+
+        elif char == u'|' and depth == 0:
+            return True
+
+    return False
+
+
+def pattern_keyword(pattern):
+    """
+    Find the command word that a command has to start with to be matched by the given pattern
+
+    >>> pattern_keyword(re.compile(r'^/?summon (?P<entity>\S+) (?P<pos>.*)$'))
+    u'summon'
+    >>> pattern_keyword(r'^/?summon-at\s(?P<entity>\S+)$')
+    u'summon-at'
+    >>> pattern_keyword(r'^/?seed$')
+    u'seed'
+    >>> pattern_keyword(r'^/?/testfor (?P<sel>\S+)$')
+    u'testfor'
+
+    Patterns that don't start with a fixed word can match any command:
+
+    >>> pattern_keyword(r'^(?P<sel>\S+) (?P<nbt>\{.*\})$') is None
+    True
+    >>> pattern_keyword(r'^/?summon-pos(?P<pos>(?: \S+){3})$') is None
+    True
+    >>> pattern_keyword(re.compile(r'^/?say (?P<value>.*)$', re.IGNORECASE)) is None
+    True
+
+    :param pattern: The pattern (compiled or not)
+    :return: The command word or None if the pattern can match commands starting with any word
+    :rtype: unicode
+    """
+    if hasattr(pattern, u'pattern'):
+        if pattern.flags & re.IGNORECASE:
+            return None
+
+        pattern = pattern.pattern
+
+    if has_top_level_alternation(pattern):
+        return None
+
+    match = KEYWORD_PAT.match(pattern)
+    if match is None:
+        return None
+
+    return unicode(match.group(u'keyword'))
+
+
+def command_keyword(cmd):
+    """
+    Find the command word of a command
+
+    >>> command_keyword(u'/summon Zombie ~ ~ ~')
+    u'summon'
+    >>> command_keyword(u'say Hello')
+    u'say'
+    >>> command_keyword(u'//testfor @a')
+    u'testfor'
+    >>> command_keyword(u'/')
+    u''
+
+    :param cmd: The stripped command
+    :type cmd: unicode
+    :return: The first word of the command without the leading /
+    :rtype: unicode
+    """
+    parts = cmd.lstrip(u'/').split(None, 1)
+    return parts[0] if parts else u''
+
+
+# Stringify methods
+def selector_string(type, entries):
+    """
+    Build a selector based on the given type and entries
+
+    >>> type = u'a'
+    >>> entries = {u'score_test_min': u'1'}
+    >>> selector_string(type=type, entries=entries)
+    u'@a[score_test_min=1]'
+
+    :param type: The type of the selector (a, p, r or e)
+    :type type: unicode
+    :param entries: The key -> value pairs of this selector
+    :type entries: dict[unicode, unicode]
+    :return: A string made of type and entries
+    :rtype: unicode
+    """
+    return u'@{}{}'.format(
+        type, u'[' + u','.join(k + u'=' + v for k, v in entries.items()) + u']' if len(entries) > 0 else u'')
+
+
+def make_get_value_from_value(is_nbt):
+    if is_nbt:
+        return lambda value: value if isinstance(value, TAG_List) or isinstance(value,
+                                                                                TAG_Compound) else value.value
+
+    else:
+        return lambda value: value
+
+
+def compound_string(tag, fun=escape_quoted, is_nbt=False, get_value=None):
+    """
+    Build a new string in the format of a compound tag with the given tag and function to apply to every value
+
+    >>> compound_string({u'Key': u'Value'})
+    u'{Key:Value}'
+
+    >>> tag = u'{Equipment:[{id:269},{id:10},{id:100},{id:"minecraft:iron_chestplate"},{id:"minecraft:skull",' + \
+               u'Damage:1}],Riding:{id:Pig}}'
+    >>> parse_compound(compound_string(parse_compound(tag))) == \
+            parse_compound(tag)
+    True
+
+    :param tag: The tag
+    :param fun: A function to apply on every values
+    :param is_nbt: True if the value is made using nbt tags in place of builtin types
+    :param get_value: A function used to get a value
+    :return: A string built using the given tag
+    """
+    get_value = get_value or make_get_value_from_value(is_nbt)
+
+    string = [fun(key, force=True) + u':' + value_string(value, fun, get_value=get_value) for key, value in tag.items()]
+
+    return u'{' + u','.join(string) + u'}'
+
+
+def list_string(tag, fun=escape_quoted, is_nbt=False, get_value=None):
+    """
+    Build a new string in the format of a list tag with the given tag and function to apply to every value
+
+    >>> list_string([u'1', u'2', u'3', u'JKLAMDZ', u'IZJLA', u'42'])
+    u'[1,2,3,JKLAMDZ,IZJLA,42]'
+
+    >>> tag = u'[1, 12, 42, 42, 1092, 666, -1]'
+    >>> list_string(parse_list(tag, return_size=False)) == tag
+    True
+
+    :param tag: The tag
+    :param fun: A function to apply on every value
+    :param is_nbt: True if the value is made using nbt tags in place of builtin types
+    :param get_value: A function used to get a value
+    :return: A string built using the given tag
+    """
+    get_value = get_value or make_get_value_from_value(is_nbt)
+
+    string = [value_string(element, fun, get_value=get_value) for element in tag]
+    return u'[' + u','.join(string) + u']'
+
+
+def value_string(value, fun=escape_quoted, is_nbt=False, get_value=None):
+    """
+    Build a new string of the given value
+
+    >>> tag = {u'Key': u'Value'}
+    >>> value_string(tag) == compound_string(tag)
+    True
+
+    >>> tag = [u'1', u'2', u'3', u'JKLAMDZ', u'IZJLA', u'42']
+    >>> value_string(tag) == list_string(tag)
+    True
+
+    >>> value_string(u'102')
+    u'102'
+
+    :param value: The value
+    :param fun: A function to apply on every value
+    :param is_nbt: True if the value is made using nbt tags in place of builtin types
+    :param get_value: A function used to get a value
+    :return: A string built using the given value
+    """
+    get_value = get_value or make_get_value_from_value(is_nbt)
+
+    if is_nbt:
+        tag_compound = TAG_Compound
+        tag_list = TAG_List
+
+    else:
+        tag_compound = dict
+        tag_list = list
+
+    if isinstance(value, tag_compound):
+        return compound_string(value, fun, get_value=get_value)
+
+    elif isinstance(value, tag_list):
+        return list_string(value, fun, get_value=get_value)
+
+    else:
+        return fun(get_value(value))
+
+
+json_values = re.compile(r'true|false|-?\d+(?:\.\d*)?')
+
+place_quotes = make_place_around(u'"', exceptions=json_values)
+
+
+def json_string(json):
+    """
+    Build a new string in the format of strict json using the given json
+
+    >>> j = {u'text': u'This is some text', u'color': u'red'}
+    >>> result = parse_json(json_string(j))
+    >>> expected_result = {u'"text"': u'"This is some text"', u'"color"': u'"red"'}
+    >>> result == expected_result
+    True
+
+    :param json: The json
+    :type json: object
+    :return: A string built using the give json
+    """
+    return value_string(json, fun=place_escaped_quotes)
+
+
+# Streaming stringify functions
+# They write the same strings as compound_string and json_string without recursion, in a single buffer or a file,
+# and find how to write the leaves of a json with a table indexed by their first character in place of the
+# place_quotes regex
+DIGITS = frozenset(u'0123456789')
+
+
+def quote_json_leaf(value, force=False):
+    """
+    Write a json leaf between quotes, the leaves that are already quoted are only escaped
+
+    >>> print(quote_json_leaf(u'say "hi"'))
+    "say \\"hi\\""
+    >>> print(quote_json_leaf(u'"hi"'))
+    "hi"
+    """
+    if value[-1:] == u'"' and value[:1] == u'"':
+        return escape_quoted(value)
+
+    return u'"' + escape_string(value) + u'"'
+
+
+def bare_json_leaf(prefix):
+    """
+    Build the function that writes a json leaf as it is if it starts with prefix, like json_values, or quotes it
+    """
+    def json_leaf(value, force=False):
+        return value if value.startswith(prefix) else quote_json_leaf(value)
+
+    return json_leaf
+
+
+def number_json_leaf(value, force=False):
+    return value
+
+
+def negative_json_leaf(value, force=False):
+    return value if value[1:2] in DIGITS else quote_json_leaf(value)
+
+
+# How to write a json leaf by its first character, the other leaves are quoted
+JSON_LEAVES = {char: number_json_leaf for char in DIGITS}
+JSON_LEAVES.update({
+    u'-': negative_json_leaf,
+    u't': bare_json_leaf(u'true'),
+    u'f': bare_json_leaf(u'false'),
+})
+
+
+def write_value_string(value, write, is_json=False):
+    """
+    Write the same string as value_string, or json_string, fragment by fragment with a single function and without
+    recursion
+
+    The value can also be made of nodes
+
+    >>> fragments = []
+    >>> write_value_string({u'Key': [u'"a \\"b\\""', {}]}, fragments.append)
+    >>> print(u''.join(fragments))
+    {Key:["a \\"b\\"",{}]}
+    >>> fragments = []
+    >>> write_value_string([u'', {u'text': u'Go up'}, u'true', u'-1', u'-x'], fragments.append, is_json=True)
+    >>> print(u''.join(fragments))
+    ["",{"text":"Go up"},true,-1,"-x"]
+
+    :param value: The value
+    :param write: The function called with each fragment, like the append method of a list or the write method of a
+                  file
+    :param is_json: True to write the value as a json
+    :type is_json: bool
+    """
+    if is_json:
+        def leaf_string(leaf):
+            return JSON_LEAVES.get(leaf[:1], quote_json_leaf)(leaf)
+
+        key_string = quote_json_leaf
+
+    else:
+        leaf_string = key_string = escape_quoted
+
+    # The opened tags with, for each, the iterator on its values and if it is a compound
+    if isinstance(value, COMPOUND_TYPES):
+        write(u'{')
+        stack = [(iter(value.items()), True)]
+
+    elif isinstance(value, list):
+        write(u'[')
+        stack = [(iter(value), False)]
+
+    else:
+        write(leaf_string(scalar_text(value)))
+        return
+
+    empty = True
+    while stack:
+        values, is_compound = stack[-1]
+
+        for value in values:
+            if not empty:
+                write(u',')
+
+            empty = False
+
+            if is_compound:
+                key, value = value
+                write(key_string(key) + u':')
+
+            if isinstance(value, COMPOUND_TYPES):
+                write(u'{')
+                stack.append((iter(value.items()), True))
+                empty = True
+                break
+
+            elif isinstance(value, list):
+                write(u'[')
+                stack.append((iter(value), False))
+                empty = True
+                break
+
+            elif isinstance(value, SNBTScalar):
+                write(leaf_string(value.text))
+
+            else:
+                write(leaf_string(value))
+
+        else:
+            stack.pop()
+            write(u'}' if is_compound else u']')
+            empty = False
+
+
+def stream_compound_string(tag, out=None):
+    """
+    Build the same string as compound_string in a single buffer, or write it to a file
+
+    >>> tag = parse_compound(u'{Equipment:[{id:269},{},{}],CustomName:"A \\\\"B\\\\"",Riding:{id:Pig,Tags:[[a],[]]}}')
+    >>> stream_compound_string(tag) == compound_string(tag)
+    True
+
+    >>> depth = 10000
+    >>> tag = {u'id': u'Pig'}
+    >>> for _ in range(depth):
+    ...     tag = {u'Riding': [tag]}
+    >>> stream_compound_string(tag) == u'{Riding:[' * depth + u'{id:Pig}' + u']}' * depth
+    True
+    >>> import io
+    >>> out = io.StringIO()
+    >>> stream_compound_string({u'id': u'Pig'}, out)
+    >>> out.getvalue()
+    u'{id:Pig}'
+
+    :param tag: The tag
+    :param out: The file-like object to write the string to, None to return the string
+    :return: The string built using the given tag, None if it was written to out
+    """
+    if out is not None:
+        write_value_string(tag, out.write)
+        return None
+
+    fragments = []
+    write_value_string(tag, fragments.append)
+    return u''.join(fragments)
+
+
+def stream_json_string(json, out=None):
+    """
+    Build the same string as json_string in a single buffer, or write it to a file
+
+    >>> j = parse_json(u'{text:"a",extra:[{text:"\\\\"b\\\\"",bold:true},{text:-2,color:"-x"},""],score:truex}')
+    >>> stream_json_string(j) == json_string(j)
+    True
+
+    :param json: The json
+    :param out: The file-like object to write the string to, None to return the string
+    :return: The string built using the given json, None if it was written to out
+    """
+    if out is not None:
+        write_value_string(json, out.write, is_json=True)
+        return None
+
+    fragments = []
+    write_value_string(json, fragments.append, is_json=True)
+    return u''.join(fragments)
+
+
+# Node model
+# The parsed tags can be turned into compact nodes: the scalars keep their type and their decoded value next to
+# their spelling, and the compound tags keep their keys in a tuple shared by the compound tags with the same keys
+SCALAR_NUMBER_PAT = LazyPattern(r'(-?(?:\d+(?:\.\d*)?|\.\d+))([bBsSlLfFdD]?)$')
+
+# The type of a number by its suffix, and if its value is an integer
+SCALAR_SUFFIXES = {
+    u'': (TAG_INT, True),
+    u'b': (TAG_BYTE, True),
+    u's': (TAG_SHORT, True),
+    u'l': (TAG_LONG, True),
+    u'f': (TAG_FLOAT, False),
+    u'd': (TAG_DOUBLE, False),
+}
+
+SCALAR_INTEGER_TYPES = frozenset(type for type, integer in SCALAR_SUFFIXES.values() if integer)
+
+
+class SNBTScalar(object):
+    """
+    A value of a tag with its type, its decoded value and its spelling
+
+    The type and the number are decoded from the spelling the first time one of them is read and then kept, so the
+    scalars that are only written back never decode it. The strings are sliced from their spelling when their value
+    is read
+
+    >>> scalar = SNBTScalar.parse(u'0.35F')
+    >>> scalar.decoded is None
+    True
+    >>> scalar.type == TAG_FLOAT, scalar.value, scalar.text
+    (True, 0.35, u'0.35F')
+    >>> SNBTScalar.parse(u'"Bob"').value, SNBTScalar.parse(u'12').type == TAG_INT
+    (u'Bob', True)
+    """
+    __slots__ = ('text', 'decoded')
+
+    def __init__(self, text):
+        """
+        :param text: The scalar, the strings keep their quotes
+        :type text: unicode
+        """
+        self.text = text
+
+        # The type and the number, None until they are read
+        self.decoded = None
+
+    @property
+    def type(self):
+        return (self.decoded or self.decode())[0]
+
+    @property
+    def number(self):
+        return (self.decoded or self.decode())[1]
+
+    @property
+    def value(self):
+        type, number = self.decoded or self.decode()
+        if type != TAG_STRING:
+            return number
+
+        return self.text[1:-1] if self.text[:1] == u'"' else self.text
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param text: The scalar, the strings keep their quotes
+        :type text: unicode
+        :rtype: SNBTScalar
+        """
+        return cls(text)
+
+    def decode(self):
+        """
+        Find the type and the value of the scalar
+
+        The numbers without suffix are ints, or doubles if they have a dot, and everything that isn't a number is a
+        string
+
+        :return: The type and the number, None for a string
+        :rtype: (int, int | float)
+        """
+        text = self.text
+        self.decoded = (TAG_STRING, None)
+        if text[:1] != u'"':
+            match = SCALAR_NUMBER_PAT.match(text)
+            if match is not None:
+                number, suffix = match.groups()
+                type, integer = SCALAR_SUFFIXES[suffix.lower()]
+                if not integer:
+                    self.decoded = (type, float(number))
+
+                elif u'.' not in number:
+                    self.decoded = (type, int(number))
+
+                elif not suffix:
+                    self.decoded = (TAG_DOUBLE, float(number))
+
+        return self.decoded
+
+    def __unicode__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'SNBTScalar({!r})'.format(self.text)
+
+
+class SNBTCompound(object):
+    """
+    A compound tag backed by the tuple of its keys and the list of its values
+
+    It has the methods of a dict that the tag rules use. A new key is added at the end.
+
+    >>> tag = SNBTCompound((u'id', u'HealF'), [u'Pig', u'5F'])
+    >>> tag[u'Health'] = tag.pop(u'HealF')
+    >>> tag.items(), u'id' in tag, len(tag)
+    ([(u'id', u'Pig'), (u'Health', u'5F')], True, 2)
+    """
+    __slots__ = ('names', 'nodes')
+
+    def __init__(self, names=(), nodes=None):
+        """
+        :param names: The keys
+        :type names: tuple
+        :param nodes: The values, in the order of the keys
+        :type nodes: list
+        """
+        self.names = names
+        self.nodes = nodes if nodes is not None else []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, key):
+        return key in self.names
+
+    def __getitem__(self, key):
+        try:
+            return self.nodes[self.names.index(key)]
+
+        except ValueError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            self.nodes[self.names.index(key)] = value
+
+        except ValueError:
+            self.names += (key,)
+            self.nodes.append(value)
+
+    def __delitem__(self, key):
+        try:
+            i = self.names.index(key)
+
+        except ValueError:
+            raise KeyError(key)
+
+        self.names = self.names[:i] + self.names[i + 1:]
+        del self.nodes[i]
+
+    def get(self, key, default=None):
+        return self[key] if key in self.names else default
+
+    def pop(self, key, *default):
+        if key not in self.names:
+            if default:
+                return default[0]
+
+            raise KeyError(key)
+
+        value = self[key]
+        del self[key]
+        return value
+
+    def keys(self):
+        return list(self.names)
+
+    def values(self):
+        return list(self.nodes)
+
+    def items(self):
+        return zip(self.names, self.nodes)
+
+    def iteritems(self):
+        return itertools.izip(self.names, self.nodes)
+
+    def __repr__(self):
+        return 'SNBTCompound({!r}, {!r})'.format(self.names, self.nodes)
+
+
+# The types of the compound tags that the stringify commands and the formatter accept
+COMPOUND_TYPES = (dict, SNBTCompound)
+
+
+def scalar_text(value):
+    """
+    The spelling of a value that can be a scalar node
+
+    >>> scalar_text(SNBTScalar.parse(u'1b')), scalar_text(u'1b')
+    (u'1b', u'1b')
+    """
+    return value.text if isinstance(value, SNBTScalar) else value
+
+
+def _node_parse_tag(nbt, index):
+    """
+    Parse the compound or list tag that starts at index into nodes, like _iter_parse_tag but without building the
+    dicts first
+
+    The compound tags with the same keys, in the same order, share the tuple of their keys, and the scalars with the
+    same spelling share their node, so the nodes of the scalars must not be changed in place. The keys keep their
+    order, the value of a key written twice is the last one
+
+    :param nbt: The tag
+    :param index: The index of the { or [ that opens the tag
+    :return: The index at which the tag ends and the parsed tag
+    """
+    names_cache = {}
+    scalars = {}
+
+    # The compound tags are filled with the list of their keys, turned into a shared tuple when they are closed
+    root = SNBTCompound([], []) if nbt[index] == u'{' else []
+
+    # The opened tags with, for each, the list of its values, the list of its keys (None for a list tag) and if it is
+    # a compound tag
+    stack = [(root, root.nodes, root.names, True) if nbt[index] == u'{' else (root, root, None, False)]
+    empty = True
+
+    i = index + 1
+    while True:
+        tag, nodes, names, in_compound = stack[-1]
+
+        i, key, value = scan_entry(nbt, i, in_compound, empty)
+        if value is None:
+            stack.pop()
+            if in_compound:
+                key = tuple(names)
+                names = names_cache.get(key)
+                if names is None:
+                    names = names_cache[key] = key if len(set(key)) == len(key) else tuple(OrderedDict.fromkeys(key))
+
+                if len(names) != len(key):
+                    values = dict(zip(key, nodes))
+                    tag.nodes = [values[name] for name in names]
+
+                tag.names = names
+
+            if not stack:
+                return i, root
+
+            empty = False
+            continue
+
+        empty = False
+        if value == u'{':
+            value = SNBTCompound([], [])
+            stack.append((value, value.nodes, value.names, True))
+            empty = True
+
+        elif value == u'[':
+            value = []
+            stack.append((value, value, None, False))
+            empty = True
+
+        else:
+            text = value
+            value = scalars.get(text)
+            if value is None:
+                value = scalars[text] = SNBTScalar(text)
+
+        if in_compound:
+            names.append(key)
+
+        nodes.append(value)
+
+
+def node_parse_compound(nbt, index=0, return_size=False):
+    """
+    Parse a compound tag into nodes, without recursion
+
+    >>> tag = node_parse_compound(u'{Equipment:[{id:269,Count:1b},{id:1,Count:1b}],HealF:0.5F}')
+    >>> tag[u'HealF'].value, tag[u'Equipment'][0].names is tag[u'Equipment'][1].names
+    (0.5, True)
+    >>> tag[u'Equipment'][0][u'Count'] is tag[u'Equipment'][1][u'Count']
+    True
+    >>> node_parse_compound(u'{id:Pig,Riding:{id:Bat},id:Cow}')
+    SNBTCompound((u'id', u'Riding'), [SNBTScalar(u'Cow'), SNBTCompound((u'id',), [SNBTScalar(u'Bat')])])
+    >>> node_parse_compound(u'{Equipment:[{}]')
+    Traceback (most recent call last):
+        ...
+    ValueError: Compound Tag is never closed in {Equipment:[{}]
+
+    :param nbt: The compound tag
+    :param index: The index at which the compound tag starts
+    :param return_size: If the size should be returned or not
+    :return: The parsed compound tag
+    :rtype: SNBTCompound
+    """
+    if nbt[index] != u'{':
+        raise ValueError(u'Expected character {{. Found character {} in {}'.format(nbt[index], nbt))
+
+    i, tag = _node_parse_tag(nbt, index)
+    return (i, tag) if return_size else tag
+
+
+def node_parse_list(nbt, index=0, return_size=True):
+    """
+    Parse a list tag into nodes, without recursion
+
+    >>> node_parse_list(u'[1b,{}]')
+    (7, [SNBTScalar(u'1b'), SNBTCompound((), [])])
+
+    :param nbt: The list tag
+    :param index: The index at which the list tag starts
+    :param return_size: If the size should be returned or not
+    :return: The parsed list tag
+    :rtype: list
+    """
+    if nbt[index] != u'[':
+        raise ValueError(u'Expected character [. Found character {} in {}'.format(nbt[index], nbt))
+
+    i, tag = _node_parse_tag(nbt, index)
+    return (i, tag) if return_size else tag
+
+
+# Shared subtrees
+# A SubtreeTable gives the same frozen node to every identical subtree it sees, they are copied before they are changed
+def frozen(*args, **kwargs):
+    raise TypeError(u'A shared tag can\'t be changed, it has to be copied with thaw first')
+
+
+class FrozenCompound(SNBTCompound):
+    """
+    A shared compound tag, with the set of the keys of the compound tags it contains
+
+    >>> tag = FrozenCompound((u'id',), [u'Pig'], frozenset([u'id']))
+    >>> tag[u'id'] = u'Cow'
+    Traceback (most recent call last):
+        ...
+    TypeError: A shared tag can't be changed, it has to be copied with thaw first
+    """
+    __slots__ = ('keys_below',)
+
+    def __init__(self, names, nodes, keys_below):
+        super(FrozenCompound, self).__init__(names, nodes)
+        self.keys_below = keys_below
+
+    __setitem__ = __delitem__ = pop = frozen
+
+
+class FrozenList(list):
+    """
+    A shared list tag, with the set of the keys of the compound tags it contains
+    """
+    __slots__ = ('keys_below',)
+
+    def __init__(self, nodes, keys_below):
+        super(FrozenList, self).__init__(nodes)
+        self.keys_below = keys_below
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = frozen
+    append = extend = insert = pop = remove = reverse = sort = frozen
+
+
+FROZEN_TYPES = (FrozenCompound, FrozenList)
+
+
+def thaw(value):
+    """
+    Copy the shared tags of a value, without recursion, so that it can be changed
+
+    The tags that aren't shared are changed in place and the scalars are kept
+
+    >>> table = SubtreeTable()
+    >>> tag = thaw(table.parse_compound(u'{Riding:{id:Pig,Tags:[a]}}'))
+    >>> tag[u'Riding'][u'Tags'].append(u'b')
+    >>> stream_compound_string(tag), stream_compound_string(table.parse_compound(u'{Riding:{id:Pig,Tags:[a]}}'))
+    (u'{Riding:{id:Pig,Tags:[a,b]}}', u'{Riding:{id:Pig,Tags:[a]}}')
+
+    :param value: The value
+    :return: The value with no shared tag
+    """
+    root = [value]
+    stack = [(root, 0)]
+    while stack:
+        container, key = stack.pop()
+        value = container[key]
+
+        if isinstance(value, FrozenCompound):
+            value = container[key] = SNBTCompound(value.names, list(value.nodes))
+
+        elif isinstance(value, FrozenList):
+            value = container[key] = list(value)
+
+        if isinstance(value, SNBTCompound):
+            stack.extend((value.nodes, i) for i in range(len(value.nodes)))
+
+        elif isinstance(value, dict):
+            stack.extend((value, k) for k in value)
+
+        elif isinstance(value, list):
+            stack.extend((value, i) for i in range(len(value)))
+
+    return root[0]
+
+
+class SubtreeTable(object):
+    """
+    A hash-consing table: the identical subtrees of the tags it shares, in a single tag or across a batch of them,
+    become the same frozen node
+
+    The tags are parsed one level at a time, and the raw compound and list tags found in a level are first looked up
+    by their text, so a subtree that was already seen isn't parsed again. The others are found by their keys and the
+    identity of the nodes they contain, which are shared first. The table keeps every node it made and every text
+    it looked up, without any bound, so it should only live as long as the batch it shares.
+
+    >>> table = SubtreeTable()
+    >>> a = table.parse_compound(u'{id:Zombie,Equipment:[{id:276,tag:{ench:[{id:16,lvl:5}]}},{}]}')
+    >>> b = table.parse_compound(u'{id:Skeleton,Equipment:[{id:276,tag:{ench:[{id:16,lvl:5}]}},{}]}')
+    >>> a[u'Equipment'] is b[u'Equipment'], a is b
+    (True, False)
+    >>> sorted(a.keys_below)
+    [u'Equipment', u'ench', u'id', u'lvl', u'tag']
+    >>> table.parse_compound(u'{Riding:{id:Pig,Tags:[a]}}')[u'Riding'] is \
+        table.parse_compound(u'{Riding:{id:Pig, Tags:[a]}}')[u'Riding']
+    True
+    """
 
-    string = [fun(key, force=True) + u':' + value_string(value, fun, get_value=get_value) for key, value in tag.items()]
+    def __init__(self):
+        self.nodes = {}
+        self.spans = {}
+        self.scalars = {}
+        self.names = {}
+        self.key_sets = {}
 
-    return u'{' + u','.join(string) + u'}'
+    def __len__(self):
+        return len(self.nodes)
 
+    def scalar(self, value):
+        """
+        :param value: A scalar, its node or its text
+        :return: The shared node of the scalar
+        :rtype: SNBTScalar
+        """
+        text = scalar_text(value)
+        scalar = self.scalars.get(text)
+        if scalar is None:
+            scalar = self.scalars[text] = value if isinstance(value, SNBTScalar) else SNBTScalar.parse(text)
 
-def list_string(tag, fun=lambda v, force=False: v, is_nbt=False, get_value=None):
-    """
-    Build a new string in the format of a list tag with the given tag and function to apply to every value
+        return scalar
 
-    >>> list_string([u'1', u'2', u'3', u'JKLAMDZ', u'IZJLA', u'42'])
-    u'[1,2,3,JKLAMDZ,IZJLA,42]'
+    def share(self, value):
+        """
+        Share the subtrees of a value, without recursion
 
-    >>> tag = u'[1, 12, 42, 42, 1092, 666, -1]'
-    >>> list_string(parse_list(tag, return_size=False)) == tag
-    True
+        The value can be made of builtin types, of raw tags or of nodes, it isn't changed.
 
-    :param tag: The tag
-    :param fun: A function to apply on every value
-    :param is_nbt: True if the value is made using nbt tags in place of builtin types
-    :param get_value: A function used to get a value
-    :return: A string built using the given tag
-    """
-    get_value = get_value or make_get_value_from_value(is_nbt)
+        :param value: The value
+        :return: The shared value
+        """
+        root = [value]
 
-    string = [value_string(element, fun, get_value=get_value) for element in tag]
-    return u'[' + u','.join(string) + u']'
+        # The containers of the tags, with the key of the tag in it, if the tags it contains are shared and its text
+        stack = [(root, 0, False, None)]
+        while stack:
+            container, key, visited, span = stack.pop()
+            value = container[key]
 
+            if visited:
+                node = container[key] = self.intern(value)
+                if span is not None:
+                    self.spans[span] = node
 
-def value_string(value, fun=lambda v, force=False: v, is_nbt=False, get_value=None):
-    """
-    Build a new string of the given value
+                continue
 
-    >>> tag = {u'Key': u'Value'}
-    >>> value_string(tag) == compound_string(tag)
-    True
+            if isinstance(value, FROZEN_TYPES):
+                continue
 
-    >>> tag = [u'1', u'2', u'3', u'JKLAMDZ', u'IZJLA', u'42']
-    >>> value_string(tag) == list_string(tag)
-    True
+            if isinstance(value, RawSNBT):
+                node = self.spans.get(value)
+                if node is not None:
+                    container[key] = node
+                    continue
 
-    >>> value_string(u'102')
-    u'102'
+                span = value
+                value = value.parse()
 
-    :param value: The value
-    :param fun: A function to apply on every value
-    :param is_nbt: True if the value is made using nbt tags in place of builtin types
-    :param get_value: A function used to get a value
-    :return: A string built using the given value
-    """
-    get_value = get_value or make_get_value_from_value(is_nbt)
+            # The values of the lazy tags are read as they are, without parsing them
+            if isinstance(value, COMPOUND_TYPES):
+                items = value.items()
+                value = SNBTCompound(tuple(k for k, _ in items), [v for _, v in items])
+                nodes = value.nodes
 
-    if is_nbt:
-        tag_compound = TAG_Compound
-        tag_list = TAG_List
+            elif isinstance(value, list):
+                value = nodes = list(value)
 
-    else:
-        tag_compound = dict
-        tag_list = list
+            else:
+                container[key] = self.scalar(value)
+                continue
 
-    if isinstance(value, tag_compound):
-        return compound_string(value, fun, get_value=get_value)
+            container[key] = value
+            stack.append((container, key, True, span))
+            stack.extend((nodes, i, False, None) for i in range(len(nodes)))
 
-    elif isinstance(value, tag_list):
-        return list_string(value, fun, get_value=get_value)
+        return root[0]
 
-    else:
-        return fun(get_value(value))
+    def intern(self, value):
+        """
+        Get the shared node of a compound or a list tag whose values are shared
 
+        :param value: The tag, a SNBTCompound or a list
+        :return: The shared tag
+        """
+        is_compound = isinstance(value, SNBTCompound)
+        nodes = value.nodes if is_compound else value
+        key = (value.names if is_compound else None, tuple(id(node) for node in nodes))
 
-json_values = re.compile(r'true|false|-?\d+(?:\.\d*)?')
+        node = self.nodes.get(key)
+        if node is not None:
+            return node
 
-place_quotes = make_place_around(u'"', exceptions=json_values)
+        keys_below = set(value.names) if is_compound else set()
+        for child in nodes:
+            if isinstance(child, FROZEN_TYPES):
+                keys_below.update(child.keys_below)
 
+        keys_below = frozenset(keys_below)
+        keys_below = self.key_sets.setdefault(keys_below, keys_below)
 
-def json_string(json):
+        if is_compound:
+            node = FrozenCompound(self.names.setdefault(value.names, value.names), nodes, keys_below)
+
+        else:
+            node = FrozenList(nodes, keys_below)
+
+        self.nodes[key] = node
+        return node
+
+    def parse_compound(self, nbt, index=0, return_size=False):
+        """
+        Parse a compound tag into shared nodes
+
+        :param nbt: The compound tag
+        :param index: The index at which the compound tag starts
+        :param return_size: If the size should be returned or not
+        :return: The parsed compound tag
+        :rtype: FrozenCompound
+        """
+        i, tag = lazy_parse_compound(nbt, index, return_size=True)
+        return (i, self.share(tag)) if return_size else self.share(tag)
+
+    def parse_list(self, nbt, index=0, return_size=True):
+        """
+        Parse a list tag into shared nodes
+
+        :param nbt: The list tag
+        :param index: The index at which the list tag starts
+        :param return_size: If the size should be returned or not
+        :return: The parsed list tag
+        :rtype: FrozenList
+        """
+        i, tag = lazy_parse_list(nbt, index, return_size=True)
+        return (i, self.share(tag)) if return_size else self.share(tag)
+
+
+# The parsing engines
+SNBTEngine = namedtuple('SNBTEngine', ['name', 'parse_compound', 'parse_list', 'parse_json', 'compound_string',
+                                       'json_string'])
+
+CHAR_ENGINE = u'char'
+SCANNER_ENGINE = u'scanner'
+ITERATIVE_ENGINE = u'iterative'
+LAZY_ENGINE = u'lazy'
+NODE_ENGINE = u'node'
+
+SNBT_ENGINES = {
+    CHAR_ENGINE: SNBTEngine(CHAR_ENGINE, parse_compound, parse_list, parse_json, compound_string, json_string),
+    SCANNER_ENGINE: SNBTEngine(SCANNER_ENGINE, scan_compound, scan_list, scan_json, compound_string, json_string),
+    ITERATIVE_ENGINE: SNBTEngine(ITERATIVE_ENGINE, iter_parse_compound, iter_parse_list, iter_parse_json,
+                                 stream_compound_string, stream_json_string),
+    LAZY_ENGINE: SNBTEngine(LAZY_ENGINE, lazy_parse_compound, lazy_parse_list, iter_parse_json,
+                            stream_compound_string, stream_json_string),
+    NODE_ENGINE: SNBTEngine(NODE_ENGINE, node_parse_compound, node_parse_list, iter_parse_json,
+                            stream_compound_string, stream_json_string),
+}
+
+DEFAULT_SNBT_ENGINE = ITERATIVE_ENGINE
+
+
+def get_snbt_engine(name=None):
     """
-    Build a new string in the format of strict json using the given json
+    Get a parsing engine by its name
 
-    >>> j = {u'text': u'This is some text', u'color': u'red'}
-    >>> result = parse_json(json_string(j))
-    >>> expected_result = {u'"text"': u'"This is some text"', u'"color"': u'"red"'}
-    >>> result == expected_result
+    >>> get_snbt_engine(CHAR_ENGINE).parse_compound is parse_compound
+    True
+    >>> get_snbt_engine().name == DEFAULT_SNBT_ENGINE
     True
+    >>> get_snbt_engine(u'unknown')
+    Traceback (most recent call last):
+        ...
+    ValueError: Unknown SNBT engine unknown
 
-    :param json: The json
-    :type json: object
-    :return: A string built using the give json
+    :param name: The name of the engine, None for the default engine
+    :type name: unicode
+    :rtype: SNBTEngine
     """
-    return value_string(json, fun=place_quotes)
+    try:
+        return SNBT_ENGINES[name or DEFAULT_SNBT_ENGINE]
+
+    except KeyError:
+        raise ValueError(u'Unknown SNBT engine {}'.format(name))
 
 
 def suffix(suf):
@@ -814,7 +3299,7 @@ NBT_SUFFIXES = {
     TAG_LONG: suffix(u'L'),
     TAG_FLOAT: suffix(u'f'),
     TAG_DOUBLE: suffix(u'd'),
-    TAG_STRING: lambda v: u'"' + v + u'"'
+    TAG_STRING: lambda v: u'"' + escape_string(v) + u'"'
 }
 
 
@@ -883,3 +3368,560 @@ def value_tag_string(tag):
 
     """
     return NBT_SUFFIXES.get(tag.tagID, lambda v: v)(unicode(tag.value))
+
+
+# Binary nbt
+# Read and write the nbt of the region files without pymclevel
+NBT_END = 0
+NBT_BYTE = 1
+NBT_SHORT = 2
+NBT_INT = 3
+NBT_LONG = 4
+NBT_FLOAT = 5
+NBT_DOUBLE = 6
+NBT_BYTE_ARRAY = 7
+NBT_STRING = 8
+NBT_LIST = 9
+NBT_COMPOUND = 10
+NBT_INT_ARRAY = 11
+NBT_LONG_ARRAY = 12
+
+NBT_STRUCTS = {
+    NBT_BYTE: struct.Struct('>b'),
+    NBT_SHORT: struct.Struct('>h'),
+    NBT_INT: struct.Struct('>i'),
+    NBT_LONG: struct.Struct('>q'),
+    NBT_FLOAT: struct.Struct('>f'),
+    NBT_DOUBLE: struct.Struct('>d'),
+}
+
+# The size of the values of the array tags, which are kept as raw big-endian bytes
+NBT_ARRAY_SIZES = {
+    NBT_BYTE_ARRAY: 1,
+    NBT_INT_ARRAY: 4,
+    NBT_LONG_ARRAY: 8,
+}
+
+NBT_LENGTH_STRUCT = struct.Struct('>i')
+NBT_STRING_LENGTH_STRUCT = struct.Struct('>H')
+
+# The 4 bytes sequences of utf-8 that modified utf-8 writes as two 3 bytes surrogates
+FOUR_BYTES_CHAR_PAT = LazyPattern(r'[\xf0-\xf7][\x80-\xbf]{3}')
+
+
+class BinaryTag(object):
+    """
+    A binary nbt tag whose value can be read and changed like the value of a pymclevel tag
+
+    The value of a compound is an OrderedDict of the tags it contains, the value of a list is a list of tags and
+    the value of an array is its raw big-endian bytes
+
+    The compounds, lists and arrays decoded from binary nbt keep the span of their raw payload and only decode it
+    the first time their value is read. The tags whose value was never read are encoded again by copying that span
+    as it is
+
+    >>> tag = BinaryTag(NBT_COMPOUND, OrderedDict([(u'id', BinaryTag(NBT_STRING, u'Control'))]))
+    >>> tag[u'id'].value
+    u'Control'
+    >>> u'Command' in tag
+    False
+    """
+
+    def __init__(self, type, value=None, list_type=NBT_END, raw=None):
+        """
+        :param type: The type of the tag
+        :type type: int
+        :param value: The value of the tag
+        :param list_type: The type of the tags in the list if the tag is a list
+        :type list_type: int
+        :param raw: The span of the raw payload of the tag, decoded when the value is read
+        :type raw: NBTSpan
+        """
+        self.type = type
+        self._value = value
+        self.list_type = list_type
+        self.raw = raw
+
+    @property
+    def value(self):
+        if self.raw is not None:
+            self._value, self.list_type = decode_nbt_payload(self.raw, self.type)
+            self.raw = None
+
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self.raw = None
+
+    @property
+    def decoded(self):
+        """
+        If the value of the tag was read or set
+        """
+        return self.raw is None
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __contains__(self, key):
+        return key in self.value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def get(self, key, default=None):
+        return self.value.get(key, default)
+
+    def __eq__(self, other):
+        return isinstance(other, BinaryTag) and (self.type, self.value, self.list_type) == \
+            (other.type, other.value, other.list_type)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return u'BinaryTag({}, {!r})'.format(self.type, self.value)
+
+
+def nbt_string_marker(value):
+    """
+    Build the bytes of a string in binary nbt, used to search some id in the nbt of a chunk
+
+    >>> nbt_string_marker(u'Control')
+    '\\x00\\x07Control'
+
+    :param value: The string
+    :type value: unicode
+    :rtype: str
+    """
+    value = encode_mutf8(value)
+    return NBT_STRING_LENGTH_STRUCT.pack(len(value)) + value
+
+
+def decode_mutf8(data):
+    """
+    Decode the modified utf-8 used by the nbt strings
+
+    >>> decode_mutf8('a\\xc0\\x80b')
+    u'a\\x00b'
+
+    :param data: The encoded string
+    :type data: str
+    :rtype: unicode
+    """
+    if '\xc0\x80' in data:
+        data = data.replace('\xc0\x80', '\x00')
+
+    return data.decode('utf-8')
+
+
+def encode_surrogates(match):
+    """
+    Write a 4 bytes utf-8 char as the two 3 bytes surrogates used by modified utf-8
+    """
+    b0, b1, b2, b3 = (ord(c) for c in match.group())
+    code = (((b0 & 0x07) << 18) | ((b1 & 0x3f) << 12) | ((b2 & 0x3f) << 6) | (b3 & 0x3f)) - 0x10000
+    result = []
+    for unit in (0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff)):
+        result.append(chr(0xe0 | (unit >> 12)) + chr(0x80 | ((unit >> 6) & 0x3f)) + chr(0x80 | (unit & 0x3f)))
+
+    return ''.join(result)
+
+
+def encode_mutf8(value):
+    """
+    Encode a string in the modified utf-8 used by the nbt strings
+
+    >>> encode_mutf8(u'a\\x00b')
+    'a\\xc0\\x80b'
+    >>> encode_mutf8(u'\\U0001f600')
+    '\\xed\\xa0\\xbd\\xed\\xb8\\x80'
+    >>> decode_mutf8(encode_mutf8(u'\\U0001f600')).encode('utf-8') == u'\\U0001f600'.encode('utf-8')
+    True
+
+    :param value: The string
+    :type value: unicode
+    :rtype: str
+    """
+    data = value.encode('utf-8')
+    if '\x00' in data:
+        data = data.replace('\x00', '\xc0\x80')
+
+    return FOUR_BYTES_CHAR_PAT.sub(encode_surrogates, data)
+
+
+# The span of the payload of a tag in binary nbt
+# ends remembers the end of the compounds and lists already skipped so that each one is walked only once
+NBTSpan = namedtuple('NBTSpan', ['data', 'start', 'end', 'ends'])
+
+
+def decode_nbt_string(data, index):
+    length = NBT_STRING_LENGTH_STRUCT.unpack_from(data, index)[0]
+    index += NBT_STRING_LENGTH_STRUCT.size
+    if index + length > len(data):
+        raise ValueError(u'Truncated nbt string at {}'.format(index))
+
+    return decode_mutf8(data[index:index + length].tobytes()), index + length
+
+
+def skip_nbt_payload(data, index, type, ends):
+    """
+    Find the end of the payload of a tag without decoding it
+
+    The strings, arrays and lists of numbers are skipped using their length prefix
+
+    :param data: The binary nbt
+    :type data: memoryview
+    :param index: The index of the payload
+    :type index: int
+    :param type: The type of the tag
+    :type type: int
+    :param ends: The ends of the compounds and lists already skipped by their index
+    :type ends: dict
+    :return: The index of the end of the payload
+    :rtype: int
+    """
+    if type == NBT_LIST or type == NBT_COMPOUND:
+        end = ends.get(index)
+        if end is None:
+            end = ends[index] = skip_nbt_container(data, index, type, ends)
+
+        return end
+
+    elif type in NBT_STRUCTS:
+        return index + NBT_STRUCTS[type].size
+
+    elif type == NBT_STRING:
+        return index + NBT_STRING_LENGTH_STRUCT.size + NBT_STRING_LENGTH_STRUCT.unpack_from(data, index)[0]
+
+    elif type in NBT_ARRAY_SIZES:
+        length = NBT_LENGTH_STRUCT.unpack_from(data, index)[0]
+        return index + NBT_LENGTH_STRUCT.size + max(length, 0) * NBT_ARRAY_SIZES[type]
+
+    raise ValueError(u'Unknown nbt tag type {}'.format(type))
+
+
+def skip_nbt_container(data, index, type, ends):
+    if type == NBT_LIST:
+        list_type = ord(data[index])
+        length = NBT_LENGTH_STRUCT.unpack_from(data, index + 1)[0]
+        index += 1 + NBT_LENGTH_STRUCT.size
+        if list_type in NBT_STRUCTS:
+            return index + max(length, 0) * NBT_STRUCTS[list_type].size
+
+        for _ in xrange(length):
+            index = skip_nbt_payload(data, index, list_type, ends)
+
+        return index
+
+    else:
+        while True:
+            tag_type = ord(data[index])
+            index += 1
+            if tag_type == NBT_END:
+                return index
+
+            index += NBT_STRING_LENGTH_STRUCT.size + NBT_STRING_LENGTH_STRUCT.unpack_from(data, index)[0]
+            index = skip_nbt_payload(data, index, tag_type, ends)
+
+
+def decode_nbt_tag(data, index, type, ends):
+    """
+    Decode a tag, the compounds, lists and arrays are only skipped and keep the span of their payload
+
+    :param data: The binary nbt
+    :type data: memoryview
+    :param index: The index of the payload
+    :type index: int
+    :param type: The type of the tag
+    :type type: int
+    :param ends: The ends of the compounds and lists already skipped by their index
+    :type ends: dict
+    :return: The tag and the index of the end of its payload
+    :rtype: (BinaryTag, int)
+    """
+    if type in NBT_STRUCTS:
+        value_struct = NBT_STRUCTS[type]
+        return BinaryTag(type, value_struct.unpack_from(data, index)[0]), index + value_struct.size
+
+    elif type == NBT_STRING:
+        value, index = decode_nbt_string(data, index)
+        return BinaryTag(type, value), index
+
+    end = skip_nbt_payload(data, index, type, ends)
+    if end > len(data):
+        raise ValueError(u'Truncated nbt tag at {}'.format(index))
+
+    return BinaryTag(type, raw=NBTSpan(data, index, end, ends)), end
+
+
+def decode_nbt_payload(span, type):
+    """
+    Decode the payload of a compound, a list or an array
+
+    :param span: The span of the raw payload
+    :type span: NBTSpan
+    :param type: The type of the tag
+    :type type: int
+    :return: The value of the tag and the type of its elements if it is a list
+    :rtype: (object, int)
+    """
+    data, index, ends = span.data, span.start, span.ends
+    try:
+        if type in NBT_ARRAY_SIZES:
+            return data[index + NBT_LENGTH_STRUCT.size:span.end].tobytes(), NBT_END
+
+        elif type == NBT_LIST:
+            list_type = ord(data[index])
+            length = NBT_LENGTH_STRUCT.unpack_from(data, index + 1)[0]
+            index += 1 + NBT_LENGTH_STRUCT.size
+            value = []
+            for _ in xrange(length):
+                tag, index = decode_nbt_tag(data, index, list_type, ends)
+                value.append(tag)
+
+            return value, list_type
+
+        elif type == NBT_COMPOUND:
+            value = OrderedDict()
+            while True:
+                tag_type = ord(data[index])
+                index += 1
+                if tag_type == NBT_END:
+                    return value, NBT_END
+
+                name, index = decode_nbt_string(data, index)
+                value[name], index = decode_nbt_tag(data, index, tag_type, ends)
+
+    except (struct.error, IndexError):
+        raise ValueError(u'Truncated nbt')
+
+    raise ValueError(u'Unknown nbt tag type {}'.format(type))
+
+
+def decode_nbt(data):
+    """
+    Decode binary nbt, like the decompressed nbt of a chunk
+
+    Nothing is copied or decoded until the value of a tag is read
+
+    >>> name, tag = decode_nbt('\\x0a\\x00\\x00\\x08\\x00\\x02id\\x00\\x07Control\\x00')
+    >>> name, tag[u'id'].value
+    (u'', u'Control')
+    >>> decode_nbt('\\x0a\\x00\\x00\\x08\\x00\\x02id\\x00\\x07Con')
+    Traceback (most recent call last):
+        ...
+    ValueError: Truncated nbt
+
+    :param data: The binary nbt
+    :type data: str
+    :return: The name of the root compound and the root compound
+    :rtype: (unicode, BinaryTag)
+    """
+    data = memoryview(data)
+    try:
+        if ord(data[0]) != NBT_COMPOUND:
+            raise ValueError(u'The root of the nbt must be a compound')
+
+        name, index = decode_nbt_string(data, 1)
+        tag, index = decode_nbt_tag(data, index, NBT_COMPOUND, {})
+
+    except (struct.error, IndexError):
+        raise ValueError(u'Truncated nbt')
+
+    return name, tag
+
+
+def encode_nbt_tag(tag, result):
+    """
+    Encode the payload of a tag, the payload of the tags whose value wasn't read is copied as it is
+
+    :param tag: The tag
+    :type tag: BinaryTag
+    :param result: The buffer the payload is written to
+    :type result: bytearray
+    """
+    if tag.raw is not None:
+        result += tag.raw.data[tag.raw.start:tag.raw.end]
+
+    elif tag.type in NBT_STRUCTS:
+        result += NBT_STRUCTS[tag.type].pack(tag.value)
+
+    elif tag.type == NBT_STRING:
+        value = encode_mutf8(tag.value)
+        result += NBT_STRING_LENGTH_STRUCT.pack(len(value))
+        result += value
+
+    elif tag.type in NBT_ARRAY_SIZES:
+        result += NBT_LENGTH_STRUCT.pack(len(tag.value) // NBT_ARRAY_SIZES[tag.type])
+        result += tag.value
+
+    elif tag.type == NBT_LIST:
+        result.append(tag.list_type)
+        result += NBT_LENGTH_STRUCT.pack(len(tag.value))
+        for item in tag.value:
+            encode_nbt_tag(item, result)
+
+    elif tag.type == NBT_COMPOUND:
+        for name, item in tag.value.iteritems():
+            name = encode_mutf8(name)
+            result.append(item.type)
+            result += NBT_STRING_LENGTH_STRUCT.pack(len(name))
+            result += name
+            encode_nbt_tag(item, result)
+
+        result.append(NBT_END)
+
+    else:
+        raise ValueError(u'Unknown nbt tag type {}'.format(tag.type))
+
+
+def encode_nbt(name, tag):
+    """
+    Encode a root compound to binary nbt
+
+    >>> data = '\\x0a\\x00\\x00\\x09\\x00\\x01l\\x03\\x00\\x00\\x00\\x02\\x00\\x00\\x00\\x01\\xff\\xff\\xff\\xff\\x00'
+    >>> name, tag = decode_nbt(data)
+    >>> encode_nbt(name, tag) == data
+    True
+    >>> tag[u'l'].decoded
+    False
+    >>> tag[u'l'].value[1].value = 2
+    >>> encode_nbt(name, tag) == data.replace('\\xff\\xff\\xff\\xff', '\\x00\\x00\\x00\\x02')
+    True
+
+    :param name: The name of the root compound
+    :type name: unicode
+    :param tag: The root compound
+    :type tag: BinaryTag
+    :rtype: bytearray
+    """
+    name = encode_mutf8(name)
+    result = bytearray()
+    result.append(NBT_COMPOUND)
+    result += NBT_STRING_LENGTH_STRUCT.pack(len(name))
+    result += name
+    encode_nbt_tag(tag, result)
+    return result
+
+
+# Anvil region files
+REGION_SECTOR_SIZE = 4096
+REGION_SIZE = 32
+REGION_CHUNKS = REGION_SIZE * REGION_SIZE
+REGION_TABLE_STRUCT = struct.Struct('>{}I'.format(REGION_CHUNKS))
+REGION_ENTRY_STRUCT = struct.Struct('>I')
+CHUNK_HEADER_STRUCT = struct.Struct('>ib')
+
+GZIP_COMPRESSION = 1
+ZLIB_COMPRESSION = 2
+NO_COMPRESSION = 3
+
+
+class RegionFile(object):
+    """
+    An Anvil region file (.mca) read through a memory map
+
+    The 8 KiB header holds the offset table and the timestamps of the 32x32 chunks of the region
+    """
+
+    def __init__(self, path, writable=False):
+        """
+        :param path: The path of the region file
+        :param writable: If the chunks can be written
+        :type writable: bool
+        """
+        self.path = path
+        self.file = open(path, 'r+b' if writable else 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+        except (ValueError, mmap.error):
+            self.file.close()
+            raise ValueError(u'Empty region file {}'.format(path))
+
+        if len(self.map) < 2 * REGION_SECTOR_SIZE:
+            self.close()
+            raise ValueError(u'Truncated region file {}'.format(path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    @staticmethod
+    def chunk_index(x, z):
+        return (x % REGION_SIZE) + (z % REGION_SIZE) * REGION_SIZE
+
+    def chunks(self):
+        """
+        :return: The region coordinates of the chunks stored in the file
+        :rtype: list
+        """
+        table = REGION_TABLE_STRUCT.unpack_from(self.map, 0)
+        return [(i % REGION_SIZE, i // REGION_SIZE) for i, location in enumerate(table) if location]
+
+    def read_chunk(self, x, z):
+        """
+        Read and decompress a chunk
+
+        :param x: The x coordinate of the chunk in the region
+        :param z: The z coordinate of the chunk in the region
+        :return: The binary nbt of the chunk or None if it isn't stored in the file
+        :rtype: str
+        """
+        location = REGION_ENTRY_STRUCT.unpack_from(self.map, 4 * self.chunk_index(x, z))[0]
+        if not location:
+            return None
+
+        offset = (location >> 8) * REGION_SECTOR_SIZE
+        length, compression = CHUNK_HEADER_STRUCT.unpack_from(self.map, offset)
+        data = self.map[offset + CHUNK_HEADER_STRUCT.size:offset + 4 + length]
+
+        if compression == ZLIB_COMPRESSION:
+            return zlib.decompress(data)
+
+        elif compression == GZIP_COMPRESSION:
+            return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+        elif compression == NO_COMPRESSION:
+            return data
+
+        raise ValueError(u'Unknown compression {} of the chunk {} {} of {}'.format(compression, x, z, self.path))
+
+    def write_chunk(self, x, z, data):
+        """
+        Compress and write a chunk in its sectors if it still fits in them, at the end of the file otherwise
+
+        :param x: The x coordinate of the chunk in the region
+        :param z: The z coordinate of the chunk in the region
+        :param data: The binary nbt of the chunk
+        :type data: str
+        """
+        payload = zlib.compress(buffer(data))
+        chunk = CHUNK_HEADER_STRUCT.pack(len(payload) + 1, ZLIB_COMPRESSION) + payload
+        sectors = (len(chunk) + REGION_SECTOR_SIZE - 1) // REGION_SECTOR_SIZE
+        if sectors > 0xff:
+            raise ValueError(u'The chunk {} {} is too big for {}'.format(x, z, self.path))
+
+        index = self.chunk_index(x, z)
+        location = REGION_ENTRY_STRUCT.unpack_from(self.map, 4 * index)[0]
+        offset = location >> 8
+        if not location or sectors > location & 0xff:
+            offset = (len(self.map) + REGION_SECTOR_SIZE - 1) // REGION_SECTOR_SIZE
+            self.map.resize((offset + sectors) * REGION_SECTOR_SIZE)
+
+        start = offset * REGION_SECTOR_SIZE
+        self.map[start:start + len(chunk)] = chunk
+        REGION_ENTRY_STRUCT.pack_into(self.map, 4 * index, (offset << 8) | sectors)
+        REGION_ENTRY_STRUCT.pack_into(self.map, REGION_SECTOR_SIZE + 4 * index, int(time.time()))